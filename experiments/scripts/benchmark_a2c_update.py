@@ -0,0 +1,43 @@
+from time import perf_counter
+
+import torch
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+
+from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.trainer import A2CTrainer
+
+ENV_NAMES = ['CartPole-v0', 'LunarLander-v2']
+VEC_ENV_CLASSES = [DummyVecEnv, SubprocVecEnv]
+SEED = 2021
+NUM_ENVS = 5
+N_STEPS = 5
+NUM_UPDATES = 2000
+
+
+def updates_per_s(env_name: str, vec_env_cls) -> float:
+    torch.manual_seed(SEED)
+    envs = make_vec_env(env_id=env_name, seed=SEED, n_envs=NUM_ENVS, vec_env_cls=vec_env_cls)
+    policy = PolicyA2C(envs.observation_space.shape, envs.action_space)
+    trainer = A2CTrainer(
+        policy=policy,
+        vec_envs=envs,
+        n_steps=N_STEPS,
+        use_gpu=False,
+        log_interval=NUM_UPDATES * 2,
+    )
+
+    start = perf_counter()
+    trainer.train(num_frames=NUM_UPDATES * N_STEPS * NUM_ENVS, stop_time=None)
+    duration = perf_counter() - start
+    envs.close()
+    return NUM_UPDATES / duration
+
+
+if __name__ == '__main__':
+    torch.set_num_threads(1)
+    print(f'{NUM_ENVS} envs, {N_STEPS} steps per update:')
+    for env_name in ENV_NAMES:
+        for vec_env_cls in VEC_ENV_CLASSES:
+            rate = updates_per_s(env_name, vec_env_cls)
+            print(f'  {env_name}, {vec_env_cls.__name__}: {rate:.0f} updates/s')
@@ -0,0 +1,53 @@
+import multiprocessing
+
+import torch
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.data_parallel import (
+    DataParallelA2CTrainer,
+    train_data_parallel,
+)
+
+ENV_NAME = 'LunarLander-v2'
+SEED = 2021
+NUM_RANKS = [1, 2, 4, 8, 16, 32]
+ENVS_PER_RANK = 5
+N_STEPS = 5
+FRAMES_PER_RANK = 200_000
+
+
+def make_trainer(rank: int, num_ranks: int) -> DataParallelA2CTrainer:
+    # environments step in the process of their rank, which takes a core
+    torch.manual_seed(SEED)
+    envs = make_vec_env(
+        env_id=ENV_NAME,
+        seed=SEED,
+        n_envs=ENVS_PER_RANK,
+        start_index=rank * ENVS_PER_RANK,
+        vec_env_cls=DummyVecEnv,
+    )
+    policy = PolicyA2C(envs.observation_space.shape, envs.action_space)
+    return DataParallelA2CTrainer(
+        policy=policy,
+        vec_envs=envs,
+        n_steps=N_STEPS,
+        use_gpu=False,
+        log_interval=10 ** 9,
+    )
+
+
+if __name__ == '__main__':
+    print(f'{ENV_NAME}, {ENVS_PER_RANK} envs per rank, frames per second:')
+    reference = None
+    for num_ranks in NUM_RANKS:
+        if num_ranks > multiprocessing.cpu_count():
+            break
+
+        num_frames, duration = train_data_parallel(
+            make_trainer, num_ranks, num_frames=FRAMES_PER_RANK * num_ranks
+        )
+        rate = num_frames / duration
+        reference = reference or rate
+        print(f'  {num_ranks} ranks: {rate:,.0f} ({rate / reference:.1f}x)')
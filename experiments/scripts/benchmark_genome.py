@@ -0,0 +1,71 @@
+import pickle
+import random
+import tracemalloc
+from time import perf_counter
+
+import neat
+import numpy as np
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.compact_genome import CompactGenome
+from neat_improved.neat.genome_encoding import decode_genome, encode_genome
+
+ENV_NAME = 'BipedalWalker-v3'
+SEED = 2021
+POP_SIZE = 1000
+NUM_GENERATIONS = 5
+
+
+def create_config(genome_type) -> neat.Config:
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    config.genome_type = genome_type
+    config.pop_size = POP_SIZE
+    return config
+
+
+def benchmark(genome_type):
+    random.seed(SEED)
+    np.random.seed(SEED)
+    config = create_config(genome_type)
+
+    tracemalloc.start()
+    population = neat.Population(config)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    reproduction_time = 0.0
+    for _ in range(NUM_GENERATIONS):
+        for genome in population.population.values():
+            genome.fitness = random.random()
+
+        start = perf_counter()
+        population.population = population.reproduction.reproduce(
+            config, population.species, config.pop_size, population.generation
+        )
+        reproduction_time += perf_counter() - start
+        population.species.speciate(config, population.population, population.generation)
+        population.generation += 1
+
+    genomes = list(population.population.values())
+    pickled = np.mean([len(pickle.dumps(genome)) for genome in genomes])
+    genome_config = config.genome_config
+    start = perf_counter()
+    for genome in genomes:
+        decode_genome(encode_genome(genome, genome_config), genome_type, genome_config)
+    encoding_time = perf_counter() - start
+
+    print(f'{genome_type.__name__}:')
+    print(f'  reproduction {reproduction_time / NUM_GENERATIONS:.3f} s/generation')
+    print(f'  {memory / POP_SIZE / 1024:.1f} KiB/genome, {pickled:,.0f} pickled bytes/genome')
+    print(f'  encode + decode {encoding_time / len(genomes) * 1e6:.0f} us/genome')
+
+
+if __name__ == '__main__':
+    for genome_type in (neat.DefaultGenome, CompactGenome):
+        benchmark(genome_type)
@@ -0,0 +1,62 @@
+import multiprocessing
+from time import perf_counter
+
+import gym
+import torch
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import VecEnv
+
+from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.impala import ImpalaTrainer
+
+ENV_NAME = 'LunarLander-v2'
+SEED = 2021
+NUM_ACTORS = [1, 2, 4, 8, 16, 32]
+ENVS_PER_ACTOR = 4
+N_STEPS = 20
+STOP_TIME = 30
+
+
+def make_envs(actor_index: int) -> VecEnv:
+    return make_vec_env(
+        env_id=ENV_NAME,
+        seed=SEED,
+        n_envs=ENVS_PER_ACTOR,
+        start_index=actor_index * ENVS_PER_ACTOR,
+    )
+
+
+def frames_per_s(num_actors: int) -> float:
+    torch.manual_seed(SEED)
+    env = gym.make(ENV_NAME)
+    policy = PolicyA2C(env.observation_space.shape, env.action_space)
+    trainer = ImpalaTrainer(
+        policy=policy,
+        make_envs=make_envs,
+        observation_space=env.observation_space,
+        action_space=env.action_space,
+        num_actors=num_actors,
+        n_envs=ENVS_PER_ACTOR,
+        n_steps=N_STEPS,
+        batch_size=min(num_actors, 8),
+        use_gpu=False,
+        log_interval=10 ** 9,
+    )
+
+    start = perf_counter()
+    trainer.train(num_frames=None, stop_time=STOP_TIME)
+    return trainer.num_frames / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    torch.set_num_threads(1)
+    print(f'{ENV_NAME}, {ENVS_PER_ACTOR} envs per actor, frames per second:')
+    reference = None
+    for num_actors in NUM_ACTORS:
+        if num_actors > 1 and num_actors >= multiprocessing.cpu_count():
+            # the learner needs a core of its own, the single actor is the baseline
+            break
+
+        rate = frames_per_s(num_actors)
+        reference = reference or rate
+        print(f'  {num_actors} actors: {rate:,.0f} ({rate / reference:.1f}x)')
@@ -0,0 +1,66 @@
+import random
+from time import perf_counter
+from typing import List
+
+import neat
+import numpy as np
+from neat.nn import FeedForwardNetwork
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.network import CompiledNetwork
+
+ENV_NAME = 'BipedalWalker-v3'
+SEED = 2021
+NUM_GENOMES = 20
+NUM_MUTATIONS = 300
+NUM_ACTIVATIONS = 2000
+
+
+def create_genomes(config: neat.Config, num_genomes: int, num_mutations: int) -> List:
+    genomes = []
+    for key in range(num_genomes):
+        genome = config.genome_type(key)
+        genome.configure_new(config.genome_config)
+        for _ in range(num_mutations):
+            genome.mutate(config.genome_config)
+        genomes.append(genome)
+
+    return genomes
+
+
+def activations_per_second(networks, observations) -> float:
+    start = perf_counter()
+    for network in networks:
+        for observation in observations:
+            network.activate(observation)
+
+    return len(networks) * len(observations) / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    genomes = create_genomes(config, NUM_GENOMES, NUM_MUTATIONS)
+    observations = np.random.uniform(-2, 2, (NUM_ACTIVATIONS, config.genome_config.num_inputs))
+
+    reference = [FeedForwardNetwork.create(genome, config) for genome in genomes]
+    compiled = [CompiledNetwork.create(genome, config) for genome in genomes]
+
+    for ref, comp in zip(reference, compiled):
+        for observation in observations[:100]:
+            np.testing.assert_allclose(comp.activate(observation), ref.activate(observation))
+
+    num_connections = np.mean([len(g.connections) for g in genomes])
+    num_nodes = np.mean([len(g.nodes) for g in genomes])
+    print(f'{ENV_NAME}: {num_nodes:.1f} nodes, {num_connections:.1f} connections on average')
+
+    for name, networks in (('FeedForwardNetwork', reference), ('CompiledNetwork', compiled)):
+        print(f'{name}: {activations_per_second(networks, observations):,.0f} activations/s')
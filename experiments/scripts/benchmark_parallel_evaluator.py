@@ -0,0 +1,69 @@
+import multiprocessing
+import pickle
+import random
+from multiprocessing import Pool
+from time import perf_counter
+
+import neat
+import numpy as np
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.genome_encoding import encode_genome
+from neat_improved.neat.parallel import EvaluationPool
+
+ENV_NAME = 'BipedalWalker-v3'
+SEED = 2021
+NUM_WORKERS = multiprocessing.cpu_count()
+NUM_GENERATIONS = 20
+
+
+class NullEvaluator(GymEvaluator):
+    """Does no work, so that only the dispatching overhead is measured."""
+
+    num_frames = 0
+
+    def evaluate(self, genome, config):
+        return 0.0, 0
+
+
+def report(name: str, bytes_per_task: float, num_tasks: int, duration: float):
+    print(f'{name}: {bytes_per_task:,.0f} bytes/task, {num_tasks / duration:,.0f} tasks/s')
+
+
+if __name__ == '__main__':
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    population = neat.Population(config).population
+    genomes = list(population.values())
+    evaluator = NullEvaluator(ENV_NAME)
+    num_tasks = len(genomes) * NUM_GENERATIONS
+
+    # before: the bound evaluator and the whole config are pickled with every genome
+    payload = np.mean([len(pickle.dumps((evaluator.evaluate, (g, config)))) for g in genomes])
+    with Pool(NUM_WORKERS) as pool:
+        start = perf_counter()
+        for _ in range(NUM_GENERATIONS):
+            jobs = [pool.apply_async(evaluator.evaluate, (g, config)) for g in genomes]
+            [job.get() for job in jobs]
+        report('Pool.apply_async', payload, num_tasks, perf_counter() - start)
+
+    # after: the evaluator and the config are installed once, tasks carry encoded genomes
+    payload = np.mean(
+        [len(pickle.dumps((1, [encode_genome(g, config.genome_config)]))) for g in genomes]
+    )
+    with EvaluationPool(NUM_WORKERS) as pool:
+        pool.install(evaluator, config)
+        start = perf_counter()
+        for _ in range(NUM_GENERATIONS):
+            jobs = [pool.submit([g]) for g in genomes]
+            [job.get() for job in jobs]
+        report('EvaluationPool', payload, num_tasks, perf_counter() - start)
@@ -0,0 +1,56 @@
+from time import perf_counter
+
+import torch
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.trainer import A2CTrainer
+from neat_improved.rl.vec_env import PipelinedVecEnv, SharedMemoryVecEnv
+
+ENV_NAME = 'LunarLander-v2'
+SEED = 2021
+NUM_ENVS = 16
+N_STEPS = 5
+NUM_UPDATES = 1000
+
+
+def frames_per_s(vec_env_cls, pipelined: bool) -> float:
+    torch.manual_seed(SEED)
+    group_sizes = (NUM_ENVS // 2, NUM_ENVS - NUM_ENVS // 2) if pipelined else (NUM_ENVS,)
+    groups = [
+        make_vec_env(
+            env_id=ENV_NAME,
+            seed=SEED,
+            n_envs=n_envs,
+            start_index=sum(group_sizes[:i]),
+            vec_env_cls=vec_env_cls,
+        )
+        for i, n_envs in enumerate(group_sizes)
+    ]
+    envs = PipelinedVecEnv(groups) if pipelined else groups[0]
+    policy = PolicyA2C(envs.observation_space.shape, envs.action_space)
+    trainer = A2CTrainer(
+        policy=policy,
+        vec_envs=envs,
+        n_steps=N_STEPS,
+        use_gpu=False,
+        log_interval=NUM_UPDATES * 2,
+    )
+
+    num_frames = NUM_UPDATES * N_STEPS * NUM_ENVS
+    start = perf_counter()
+    trainer.train(num_frames=num_frames, stop_time=None)
+    duration = perf_counter() - start
+    envs.close()
+    return num_frames / duration
+
+
+if __name__ == '__main__':
+    torch.set_num_threads(1)
+    print(f'{ENV_NAME}, {NUM_ENVS} envs, {N_STEPS} steps per update, frames per second:')
+    for vec_env_cls in (SubprocVecEnv, SharedMemoryVecEnv):
+        for pipelined in (False, True):
+            rate = frames_per_s(vec_env_cls, pipelined)
+            mode = 'pipelined' if pipelined else 'sequential'
+            print(f'  {vec_env_cls.__name__}, {mode}: {rate:,.0f}')
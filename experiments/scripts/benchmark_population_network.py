@@ -0,0 +1,86 @@
+import random
+from time import perf_counter
+
+import neat
+import numpy as np
+import torch
+
+from experiments.scripts.benchmark_network import create_genomes
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.network import CompiledNetwork, PopulationNetwork
+from neat_improved.neat.torch_network import TorchPopulationNetwork
+
+ENV_NAME = 'LunarLander-v2'
+SEED = 2021
+POPULATION_SIZES = (1, 2, 5, 10, 20, 50, 100, 200, 400)
+NUM_MUTATIONS = 50
+NUM_STEPS = 200
+
+
+def seconds_per_step(activate, observations) -> float:
+    start = perf_counter()
+    for observation in observations:
+        activate(observation)
+
+    return (perf_counter() - start) / len(observations)
+
+
+def per_genome(networks):
+    def activate(observation):
+        return np.stack([network.activate(obs) for network, obs in zip(networks, observation)])
+
+    return activate
+
+
+if __name__ == '__main__':
+    random.seed(SEED)
+    np.random.seed(SEED)
+    # like in the evaluation workers, one process per core
+    torch.set_num_threads(1)
+
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    genomes = create_genomes(config, max(POPULATION_SIZES), NUM_MUTATIONS)
+    compiled = [CompiledNetwork.create(genome, config) for genome in genomes]
+    num_inputs = config.genome_config.num_inputs
+
+    engines = {
+        'PopulationNetwork': PopulationNetwork.create,
+        'TorchPopulationNetwork (sparse)': TorchPopulationNetwork.create,
+        'TorchPopulationNetwork (padded)': lambda n: TorchPopulationNetwork.create(n, 'padded'),
+    }
+
+    observations = np.random.uniform(-2, 2, (10, len(compiled), num_inputs))
+    for name, create in engines.items():
+        engine = create(compiled)
+        for observation in observations:
+            expected = per_genome(compiled)(observation)
+            np.testing.assert_allclose(engine.activate(observation), expected, rtol=1e-9)
+
+    # networks of different depths end up in the same population network
+    depths = [len({group.layer for group in network.groups}) for network in compiled]
+    print(f'{ENV_NAME}: {min(depths)}-{max(depths)} layers, {NUM_STEPS} steps per measurement')
+    print('networks'.rjust(8) + ''.join(name.rjust(34) for name in ('per-genome', *engines)))
+
+    crossover = {}
+    for size in POPULATION_SIZES:
+        networks = compiled[:size]
+        observations = np.random.uniform(-2, 2, (NUM_STEPS, size, num_inputs))
+        reference = seconds_per_step(per_genome(networks), observations)
+        timings = [
+            seconds_per_step(create(networks).activate, observations) for create in engines.values()
+        ]
+        for name, seconds in zip(engines, timings):
+            if seconds < reference:
+                crossover.setdefault(name, size)
+
+        columns = [f'{seconds * 1e6:,.0f} us/step'.rjust(34) for seconds in (reference, *timings)]
+        print(f'{size:8d}' + ''.join(columns))
+
+    for name in engines:
+        print(f'{name} beats per-genome evaluation from {crossover.get(name, "no")} networks on')
@@ -0,0 +1,65 @@
+import random
+
+import neat
+import numpy as np
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.evaluator import MultipleRunGymEvaluator
+from neat_improved.neat.racing import RacingEvaluator
+
+ENV_NAME = 'LunarLander-v2'
+SEED = 2021
+RUNS_PER_NETWORK = 5
+MAX_STEPS = 1000
+
+
+def rank_correlation(a, b) -> float:
+    ranks_a = np.argsort(np.argsort(a))
+    ranks_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def evaluate_fully(genomes, config):
+    evaluator = MultipleRunGymEvaluator(
+        ENV_NAME,
+        runs_per_network=RUNS_PER_NETWORK,
+        max_steps=MAX_STEPS,
+    )
+    return evaluator.evaluate_many(genomes, config)
+
+
+if __name__ == '__main__':
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    population = neat.Population(config)
+    genomes = list(population.population.values())
+
+    reference = evaluate_fully(genomes, config)
+    # a second full evaluation shows how stable rankings are under the environment's noise
+    repeated = evaluate_fully(genomes, config)
+
+    single_run = MultipleRunGymEvaluator(ENV_NAME, max_steps=MAX_STEPS)
+    evaluate_round = lambda round_genomes: single_run.evaluate_many(round_genomes, config)
+    species_ids = population.species.genome_to_species
+    racing = RacingEvaluator(RUNS_PER_NETWORK, num_elites=config.reproduction_config.elitism)
+    # the first race only estimates the noise of the environment
+    racing.evaluate(genomes, species_ids, evaluate_round)
+    racing.take_stats()
+    raced = racing.evaluate(genomes, species_ids, evaluate_round)
+    stats = racing.take_stats()
+
+    reference_fitness = [fitness for fitness, _ in reference]
+    for name, results in (('full evaluation', repeated), ('racing', raced)):
+        frames = sum(num_frames for _, num_frames in results)
+        correlation = rank_correlation(reference_fitness, [fitness for fitness, _ in results])
+        print(f'{name}: {frames:,} frames, rank correlation with reference: {correlation:.3f}')
+
+    print(f'racing: {stats.num_episodes} episodes, {stats.num_episodes_saved} saved')
@@ -0,0 +1,85 @@
+import random
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import neat
+import numpy as np
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.log_writer import CSV, NPZ
+from neat_improved.neat.reporters import BufferedFileReporter, FileReporter, load_log
+
+ENV_NAME = 'BipedalWalker-v3'
+SEED = 2021
+POP_SIZE = 1000
+NUM_GENERATIONS = 20
+
+
+class FrameCounter:
+    # the reporters only read the frame count of the evaluator
+    num_frames = 0
+
+
+def run(create_reporter, directory: Path) -> float:
+    random.seed(SEED)
+    np.random.seed(SEED)
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    config.pop_size = POP_SIZE
+
+    evaluator = FrameCounter()
+    reporter = create_reporter(directory, evaluator)
+    post_evaluate = reporter.post_evaluate
+    seconds = 0.0
+
+    def timed_post_evaluate(*args):
+        nonlocal seconds
+        start = perf_counter()
+        post_evaluate(*args)
+        seconds += perf_counter() - start
+
+    reporter.post_evaluate = timed_post_evaluate
+
+    def random_fitness(genomes, config):
+        for _, genome in genomes:
+            genome.fitness = random.random()
+            evaluator.num_frames += 1000
+
+    population = neat.Population(config)
+    population.add_reporter(reporter)
+    population.run(random_fitness, NUM_GENERATIONS)
+    if hasattr(reporter, 'close'):
+        reporter.close()
+
+    return seconds / NUM_GENERATIONS
+
+
+if __name__ == '__main__':
+    reporters = {
+        'FileReporter': FileReporter,
+        'BufferedFileReporter (csv)': lambda d, e: BufferedFileReporter(d, e, CSV),
+        'BufferedFileReporter (npz)': lambda d, e: BufferedFileReporter(d, e, NPZ),
+    }
+
+    print(f'{POP_SIZE} genomes, {NUM_GENERATIONS} generations, time in the training loop:')
+    logs = {}
+    with tempfile.TemporaryDirectory() as root:
+        for name, create_reporter in reporters.items():
+            directory = Path(root) / name
+            seconds = run(create_reporter, directory)
+            print(f'  {name}: {seconds * 1e3:.2f} ms/generation')
+            logs[name] = load_log(directory, 'population')
+
+    reference = logs.pop('FileReporter')
+    for name, log in logs.items():
+        for field, values in reference.items():
+            # only the timestamps differ
+            if field != 'time_in_s':
+                np.testing.assert_array_equal(log[field], values, err_msg=f'{name} {field}')
+    print('Buffered logs are identical to the FileReporter logs')
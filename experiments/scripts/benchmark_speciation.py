@@ -0,0 +1,81 @@
+import random
+from time import perf_counter
+
+import neat
+import numpy as np
+
+from neat_improved.neat import NEAT_CONFIGS
+from neat_improved.neat.speciation import VectorizedSpeciesSet
+
+ENV_NAME = 'BipedalWalker-v3'
+SEED = 2021
+POP_SIZE = 1000
+NUM_GENERATIONS = 10
+# lower than in the config, the reference cost grows with the number of species
+COMPATIBILITY_THRESHOLD = 1.5
+
+
+class SpeciationRecorder(neat.reporting.BaseReporter):
+    def __init__(self, population: neat.Population):
+        self.population = population
+        self.species = []
+        self.messages = []
+        self.seconds = 0.0
+
+    def info(self, msg):
+        self.messages.append(msg)
+
+    def start_generation(self, generation):
+        species_set = self.population.species
+        representatives = {sid: s.representative.key for sid, s in species_set.species.items()}
+        self.species.append((species_set.genome_to_species, representatives))
+
+
+def random_fitness(genomes, config):
+    # only speciation matters here
+    for _, genome in genomes:
+        genome.fitness = random.random()
+
+
+def evolve(species_set_type) -> SpeciationRecorder:
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+    config = neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        str(NEAT_CONFIGS[ENV_NAME]),
+    )
+    config.pop_size = POP_SIZE
+    config.species_set_type = species_set_type
+    config.species_set_config.compatibility_threshold = COMPATIBILITY_THRESHOLD
+
+    population = neat.Population(config)
+    recorder = SpeciationRecorder(population)
+    population.add_reporter(recorder)
+
+    speciate = population.species.speciate
+
+    def timed_speciate(*args):
+        start = perf_counter()
+        speciate(*args)
+        recorder.seconds += perf_counter() - start
+
+    population.species.speciate = timed_speciate
+    population.run(random_fitness, NUM_GENERATIONS)
+    return recorder
+
+
+if __name__ == '__main__':
+    reference = evolve(neat.DefaultSpeciesSet)
+    vectorized = evolve(VectorizedSpeciesSet)
+
+    assert vectorized.species == reference.species, 'speciation differs from the reference'
+    assert vectorized.messages == reference.messages
+
+    num_species = len(reference.species[-1][1])
+    print(f'{ENV_NAME}: {POP_SIZE} genomes, {num_species} species, identical speciation')
+    for name, recorder in (('DefaultSpeciesSet', reference), ('VectorizedSpeciesSet', vectorized)):
+        print(f'{name}: {recorder.seconds / NUM_GENERATIONS:.3f} s/generation')
@@ -0,0 +1,53 @@
+import multiprocessing
+from time import perf_counter
+
+import numpy as np
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+
+from neat_improved.rl.vec_env import SharedMemoryVecEnv
+
+ENV_NAMES = ['LunarLander-v2', 'BipedalWalker-v3']
+SEED = 2021
+NUM_ENVS = 16
+NUM_WORKERS = multiprocessing.cpu_count()
+NUM_STEPS = 2000
+
+
+def steps_per_s(env_name: str, vec_env_cls, **vec_env_kwargs) -> float:
+    envs = make_vec_env(
+        env_id=env_name,
+        seed=SEED,
+        n_envs=NUM_ENVS,
+        vec_env_cls=vec_env_cls,
+        vec_env_kwargs=vec_env_kwargs,
+    )
+    # actions are sampled up front, only stepping is measured
+    actions = [
+        np.stack([envs.action_space.sample() for _ in range(NUM_ENVS)]) for _ in range(NUM_STEPS)
+    ]
+    envs.reset()
+
+    start = perf_counter()
+    for step_actions in actions:
+        envs.step(step_actions)
+    duration = perf_counter() - start
+    envs.close()
+    return NUM_STEPS * NUM_ENVS / duration
+
+
+if __name__ == '__main__':
+    vec_envs = {
+        'DummyVecEnv': (DummyVecEnv, {}),
+        'SubprocVecEnv': (SubprocVecEnv, {}),
+        f'SharedMemoryVecEnv ({NUM_WORKERS} workers)': (
+            SharedMemoryVecEnv,
+            {'num_workers': NUM_WORKERS},
+        ),
+    }
+
+    print(f'{NUM_ENVS} envs, environment steps per second:')
+    for env_name in ENV_NAMES:
+        for name, (vec_env_cls, vec_env_kwargs) in vec_envs.items():
+            rate = steps_per_s(env_name, vec_env_cls, **vec_env_kwargs)
+            print(f'  {env_name}, {name}: {rate:,.0f}')
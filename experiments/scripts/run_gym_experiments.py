@@ -1,13 +1,15 @@
 import multiprocessing
 import random
 from dataclasses import dataclass
-from typing import Union
+from typing import Optional, Union
 
 import numpy as np
 import torch
 
 from experiments.utils import run_neat, run_actor_critic
 from neat_improved import PROJECT_PATH
+from neat_improved.neat.distributed import DistributedEvaluationPool
+from neat_improved.neat.parallel import EvaluationPool
 
 RUN_ACTOR_CRITIC = True
 RUN_NEAT = True
@@ -32,6 +34,14 @@ enviroments = (
 USE_GPU = True
 NUM_GENERATIONS = None
 NUM_WORKERS = multiprocessing.cpu_count()
+# e.g. ('127.0.0.1', 5000) to evaluate NEAT on `neat-worker` processes
+# (`NEAT_AUTHKEY=KEY python -m neat_improved.neat.worker HOST:5000`) instead of local workers,
+# with the key of $NEAT_AUTHKEY or the one printed by the pool. Bind to the address of another
+# interface only on a trusted network, the workers and the pool run what the other side sends
+BROKER_ADDRESS = None
+# NEAT runs are checkpointed every CHECKPOINT_INTERVAL generations into `<run dir>/checkpoint`,
+# pass the run directory as `resume_dir` of `run_neat` to continue a preempted run
+CHECKPOINT_INTERVAL = 10
 
 
 @dataclass
@@ -55,6 +65,7 @@ def run_experiment(
     env_name: str,
     experiment: Union[NEATExperimentConfig, A2CExperimentConfig],
     seed: int,
+    pool: Optional[Union[EvaluationPool, DistributedEvaluationPool]] = None,
 ):
     np.random.seed(seed)
     torch.random.manual_seed(seed)
@@ -69,6 +80,8 @@ def run_experiment(
             logging_dir=LOGGING_DIR / experiment.name,
             runs_per_network=experiment.runs_per_network,
             seed=seed,
+            pool=pool,
+            checkpoint_interval=CHECKPOINT_INTERVAL,
         )
     elif isinstance(experiment, A2CExperimentConfig):
         run_actor_critic(
@@ -97,7 +110,14 @@ experiment_configs = (
 )
 
 if __name__ == '__main__':
-    for config in experiment_configs:
-        for env_name in enviroments:
-            for repeat in range(N_REPEATS):
-                run_experiment(env_name, config, seed=SEED + repeat)
+    # a single warm pool of NEAT workers is shared by all runs
+    if BROKER_ADDRESS is not None:
+        neat_pool = DistributedEvaluationPool(BROKER_ADDRESS)
+    else:
+        neat_pool = EvaluationPool(NUM_WORKERS)
+
+    with neat_pool as pool:
+        for config in experiment_configs:
+            for env_name in enviroments:
+                for repeat in range(N_REPEATS):
+                    run_experiment(env_name, config, seed=SEED + repeat, pool=pool)
@@ -5,14 +5,15 @@ import gym
 import matplotlib.pyplot as plt
 import neat
 from matplotlib import animation
-from neat.nn import FeedForwardNetwork
 
 from experiments.utils import render_result
 from neat_improved import NEAT_CONFIGS_PATH
+from neat_improved.neat.network import CompiledNetwork
 
 ENV_NAME = 'BipedalWalker-v3'
 LOAD_PATH = Path(f'./{ENV_NAME}.pkl')
 CONFIG_PATH = NEAT_CONFIGS_PATH / 'config-bipedal-walker-v3'
+NETWORK_TYPE = CompiledNetwork  # or neat.nn.FeedForwardNetwork
 
 
 config = neat.Config(
@@ -27,7 +28,7 @@ config = neat.Config(
 with LOAD_PATH.open('rb') as file:
     genome = pickle.load(file)
 
-network = FeedForwardNetwork.create(genome, config)
+network = NETWORK_TYPE.create(genome, config)
 
 frames = render_result(
     environment=gym.make(ENV_NAME),
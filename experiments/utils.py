@@ -1,28 +1,53 @@
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Collection, Optional, Type, Union
 
 import neat
 from gym import Env
 from neat import StdOutReporter
 from neat.nn import FeedForwardNetwork
 from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.vec_env import SubprocVecEnv
 
 from neat_improved.neat import NEAT_CONFIGS
 from neat_improved.neat.action_handler import handle_action
-from neat_improved.neat.evaluator import MultipleRunGymEvaluator
-from neat_improved.neat.reporters import FileReporter
+from neat_improved.neat.compact_genome import CompactGenome
+from neat_improved.neat.distributed import DistributedEvaluationPool
+from neat_improved.neat.early_stopping import EarlyStoppingConfig
+from neat_improved.neat.evaluator import (
+    LockstepGymEvaluator,
+    MultipleRunGymEvaluator,
+    Network,
+    PopulationNetworkType,
+)
+from neat_improved.neat.fitness_cache import FitnessCache
+from neat_improved.neat.network import PopulationNetwork
+from neat_improved.neat.parallel import EvaluationPool
+from neat_improved.neat.racing import RacingEvaluator
+from neat_improved.neat.reporters import (
+    BufferedFileReporter,
+    EarlyStoppingReporter,
+    EnvironmentPoolReporter,
+    FileReporter,
+    FitnessCacheReporter,
+    RacingReporter,
+    RemoteWorkerReporter,
+    TelemetryReporter,
+    WorkerUtilisationReporter,
+)
+from neat_improved.neat.speciation import VectorizedSpeciesSet
 from neat_improved.neat.trainer import NEATRunner
 from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.data_parallel import DataParallelA2CTrainer, train_data_parallel
 from neat_improved.rl.actor_critic.trainer import A2CTrainer
+from neat_improved.rl.profiling import ProfiledEnv
 from neat_improved.rl.reporters import FileRLReporter
+from neat_improved.rl.vec_env import PipelinedVecEnv, SharedMemoryVecEnv
 
 
 def render_result(
         environment: Env,
-        network: FeedForwardNetwork,
+        network: Network,
         steps: int = 500,
 ):
     frames = []
@@ -51,8 +76,30 @@ def run_neat(
         runs_per_network: int = 1,
         max_steps: int = 1000,
         seed: int = 2021,
+        network_type: Type[Network] = FeedForwardNetwork,
+        lockstep: bool = False,
+        population_network_type: PopulationNetworkType = PopulationNetwork,
+        chunk_size: int = 1,
+        pool: Optional[Union[EvaluationPool, DistributedEvaluationPool]] = None,
+        cost_aware_scheduling: bool = False,
+        steady_state: bool = False,
+        fitness_cache: bool = False,
+        fitness_cache_evaluations: int = 1,
+        racing: bool = False,
+        early_stopping: bool = False,
+        vectorized_speciation: bool = False,
+        compact_genome: bool = False,
+        checkpoint_interval: Optional[int] = None,
+        resume_dir: Optional[Path] = None,
+        log_format: Optional[str] = None,
+        telemetry: bool = False,
+        profile_generations: Collection[int] = (),
 ):
-    logging_dir = prepare_logging_dir(environment_name, logging_dir)
+    # a resumed run continues in the logging directory of the checkpointed one
+    if resume_dir is None:
+        logging_dir = prepare_logging_dir(environment_name, logging_dir)
+    else:
+        logging_dir = resume_dir
     config = neat.Config(
         neat.DefaultGenome,
         neat.DefaultReproduction,
@@ -60,12 +107,40 @@ def run_neat(
         neat.DefaultStagnation,
         str(NEAT_CONFIGS[environment_name]),
     )
+    # drop-in replacements, configured by the `[DefaultSpeciesSet]` and `[DefaultGenome]` sections
+    if vectorized_speciation:
+        config.species_set_type = VectorizedSpeciesSet
+    if compact_genome:
+        config.genome_type = CompactGenome
 
-    evaluator = MultipleRunGymEvaluator(
-        environment_name=environment_name,
-        max_steps=max_steps,
-        runs_per_network=runs_per_network,
-    )
+    if telemetry and lockstep:
+        raise ValueError('Telemetry is not supported by the lockstep evaluator')
+
+    early_stopping_config = None
+    if early_stopping:
+        if lockstep:
+            raise ValueError('Early stopping is not supported by the lockstep evaluator')
+        # rules of the environment come from the `[EarlyStopping]` section of its config
+        early_stopping_config = EarlyStoppingConfig.from_file(NEAT_CONFIGS[environment_name])
+
+    # when racing, the evaluator plays single episodes and the race decides how many to play
+    evaluator_runs = 1 if racing else runs_per_network
+    if lockstep:
+        evaluator = LockstepGymEvaluator(
+            environment_name=environment_name,
+            max_steps=max_steps,
+            runs_per_network=evaluator_runs,
+            population_network_type=population_network_type,
+        )
+    else:
+        evaluator = MultipleRunGymEvaluator(
+            environment_name=environment_name,
+            max_steps=max_steps,
+            runs_per_network=evaluator_runs,
+            network_type=network_type,
+            early_stopping=early_stopping_config,
+            telemetry=telemetry,
+        )
 
     with (logging_dir / 'hyperparameters.json').open('w') as file:
         json.dump(
@@ -76,22 +151,84 @@ def run_neat(
                 'runs_per_network': runs_per_network,
                 'max_steps': max_steps,
                 'seed': seed,
+                'network_type': network_type.__name__,
+                'lockstep': lockstep,
+                'population_network_type': population_network_type.__name__,
+                'chunk_size': chunk_size,
+                'cost_aware_scheduling': cost_aware_scheduling,
+                'steady_state': steady_state,
+                'fitness_cache': fitness_cache,
+                'fitness_cache_evaluations': fitness_cache_evaluations,
+                'racing': racing,
+                'early_stopping': early_stopping,
+                'vectorized_speciation': vectorized_speciation,
+                'compact_genome': compact_genome,
+                'checkpoint_interval': checkpoint_interval,
+                'log_format': log_format,
+                'telemetry': telemetry,
+                'profile_generations': list(profile_generations),
             },
             file,
             indent=4,
         )
 
+    # with a `log_format`, logs are buffered and written in the background ('csv' or 'npz')
+    if log_format is None:
+        file_reporter = FileReporter(save_dir_path=logging_dir, evaluator=evaluator)
+    else:
+        file_reporter = BufferedFileReporter(
+            save_dir_path=logging_dir, evaluator=evaluator, file_format=log_format
+        )
+
+    reporters = [
+        # StatisticsReporter(),
+        StdOutReporter(show_species_detail=False),
+        file_reporter,
+        EnvironmentPoolReporter(evaluator=evaluator),
+        WorkerUtilisationReporter(evaluator=evaluator),
+    ]
+
+    if isinstance(pool, DistributedEvaluationPool):
+        reporters.append(RemoteWorkerReporter(pool=pool))
+
+    if early_stopping:
+        reporters.append(EarlyStoppingReporter(evaluator=evaluator))
+
+    if telemetry:
+        reporters.append(TelemetryReporter(evaluator=evaluator))
+
+    cache = None
+    if fitness_cache:
+        cache = FitnessCache(max_evaluations=fitness_cache_evaluations)
+        reporters.append(FitnessCacheReporter(fitness_cache=cache))
+
+    racing_evaluator = None
+    if racing:
+        racing_evaluator = RacingEvaluator(
+            max_runs=runs_per_network,
+            num_elites=config.reproduction_config.elitism,
+        )
+        reporters.append(RacingReporter(racing=racing_evaluator))
+
     runner = NEATRunner(
         config=config,
         evaluator=evaluator,
-        reporters=[
-            # StatisticsReporter(),
-            StdOutReporter(show_species_detail=False),
-            FileReporter(save_dir_path=logging_dir, evaluator=evaluator),
-        ],
+        reporters=reporters,
         num_workers=num_workers,
+        chunk_size=chunk_size,
+        pool=pool,
+        cost_aware_scheduling=cost_aware_scheduling,
+        steady_state=steady_state,
+        fitness_cache=cache,
+        racing=racing_evaluator,
+        checkpoint_dir=logging_dir / 'checkpoint' if checkpoint_interval is not None else None,
+        checkpoint_interval=checkpoint_interval or 1,
+        profile_dir=logging_dir,
+        profile_generations=profile_generations,
     )
 
+    if resume_dir is not None:
+        runner.resume(logging_dir / 'checkpoint')
     runner.train(max_frames, stop_time)
 
 
@@ -115,12 +252,16 @@ def run_actor_critic(
         gamma: float,
         logging_dir: Path,
         stop_time: Optional = None,
+        gae_lambda: float = 1.0,
         use_gpu: bool = True,
         normalize_advantage: bool = False,
         value_loss_coef: float = 0.5,
         entropy_coef: float = 0.01,
         common_stem: bool = False,
         seed=2021,
+        profile_updates: Collection[int] = (),
+        pipelined: bool = False,
+        num_ranks: int = 1,
 ):
     logging_dir = prepare_logging_dir(environment_name, logging_dir)
     with (logging_dir / 'hyperparameters.json').open('w') as file:
@@ -130,44 +271,75 @@ def run_actor_critic(
                 'stop_time': stop_time,
                 'lr': lr,
                 'gamma': gamma,
+                'gae_lambda': gae_lambda,
                 'normalize_advantage': normalize_advantage,
                 'value_loss_coef': value_loss_coef,
                 'common_stem': common_stem,
-                'use_gpu': use_gpu,
+                'use_gpu': use_gpu and num_ranks == 1,
                 'seed': seed,
+                'profile_updates': list(profile_updates),
+                'pipelined': pipelined,
+                'num_ranks': num_ranks,
             },
             file,
             indent=4,
         )
 
-    envs = make_vec_env(
-        env_id=environment_name,
-        seed=seed,
-        n_envs=5,
-        monitor_dir=str(logging_dir),
-        # vec_env_cls=DummyVecEnv,
-        vec_env_cls=SubprocVecEnv,
-    )
+    def make_trainer(rank: int = 0, num_ranks: int = 1) -> A2CTrainer:
+        # a pipelined rollout steps two groups of environments in turns, each rank of
+        # data-parallel training has environments of its own
+        group_sizes = (3, 2) if pipelined else (5,)
+        groups = [
+            make_vec_env(
+                env_id=environment_name,
+                seed=seed,
+                n_envs=n_envs,
+                start_index=rank * sum(group_sizes) + sum(group_sizes[:i]),
+                monitor_dir=str(logging_dir),
+                # vec_env_cls=DummyVecEnv,
+                # vec_env_cls=SubprocVecEnv,
+                vec_env_cls=SharedMemoryVecEnv,
+                # lets the trainer profile the environment processes
+                wrapper_class=ProfiledEnv if profile_updates and rank == 0 else None,
+            )
+            for i, n_envs in enumerate(group_sizes)
+        ]
+        envs = PipelinedVecEnv(groups) if pipelined else groups[0]
 
-    policy = PolicyA2C(
-        envs.observation_space.shape,
-        envs.action_space,
-        common_stem=common_stem,
-    )
-    trainer = A2CTrainer(
-        policy=policy,
-        vec_envs=envs,
-        n_steps=5,
-        use_gpu=use_gpu,
-        log_interval=10,
-        value_loss_coef=value_loss_coef,
-        lr=lr,
-        normalize_advantage=normalize_advantage,
-        entropy_coef=entropy_coef,
-        reporters=(FileRLReporter(save_dir_path=logging_dir),),
-    )
+        policy = PolicyA2C(
+            envs.observation_space.shape,
+            envs.action_space,
+            common_stem=common_stem,
+        )
+        trainer_cls = DataParallelA2CTrainer if num_ranks > 1 else A2CTrainer
+        return trainer_cls(
+            policy=policy,
+            vec_envs=envs,
+            n_steps=5,
+            # data-parallel learners run on the CPU
+            use_gpu=use_gpu and num_ranks == 1,
+            log_interval=10,
+            value_loss_coef=value_loss_coef,
+            lr=lr,
+            gamma=gamma,
+            gae_lambda=gae_lambda,
+            normalize_advantage=normalize_advantage,
+            entropy_coef=entropy_coef,
+            # the statistics of all ranks are reported by the first one
+            reporters=(FileRLReporter(save_dir_path=logging_dir),) if rank == 0 else (),
+            profile_dir=logging_dir,
+            profile_updates=profile_updates if rank == 0 else (),
+        )
 
-    trainer.train(
-        stop_time=stop_time,
-        num_frames=max_frames,
-    )
+    if num_ranks > 1:
+        train_data_parallel(
+            make_trainer,
+            num_ranks,
+            num_frames=max_frames,
+            stop_time=stop_time,
+        )
+    else:
+        make_trainer().train(
+            stop_time=stop_time,
+            num_frames=max_frames,
+        )
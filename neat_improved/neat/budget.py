@@ -0,0 +1,138 @@
+import math
+import multiprocessing
+from time import time
+from typing import Optional
+
+_MAX_FRAMES, _DEADLINE, _FRAMES, _TRUNCATED, _CANCELLED, _EPOCH, _BEST_FITNESS = range(7)
+
+
+class Budget:
+    """
+    Frame and wall-clock budget shared by the trainer and its evaluation workers.
+
+    The state lives in shared memory, so episodes check it on every step and stop as soon as
+    the budget is spent instead of at the next generation boundary. Workers flush the frames
+    they consume every `flush_every` frames, which bounds the frame overshoot to about
+    `flush_every` frames per worker. The budget must be created before the worker processes.
+
+    It also tracks the best fitness of the current generation, so that workers can give up on
+    episodes that cannot beat it.
+    """
+
+    def __init__(self, flush_every: int = 64):
+        self.flush_every = flush_every
+        self._state = multiprocessing.RawArray('d', 7)
+        self._lock = multiprocessing.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        return {'flush_every': self.flush_every, '_state': self._state, '_lock': self._lock}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sync()
+
+    def reset(
+        self,
+        max_frames: Optional[float] = None,
+        stop_time: Optional[float] = None,
+        num_frames: int = 0,
+    ):
+        with self._lock:
+            self._state[_MAX_FRAMES] = max_frames if max_frames is not None else math.inf
+            self._state[_DEADLINE] = time() + stop_time if stop_time is not None else math.inf
+            self._state[_FRAMES] = num_frames
+            self._state[_TRUNCATED] = 0
+            self._state[_CANCELLED] = 0
+            self._state[_EPOCH] += 1
+        self.reset_best_fitness()
+        self._sync()
+
+    def reset_best_fitness(self):
+        self._state[_BEST_FITNESS] = -math.inf
+
+    def record_fitness(self, fitness: float):
+        if fitness > self._state[_BEST_FITNESS]:
+            with self._lock:
+                self._state[_BEST_FITNESS] = max(self._state[_BEST_FITNESS], fitness)
+
+    @property
+    def num_truncated(self) -> int:
+        return int(self._state[_TRUNCATED])
+
+    @property
+    def num_cancelled(self) -> int:
+        return int(self._state[_CANCELLED])
+
+    @property
+    def remaining_frames(self) -> float:
+        return self._state[_MAX_FRAMES] - self._state[_FRAMES]
+
+    @property
+    def best_fitness(self) -> float:
+        return self._state[_BEST_FITNESS]
+
+    @property
+    def remaining_time(self) -> float:
+        return self._state[_DEADLINE] - time()
+
+    def exhausted(self) -> bool:
+        state = self._state
+        return state[_FRAMES] + self._pending >= state[_MAX_FRAMES] or time() >= state[_DEADLINE]
+
+    def consume(self, num_frames: int = 1) -> bool:
+        """Accounts for frames about to be played, returns False if the budget is spent."""
+        if self._exhausted or self._pending + num_frames >= self.flush_every:
+            self._sync()
+
+        self._exhausted = self._exhausted or self.exhausted()
+        if self._exhausted:
+            return False
+
+        self._pending += num_frames
+        if self._pending >= self.flush_every:
+            self._flush()
+
+        return True
+
+    def add_frames(self, num_frames: int):
+        """Accounts for frames played outside the processes sharing the budget."""
+        self._add(_FRAMES, num_frames)
+
+    def record_truncated(self, num_evaluations: int = 1):
+        self._add(_TRUNCATED, num_evaluations)
+
+    def record_cancelled(self, num_evaluations: int = 1):
+        self._add(_CANCELLED, num_evaluations)
+
+    def _sync(self):
+        # the budget was reset for a new run since this process last looked at it
+        if self._state[_EPOCH] != getattr(self, '_epoch', None):
+            self._epoch = self._state[_EPOCH]
+            self._pending = 0
+            self._exhausted = False
+
+    def _flush(self):
+        self._add(_FRAMES, self._pending)
+        self._pending = 0
+
+    def _add(self, index: int, value: float):
+        with self._lock:
+            self._state[index] += value
+
+
+_BUDGET: Optional[Budget] = None
+
+
+def get_budget() -> Budget:
+    """Returns the budget installed in the current process, an unlimited one by default."""
+    global _BUDGET
+    if _BUDGET is None:
+        _BUDGET = Budget()
+
+    return _BUDGET
+
+
+def install_budget(budget: Budget):
+    global _BUDGET
+    _BUDGET = budget
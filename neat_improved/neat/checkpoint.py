@@ -0,0 +1,324 @@
+import os
+import pickle
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from pathlib import Path
+from time import perf_counter, time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from neat import Config, DefaultGenome, Population
+from neat.reporting import BaseReporter
+from neat.species import Species
+
+from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.genome_encoding import decode_genome, encode_genome
+
+# A checkpoint directory holds append-only segments of encoded genomes (see `genome_encoding`)
+# and a small pickled manifest referencing the genomes of the checkpointed state by offset.
+# Genes never change once a genome is created, so every genome is encoded and written only
+# once, and a checkpoint costs about the size of the new offspring. A new segment, holding only
+# the genomes still referenced, is started once most of the current one is garbage.
+_MANIFEST = 'checkpoint.pkl'
+_SEGMENT = 'genomes-{}.bin'
+_VERSION = 1
+
+
+class SpeciesState(NamedTuple):
+    key: int
+    created: int
+    last_improved: int
+    representative: int  # genome key
+    members: List[int]  # genome keys
+    fitness: Optional[float]
+    adjusted_fitness: Optional[float]
+    fitness_history: List[float]
+
+
+class Checkpoint(NamedTuple):
+    generation: int  # the next generation to evaluate
+    segment: int
+    offsets: Dict[int, Tuple[int, int]]  # genome key -> (offset, size) in the segment
+    fitness: Dict[int, Optional[float]]
+    population: List[int]  # genome keys
+    best_genome: Optional[int]
+    species: List[SpeciesState]
+    genome_to_species: Dict[int, int]
+    species_indexer: int
+    genome_indexer: int
+    node_indexer: Optional[int]
+    ancestors: Dict[int, Tuple]
+    random_state: Any
+    numpy_random_state: Any
+    num_frames: int
+    elapsed_s: float
+
+    @property
+    def segment_path(self) -> str:
+        return _SEGMENT.format(self.segment)
+
+
+class CheckpointStats(NamedTuple):
+    generation: int
+    num_genomes: int  # newly written
+    num_bytes: int
+    blocking_s: float  # spent in the training loop
+    background_s: float
+
+
+def load_checkpoint(directory: Path) -> Checkpoint:
+    with (directory / _MANIFEST).open('rb') as file:
+        version, checkpoint = pickle.load(file)
+
+    if version != _VERSION:
+        raise ValueError(f'Unsupported checkpoint version: {version}')
+    return checkpoint
+
+
+def restore_checkpoint(directory: Path, checkpoint: Checkpoint, population: Population):
+    """Restores the state of a `Population` created with the config of the checkpointed run."""
+    config = population.config
+    genomes = _read_genomes(directory / checkpoint.segment_path, checkpoint, config)
+
+    species_set = population.species
+    species_set.species = {}
+    for state in checkpoint.species:
+        s = Species(state.key, state.created)
+        s.last_improved = state.last_improved
+        s.representative = genomes[state.representative]
+        s.members = {key: genomes[key] for key in state.members}
+        s.fitness = state.fitness
+        s.adjusted_fitness = state.adjusted_fitness
+        s.fitness_history = list(state.fitness_history)
+        species_set.species[state.key] = s
+    species_set.genome_to_species = dict(checkpoint.genome_to_species)
+    species_set.indexer = count(checkpoint.species_indexer)
+
+    reproduction = population.reproduction
+    reproduction.genome_indexer = count(checkpoint.genome_indexer)
+    reproduction.ancestors = dict(checkpoint.ancestors)
+    if checkpoint.node_indexer is not None:
+        config.genome_config.node_indexer = count(checkpoint.node_indexer)
+
+    population.population = {key: genomes[key] for key in checkpoint.population}
+    population.best_genome = genomes.get(checkpoint.best_genome)
+    population.generation = checkpoint.generation
+
+    random.setstate(checkpoint.random_state)
+    np.random.set_state(checkpoint.numpy_random_state)
+
+
+def _read_genomes(path: Path, checkpoint: Checkpoint, config: Config) -> Dict[int, DefaultGenome]:
+    genomes = {}
+    with path.open('rb') as file:
+        data = file.read()
+
+    for key, (offset, size) in checkpoint.offsets.items():
+        data_slice = data[offset : offset + size]
+        genome = decode_genome(data_slice, config.genome_type, config.genome_config)
+        genome.fitness = checkpoint.fitness[key]
+        genomes[key] = genome
+
+    return genomes
+
+
+def _next_value(owner, name: str) -> Optional[int]:
+    # counters cannot be read without advancing them, so they are replaced by fresh ones
+    counter = getattr(owner, name)
+    if counter is None:
+        return None
+
+    value = next(counter)
+    setattr(owner, name, count(value))
+    return value
+
+
+class Checkpointer(BaseReporter):
+    """
+    Checkpoints the state of the population every `interval` generations, after speciation.
+
+    The state is captured in the training loop, but genomes are encoded and written to disk on
+    a background thread. A checkpoint still being written when the next one is due is waited
+    for, so at most one is in flight.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        population: Population,
+        evaluator: GymEvaluator,
+        interval: int = 1,
+    ):
+        self.directory = directory
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.population = population
+        self.evaluator = evaluator
+        self.interval = interval
+        self.start_time = None
+        self.stats: Optional[CheckpointStats] = None
+
+        self._segment = 0
+        self._segment_size = 0
+        self._offsets: Dict[int, Tuple[int, int]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: Optional[Future] = None
+
+    def restore(self, directory: Path, checkpoint: Checkpoint):
+        self.start_time = time() - checkpoint.elapsed_s
+        if directory.resolve() == self.directory.resolve():
+            # continue the segment of the checkpoint, dropping what was written after it
+            self._segment = checkpoint.segment
+            self._offsets = dict(checkpoint.offsets)
+            self._segment_size = max((o + s for o, s in self._offsets.values()), default=0)
+            with (self.directory / checkpoint.segment_path).open('r+b') as file:
+                file.truncate(self._segment_size)
+
+    def start_generation(self, generation):
+        if self.start_time is None:
+            self.start_time = time()
+
+    def end_generation(self, config, population, species_set):
+        generation = self.population.generation
+        if (generation + 1) % self.interval:
+            return
+
+        start = perf_counter()
+        previous = self._wait()
+        checkpoint, genomes = self._capture(config, population, species_set)
+        # buffered logs are flushed, so that they are complete up to any checkpoint on disk
+        logs_written = [
+            reporter.flush()
+            for reporter in self.population.reporters.reporters
+            if hasattr(reporter, 'flush')
+        ]
+        blocking_s = perf_counter() - start
+        self._pending = self._executor.submit(
+            self._write, checkpoint, genomes, logs_written, blocking_s
+        )
+        if previous is not None:
+            _report(previous)
+
+    def close(self):
+        """Waits for the checkpoint in flight."""
+        stats = self._wait()
+        if stats is not None:
+            _report(stats)
+
+    def _wait(self) -> Optional[CheckpointStats]:
+        if self._pending is None:
+            return None
+
+        self.stats = self._pending.result()
+        self._pending = None
+        return self.stats
+
+    def _capture(
+        self, config, population, species_set
+    ) -> Tuple[Checkpoint, List[Tuple[int, DefaultGenome]]]:
+        best_genome = self.population.best_genome
+        genomes = dict(population)
+        if best_genome is not None:
+            genomes[best_genome.key] = best_genome
+
+        species = [
+            SpeciesState(
+                key=sid,
+                created=s.created,
+                last_improved=s.last_improved,
+                representative=s.representative.key,
+                members=list(s.members),
+                fitness=s.fitness,
+                adjusted_fitness=s.adjusted_fitness,
+                fitness_history=list(s.fitness_history),
+            )
+            for sid, s in species_set.species.items()
+        ]
+
+        reproduction = self.population.reproduction
+        checkpoint = Checkpoint(
+            generation=self.population.generation + 1,
+            segment=self._segment,  # segment and offsets are filled in by the writer
+            offsets={},
+            fitness={key: genome.fitness for key, genome in genomes.items()},
+            population=list(population),
+            best_genome=best_genome.key if best_genome is not None else None,
+            species=species,
+            genome_to_species=dict(species_set.genome_to_species),
+            species_indexer=_next_value(species_set, 'indexer'),
+            genome_indexer=_next_value(reproduction, 'genome_indexer'),
+            node_indexer=_next_value(config.genome_config, 'node_indexer'),
+            ancestors=dict(reproduction.ancestors),
+            random_state=random.getstate(),
+            numpy_random_state=np.random.get_state(),
+            num_frames=self.evaluator.num_frames,
+            elapsed_s=time() - self.start_time,
+        )
+        return checkpoint, list(genomes.items())
+
+    def _write(
+        self,
+        checkpoint: Checkpoint,
+        genomes: List[Tuple[int, DefaultGenome]],
+        logs_written: List[threading.Event],
+        blocking_s: float,
+    ) -> CheckpointStats:
+        start = perf_counter()
+        genome_config = self.population.config.genome_config
+        live_size = sum(self._offsets[k][1] for k, _ in genomes if k in self._offsets)
+        if self._segment_size > 2 * live_size + (1 << 20):
+            # most of the segment is garbage, start a new one with the live genomes only
+            previous_path = self.directory / _SEGMENT.format(self._segment)
+            self._segment += 1
+            self._offsets = {}
+        else:
+            previous_path = None
+
+        offsets = {}
+        written = []
+        with (self.directory / _SEGMENT.format(self._segment)).open('ab') as file:
+            self._segment_size = file.tell()
+            for key, genome in genomes:
+                if key not in self._offsets:
+                    data = encode_genome(genome, genome_config)
+                    self._offsets[key] = (self._segment_size, len(data))
+                    self._segment_size += len(data)
+                    written.append(data)
+                offsets[key] = self._offsets[key]
+
+            file.write(b''.join(written))
+            file.flush()
+            os.fsync(file.fileno())
+
+        checkpoint = checkpoint._replace(segment=self._segment, offsets=offsets)
+        manifest = pickle.dumps((_VERSION, checkpoint), protocol=pickle.HIGHEST_PROTOCOL)
+        for event in logs_written:
+            event.wait()
+
+        temporary = self.directory / (_MANIFEST + '.tmp')
+        with temporary.open('wb') as file:
+            file.write(manifest)
+            file.flush()
+            os.fsync(file.fileno())
+        # atomic, a run preempted while writing resumes from the previous checkpoint
+        os.replace(temporary, self.directory / _MANIFEST)
+
+        if previous_path is not None:
+            previous_path.unlink()
+
+        return CheckpointStats(
+            generation=checkpoint.generation - 1,
+            num_genomes=len(written),
+            num_bytes=sum(map(len, written)) + len(manifest),
+            blocking_s=blocking_s,
+            background_s=perf_counter() - start,
+        )
+
+
+def _report(stats: CheckpointStats):
+    print(
+        f'Checkpoint of generation {stats.generation}: {stats.num_genomes} genomes, '
+        f'{stats.num_bytes / 1024:.1f} KiB written in {stats.background_s:.3f}s in the '
+        f'background, {stats.blocking_s * 1e3:.1f} ms blocking'
+    )
@@ -0,0 +1,511 @@
+import random
+from collections.abc import Mapping
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from neat import DefaultGenome
+from neat.activations import ActivationFunctionSet
+from neat.aggregations import AggregationFunctionSet
+from neat.genome import DefaultGenomeConfig
+from neat.graphs import creates_cycle
+
+from neat_improved.neat.genome_encoding import CONNECTION_RECORD, NODE_RECORD, function_names
+
+
+# function names of configs without custom functions, left out of pickled genomes
+_DEFAULT_FUNCTIONS = (
+    sorted(ActivationFunctionSet().functions),
+    sorted(AggregationFunctionSet().functions),
+)
+
+
+class NodeGene(NamedTuple):
+    key: int
+    bias: float
+    response: float
+    activation: str
+    aggregation: str
+
+
+class ConnectionGene(NamedTuple):
+    key: Tuple[int, int]
+    weight: float
+    enabled: bool
+
+
+class GeneMapping(Mapping):
+    """
+    Read-only `{key: gene}` view of gene records, standing in for the gene dicts of
+    `DefaultGenome`. Its length comes from the records, gene tuples are only created once the
+    genes are accessed.
+    """
+
+    __slots__ = ('_records', '_create_genes', '_genes')
+
+    def __init__(self, records: np.ndarray, create_genes: Callable[[np.ndarray], Iterable]):
+        self._records = records
+        self._create_genes = create_genes
+        self._genes = None
+
+    def _get_genes(self) -> dict:
+        if self._genes is None:
+            self._genes = {gene.key: gene for gene in self._create_genes(self._records)}
+        return self._genes
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, key):
+        return self._get_genes()[key]
+
+    def __iter__(self):
+        return iter(self._get_genes())
+
+    def __contains__(self, key):
+        return key in self._get_genes()
+
+    def keys(self):
+        return self._get_genes().keys()
+
+    def values(self):
+        return self._get_genes().values()
+
+    def items(self):
+        return self._get_genes().items()
+
+
+def _init_floats(config: DefaultGenomeConfig, name: str, size: int) -> np.ndarray:
+    # vectorized `FloatAttribute.init_value`
+    mean = getattr(config, f'{name}_init_mean')
+    stdev = getattr(config, f'{name}_init_stdev')
+    min_value = getattr(config, f'{name}_min_value')
+    max_value = getattr(config, f'{name}_max_value')
+    init_type = getattr(config, f'{name}_init_type').lower()
+    if 'gauss' in init_type or 'normal' in init_type:
+        return np.clip(np.random.normal(mean, stdev, size), min_value, max_value)
+    if 'uniform' in init_type:
+        low, high = max(min_value, mean - 2 * stdev), min(max_value, mean + 2 * stdev)
+        return np.random.uniform(low, high, size)
+
+    raise RuntimeError(f'Unknown init_type {init_type!r} for {name}_init_type')
+
+
+def _mutate_floats(config: DefaultGenomeConfig, name: str, values: np.ndarray):
+    # vectorized `FloatAttribute.mutate_value`, in place
+    mutate_rate = getattr(config, f'{name}_mutate_rate')
+    replace_rate = getattr(config, f'{name}_replace_rate')
+    r = np.random.random(len(values))
+
+    mutated = r < mutate_rate
+    num_mutated = np.count_nonzero(mutated)
+    if num_mutated:
+        mutate_power = getattr(config, f'{name}_mutate_power')
+        min_value = getattr(config, f'{name}_min_value')
+        max_value = getattr(config, f'{name}_max_value')
+        perturbed = values[mutated] + np.random.normal(0.0, mutate_power, num_mutated)
+        values[mutated] = np.clip(perturbed, min_value, max_value)
+
+    replaced = ~mutated & (r < replace_rate + mutate_rate)
+    num_replaced = np.count_nonzero(replaced)
+    if num_replaced:
+        values[replaced] = _init_floats(config, name, num_replaced)
+
+
+def _init_bools(config: DefaultGenomeConfig, name: str, size: int) -> np.ndarray:
+    # vectorized `BoolAttribute.init_value`
+    default = str(getattr(config, f'{name}_default')).lower()
+    if default in ('1', 'on', 'yes', 'true'):
+        return np.ones(size, dtype=bool)
+    if default in ('0', 'off', 'no', 'false'):
+        return np.zeros(size, dtype=bool)
+    if default in ('random', 'none'):
+        return np.random.random(size) < 0.5
+
+    raise RuntimeError(f'Unknown default value {default!r} for {name}')
+
+
+def _mutate_bools(config: DefaultGenomeConfig, name: str, values: np.ndarray):
+    # vectorized `BoolAttribute.mutate_value`, in place
+    mutate_rate = getattr(config, f'{name}_mutate_rate')
+    rate = np.where(
+        values,
+        mutate_rate + getattr(config, f'{name}_rate_to_false_add'),
+        mutate_rate + getattr(config, f'{name}_rate_to_true_add'),
+    )
+    mutated = np.random.random(len(values)) < rate
+    values[mutated] = np.random.random(np.count_nonzero(mutated)) < 0.5
+
+
+def _init_labels(config: DefaultGenomeConfig, name: str, names: Sequence[str], size: int):
+    # vectorized `StringAttribute.init_value`, as indices into `names`
+    default = getattr(config, f'{name}_default')
+    if default.lower() in ('none', 'random'):
+        options = [names.index(option) for option in getattr(config, f'{name}_options')]
+        return np.random.choice(options, size)
+
+    return np.full(size, names.index(default))
+
+
+def _mutate_labels(config: DefaultGenomeConfig, name: str, names: Sequence[str], values):
+    # vectorized `StringAttribute.mutate_value`, in place
+    mutate_rate = getattr(config, f'{name}_mutate_rate')
+    if mutate_rate > 0:
+        mutated = np.random.random(len(values)) < mutate_rate
+        options = [names.index(option) for option in getattr(config, f'{name}_options')]
+        values[mutated] = np.random.choice(options, np.count_nonzero(mutated))
+
+
+def _connection_codes(connections: np.ndarray) -> np.ndarray:
+    # unique as long as output keys are non-negative, which `DefaultGenome` asserts as well
+    return (connections['in'].astype(np.int64) << 32) + connections['out']
+
+
+def _match(codes: np.ndarray, other_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Which `codes` are in `other_codes`, and their positions there."""
+    if not len(other_codes):
+        return np.zeros(len(codes), dtype=bool), np.zeros(len(codes), dtype=int)
+
+    order = np.argsort(other_codes)
+    positions = np.minimum(np.searchsorted(other_codes[order], codes), len(order) - 1)
+    positions = order[positions]
+    return other_codes[positions] == codes, positions
+
+
+def _crossover(records: np.ndarray, other: np.ndarray, codes: Callable, fields: Sequence[str]):
+    # like `BaseGene.crossover`, homologous genes take every attribute from a random parent
+    child = records.copy()
+    found, positions = _match(codes(records), codes(other))
+    rows, other = np.flatnonzero(found), other[positions[found]]
+    for field in fields:
+        from_other = np.random.random(len(rows)) <= 0.5
+        child[field][rows[from_other]] = other[field][from_other]
+
+    return child
+
+
+def _gene_distance(
+    records: np.ndarray,
+    other: np.ndarray,
+    codes: Callable,
+    gene_distances: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    config: DefaultGenomeConfig,
+) -> float:
+    if not len(records) and not len(other):
+        return 0.0
+
+    found, positions = _match(codes(records), codes(other))
+    distance = np.sum(gene_distances(records[found], other[positions[found]]))
+    distance *= config.compatibility_weight_coefficient
+    disjoint = len(records) + len(other) - 2 * np.count_nonzero(found)
+    distance += config.compatibility_disjoint_coefficient * disjoint
+    return float(distance / max(len(records), len(other)))
+
+
+class CompactGenome:
+    """
+    Drop-in replacement of `DefaultGenome` storing its genes as struct-of-arrays records
+    (`NODE_RECORD`, `CONNECTION_RECORD`) instead of dicts of gene objects. Mutation,
+    crossover and distance work on whole arrays, and genomes are encoded for worker processes
+    without conversion.
+
+    `nodes` and `connections` are read-only mappings of gene tuples, enough for
+    `FeedForwardNetwork`, `CompiledNetwork` and the reporters, so pickled genomes work with
+    scripts written for `DefaultGenome`. Genes are configured by the `[DefaultGenome]` section
+    of the config (see `run_neat`).
+    """
+
+    __slots__ = (
+        'key',
+        'fitness',
+        'node_genes',
+        'connection_genes',
+        '_functions',
+        '_nodes',
+        '_connections',
+    )
+
+    @classmethod
+    def parse_config(cls, param_dict) -> DefaultGenomeConfig:
+        return DefaultGenome.parse_config(param_dict)
+
+    @classmethod
+    def write_config(cls, f, config: DefaultGenomeConfig):
+        DefaultGenome.write_config(f, config)
+
+    def __init__(self, key: int):
+        self.key = key
+        self.fitness = None
+        self.node_genes = np.zeros(0, dtype=NODE_RECORD)
+        self.connection_genes = np.zeros(0, dtype=CONNECTION_RECORD)
+        # sorted activation and aggregation names, indexed by the gene records
+        self._functions: Optional[Tuple[List[str], List[str]]] = None
+        self._nodes = None
+        self._connections = None
+
+    @classmethod
+    def from_records(
+        cls,
+        key: int,
+        node_genes: np.ndarray,
+        connection_genes: np.ndarray,
+        config: DefaultGenomeConfig,
+    ) -> 'CompactGenome':
+        genome = cls(key)
+        genome.node_genes = node_genes
+        genome.connection_genes = connection_genes
+        genome._functions = function_names(config)
+        return genome
+
+    def __getstate__(self):
+        functions = None if self._functions == _DEFAULT_FUNCTIONS else self._functions
+        return self.key, self.fitness, self.node_genes, self.connection_genes, functions
+
+    def __setstate__(self, state):
+        self.key, self.fitness, self.node_genes, self.connection_genes, functions = state
+        self._functions = functions or _DEFAULT_FUNCTIONS
+        self._nodes = None
+        self._connections = None
+
+    @property
+    def nodes(self) -> GeneMapping:
+        if self._nodes is None:
+            activations, aggregations = self._functions
+
+            def create_genes(records):
+                for key, bias, response, activation, aggregation in records.tolist():
+                    yield NodeGene(
+                        key, bias, response, activations[activation], aggregations[aggregation]
+                    )
+
+            self._nodes = GeneMapping(self.node_genes, create_genes)
+        return self._nodes
+
+    @property
+    def connections(self) -> GeneMapping:
+        if self._connections is None:
+
+            def create_genes(records):
+                for in_key, out_key, weight, enabled in records.tolist():
+                    yield ConnectionGene((in_key, out_key), weight, enabled)
+
+            self._connections = GeneMapping(self.connection_genes, create_genes)
+        return self._connections
+
+    def _set_genes(self, node_genes: np.ndarray = None, connection_genes: np.ndarray = None):
+        if node_genes is not None:
+            self.node_genes = node_genes
+        if connection_genes is not None:
+            self.connection_genes = connection_genes
+        self._nodes = None
+        self._connections = None
+
+    def _create_nodes(self, config: DefaultGenomeConfig, keys: Sequence[int]) -> np.ndarray:
+        activations, aggregations = self._functions
+        nodes = np.zeros(len(keys), dtype=NODE_RECORD)
+        nodes['key'] = keys
+        nodes['bias'] = _init_floats(config, 'bias', len(keys))
+        nodes['response'] = _init_floats(config, 'response', len(keys))
+        nodes['activation'] = _init_labels(config, 'activation', activations, len(keys))
+        nodes['aggregation'] = _init_labels(config, 'aggregation', aggregations, len(keys))
+        return nodes
+
+    @staticmethod
+    def _create_connections(config: DefaultGenomeConfig, keys: Sequence[Tuple[int, int]]):
+        connections = np.zeros(len(keys), dtype=CONNECTION_RECORD)
+        if keys:
+            connections['in'], connections['out'] = zip(*keys)
+        connections['weight'] = _init_floats(config, 'weight', len(keys))
+        connections['enabled'] = _init_bools(config, 'enabled', len(keys))
+        return connections
+
+    def configure_new(self, config: DefaultGenomeConfig):
+        self._functions = function_names(config)
+        nodes = self._create_nodes(config, config.output_keys)
+        self._set_genes(node_genes=nodes)
+        if config.num_hidden > 0:
+            keys = [config.get_new_node_key(self.nodes) for _ in range(config.num_hidden)]
+            self._set_genes(node_genes=np.concatenate([nodes, self._create_nodes(config, keys)]))
+
+        # the same connectivity as `DefaultGenome.configure_new`, which only warns about
+        # the ambiguous `fs_neat`, `full` and `partial` with hidden nodes
+        connectivity = config.initial_connection
+        if 'fs_neat' in connectivity:
+            input_key = random.choice(config.input_keys)
+            if connectivity == 'fs_neat_hidden':
+                targets = [key for key in self.nodes if key not in config.input_keys]
+            else:
+                targets = config.output_keys
+            keys = [(input_key, target) for target in targets]
+        elif 'full' in connectivity or 'partial' in connectivity:
+            direct = connectivity in ('full_direct', 'partial_direct')
+            keys = DefaultGenome.compute_full_connections(self, config, direct)
+            if 'partial' in connectivity:
+                random.shuffle(keys)
+                keys = keys[: int(round(len(keys) * config.connection_fraction))]
+        else:
+            keys = []
+
+        self._set_genes(connection_genes=self._create_connections(config, keys))
+
+    def configure_crossover(self, genome1, genome2, config: DefaultGenomeConfig):
+        assert isinstance(genome1.fitness, (int, float))
+        assert isinstance(genome2.fitness, (int, float))
+        if genome1.fitness > genome2.fitness:
+            parent1, parent2 = genome1, genome2
+        else:
+            parent1, parent2 = genome2, genome1
+
+        self._functions = parent1._functions
+        self._set_genes(
+            node_genes=_crossover(
+                parent1.node_genes,
+                parent2.node_genes,
+                lambda nodes: nodes['key'],
+                ('bias', 'response', 'activation', 'aggregation'),
+            ),
+            connection_genes=_crossover(
+                parent1.connection_genes,
+                parent2.connection_genes,
+                _connection_codes,
+                ('weight', 'enabled'),
+            ),
+        )
+
+    def mutate(self, config: DefaultGenomeConfig):
+        if config.single_structural_mutation:
+            div = max(
+                1,
+                config.node_add_prob
+                + config.node_delete_prob
+                + config.conn_add_prob
+                + config.conn_delete_prob,
+            )
+            r = random.random()
+            if r < config.node_add_prob / div:
+                self.mutate_add_node(config)
+            elif r < (config.node_add_prob + config.node_delete_prob) / div:
+                self.mutate_delete_node(config)
+            elif r < (config.node_add_prob + config.node_delete_prob + config.conn_add_prob) / div:
+                self.mutate_add_connection(config)
+            elif r < (
+                config.node_add_prob
+                + config.node_delete_prob
+                + config.conn_add_prob
+                + config.conn_delete_prob
+            ) / div:
+                self.mutate_delete_connection()
+        else:
+            if random.random() < config.node_add_prob:
+                self.mutate_add_node(config)
+            if random.random() < config.node_delete_prob:
+                self.mutate_delete_node(config)
+            if random.random() < config.conn_add_prob:
+                self.mutate_add_connection(config)
+            if random.random() < config.conn_delete_prob:
+                self.mutate_delete_connection()
+
+        activations, aggregations = self._functions
+        connections, nodes = self.connection_genes, self.node_genes
+        _mutate_floats(config, 'weight', connections['weight'])
+        _mutate_bools(config, 'enabled', connections['enabled'])
+        _mutate_floats(config, 'bias', nodes['bias'])
+        _mutate_floats(config, 'response', nodes['response'])
+        _mutate_labels(config, 'activation', activations, nodes['activation'])
+        _mutate_labels(config, 'aggregation', aggregations, nodes['aggregation'])
+        self._set_genes()
+
+    def mutate_add_node(self, config: DefaultGenomeConfig):
+        connections = self.connection_genes
+        if not len(connections):
+            if config.check_structural_mutation_surer():
+                self.mutate_add_connection(config)
+            return
+
+        # split a random connection, the new node gets the input weight 1.0
+        split = random.randrange(len(connections))
+        in_key, out_key = int(connections['in'][split]), int(connections['out'][split])
+        new_key = config.get_new_node_key(self.nodes)
+        new_connections = self._create_connections(config, [(in_key, new_key), (new_key, out_key)])
+        new_connections['weight'] = 1.0, connections['weight'][split]
+        new_connections['enabled'] = True
+
+        connections = np.concatenate([connections, new_connections])
+        connections['enabled'][split] = False
+        self._set_genes(
+            node_genes=np.concatenate([self.node_genes, self._create_nodes(config, [new_key])]),
+            connection_genes=connections,
+        )
+
+    def mutate_add_connection(self, config: DefaultGenomeConfig):
+        connections = self.connection_genes
+        node_keys = self.node_genes['key'].tolist()
+        out_key = random.choice(node_keys)
+        in_key = random.choice(node_keys + config.input_keys)
+
+        existing = np.flatnonzero((connections['in'] == in_key) & (connections['out'] == out_key))
+        if len(existing):
+            if config.check_structural_mutation_surer():
+                connections['enabled'][existing] = True
+                self._set_genes()
+            return
+
+        if in_key in config.output_keys and out_key in config.output_keys:
+            return
+
+        keys = list(zip(connections['in'].tolist(), connections['out'].tolist()))
+        if config.feed_forward and creates_cycle(keys, (in_key, out_key)):
+            return
+
+        new_connection = self._create_connections(config, [(in_key, out_key)])
+        self._set_genes(connection_genes=np.concatenate([connections, new_connection]))
+
+    def mutate_delete_node(self, config: DefaultGenomeConfig) -> int:
+        node_keys = self.node_genes['key']
+        available = [key for key in node_keys.tolist() if key not in config.output_keys]
+        if not available:
+            return -1
+
+        key = random.choice(available)
+        connections = self.connection_genes
+        kept = (connections['in'] != key) & (connections['out'] != key)
+        self._set_genes(
+            node_genes=self.node_genes[node_keys != key], connection_genes=connections[kept]
+        )
+        return key
+
+    def mutate_delete_connection(self):
+        if len(self.connection_genes):
+            index = random.randrange(len(self.connection_genes))
+            self._set_genes(connection_genes=np.delete(self.connection_genes, index))
+
+    def distance(self, other: 'CompactGenome', config: DefaultGenomeConfig) -> float:
+        node_distance = _gene_distance(
+            self.node_genes,
+            other.node_genes,
+            lambda nodes: nodes['key'],
+            lambda a, b: (
+                np.abs(a['bias'] - b['bias'])
+                + np.abs(a['response'] - b['response'])
+                + (a['activation'] != b['activation'])
+                + (a['aggregation'] != b['aggregation'])
+            ),
+            config,
+        )
+        connection_distance = _gene_distance(
+            self.connection_genes,
+            other.connection_genes,
+            _connection_codes,
+            lambda a, b: np.abs(a['weight'] - b['weight']) + (a['enabled'] != b['enabled']),
+            config,
+        )
+        return node_distance + connection_distance
+
+    def size(self) -> Tuple[int, int]:
+        return len(self.node_genes), int(np.count_nonzero(self.connection_genes['enabled']))
+
+    def __str__(self):
+        lines = [f'Key: {self.key}', f'Fitness: {self.fitness}', 'Nodes:']
+        lines.extend(f'\t{key} {node}' for key, node in self.nodes.items())
+        lines.append('Connections:')
+        lines.extend(f'\t{connection}' for _, connection in sorted(self.connections.items()))
+        return '\n'.join(lines)
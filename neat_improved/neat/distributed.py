@@ -0,0 +1,506 @@
+import itertools
+import math
+import os
+import pickle
+import secrets
+import socket
+import threading
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing import AuthenticationError, Process, cpu_count
+from multiprocessing.managers import BaseManager
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from neat import Config, DefaultGenome
+
+from neat_improved.neat.budget import Budget, install_budget
+from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.genome_encoding import encode_genome
+from neat_improved.neat.parallel import TaskResult, evaluate_encoded
+
+Address = Tuple[str, int]
+
+# shared secret of the coordinator and its workers, there is no default
+AUTHKEY_VARIABLE = 'NEAT_AUTHKEY'
+# methods of the broker available to the workers
+_WORKER_METHODS = ('register', 'heartbeat', 'fetch', 'state', 'complete', 'fail')
+# returned by `fetch` to tell workers that the coordinator is closing
+_SHUTDOWN = 'shutdown'
+
+
+@dataclass
+class RemoteWorkerStats:
+    name: str
+    connected_at: float = field(default_factory=time)
+    last_heartbeat: float = field(default_factory=time)
+    alive: bool = True
+    num_tasks: int = 0
+    num_genomes: int = 0
+    num_frames: int = 0
+    busy_time_s: float = 0.0
+
+    @property
+    def genomes_per_s(self) -> float:
+        return self.num_genomes / max(time() - self.connected_at, 1e-9)
+
+    @property
+    def frames_per_s(self) -> float:
+        return self.num_frames / max(time() - self.connected_at, 1e-9)
+
+
+def authkey_from_env() -> Optional[bytes]:
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    return authkey.encode() if authkey else None
+
+
+class DistributedJob:
+    """Handle of a submitted task, mirrors `multiprocessing.pool.AsyncResult`."""
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[TaskResult], None]] = None,
+        error_callback: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self._callback = callback
+        self._error_callback = error_callback
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def get(self, timeout: Optional[float] = None) -> TaskResult:
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+    def _set_result(self, result: TaskResult):
+        # like `AsyncResult`, callbacks run before `get` returns
+        self._result = result
+        if self._callback is not None:
+            self._callback(result)
+        self._done.set()
+
+    def _set_error(self, error: BaseException):
+        self._error = error
+        if self._error_callback is not None:
+            self._error_callback(error)
+        self._done.set()
+
+
+@dataclass
+class _Task:
+    version: int
+    encoded_genomes: List[bytes]
+    job: DistributedJob
+    profile_interval_s: Optional[float] = None
+    worker_id: Optional[int] = None
+
+
+class Broker:
+    """
+    Work queue shared with the remote workers through a `BrokerManager`. Workers register,
+    send heartbeats, pull tasks and push back their results; the coordinator puts tasks and
+    re-dispatches the tasks of workers whose heartbeats stopped.
+    """
+
+    def __init__(self, budget: Budget, heartbeat_timeout: float):
+        self.budget = budget
+        self.heartbeat_timeout = heartbeat_timeout
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._tasks: Dict[int, _Task] = {}
+        self._task_ids = itertools.count()
+        self._workers: Dict[int, RemoteWorkerStats] = {}
+        self._worker_ids = itertools.count()
+        self._states: Dict[int, bytes] = {}
+        self._closed = False
+
+    # called by the workers
+
+    def register(self, name: str) -> int:
+        with self._condition:
+            worker_id = next(self._worker_ids)
+            self._workers[worker_id] = RemoteWorkerStats(name)
+            self._condition.notify_all()
+            return worker_id
+
+    def heartbeat(self, worker_id: int):
+        with self._condition:
+            worker = self._workers[worker_id]
+            worker.last_heartbeat = time()
+            # a worker declared dead by mistake only lost its tasks
+            worker.alive = True
+
+    def fetch(self, worker_id: int, timeout: float):
+        """Returns the next task with the limits of the budget, `None` if there is none yet."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed, timeout)
+            if self._closed:
+                return _SHUTDOWN
+
+            while self._pending:
+                task_id = self._pending.popleft()
+                task = self._tasks.get(task_id)
+                if task is not None and task.worker_id is None:
+                    task.worker_id = worker_id
+                    # the best fitness of the generation so far, for `CannotBeatBestRule`
+                    limits = (
+                        self.budget.remaining_frames,
+                        self.budget.remaining_time,
+                        self.budget.best_fitness,
+                    )
+                    return (
+                        task_id,
+                        task.version,
+                        task.encoded_genomes,
+                        limits,
+                        task.profile_interval_s,
+                    )
+
+            return None
+
+    def state(self, version: int) -> bytes:
+        with self._condition:
+            return self._states[version]
+
+    def complete(
+        self,
+        worker_id: int,
+        task_id: int,
+        result: TaskResult,
+        num_truncated: int,
+        num_cancelled: int,
+        best_fitness: float,
+    ):
+        with self._condition:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                # a re-dispatched task that has been completed by another worker already
+                return
+
+            num_frames = sum(frames for _, frames in result.results)
+            worker = self._workers[worker_id]
+            worker.num_tasks += 1
+            worker.num_genomes += len(result.results)
+            worker.num_frames += num_frames
+            worker.busy_time_s += result.busy_time_s
+
+        self.budget.add_frames(num_frames)
+        self.budget.record_fitness(best_fitness)
+        if num_truncated:
+            self.budget.record_truncated(num_truncated)
+        if num_cancelled:
+            self.budget.record_cancelled(num_cancelled)
+        task.job._set_result(result._replace(worker_id=worker_id))
+
+    def fail(self, worker_id: int, task_id: int, error: str):
+        with self._condition:
+            task = self._tasks.pop(task_id, None)
+        if task is not None:
+            task.job._set_error(RuntimeError(f'Worker {worker_id} failed:\n{error}'))
+
+    # called by the coordinator
+
+    def install(self, version: int, payload: bytes):
+        with self._condition:
+            self._states = {version: payload}
+
+    def put(
+        self,
+        version: int,
+        encoded_genomes: List[bytes],
+        job: DistributedJob,
+        profile_interval_s: Optional[float] = None,
+    ):
+        with self._condition:
+            task_id = next(self._task_ids)
+            self._tasks[task_id] = _Task(version, encoded_genomes, job, profile_interval_s)
+            self._pending.append(task_id)
+            self._condition.notify()
+
+    def num_alive(self) -> int:
+        with self._condition:
+            return sum(worker.alive for worker in self._workers.values())
+
+    def wait_for_workers(self, num_workers: int, timeout: Optional[float] = None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: sum(w.alive for w in self._workers.values()) >= num_workers, timeout
+            )
+
+    def worker_stats(self) -> Dict[str, RemoteWorkerStats]:
+        with self._condition:
+            return {w.name: RemoteWorkerStats(**vars(w)) for w in self._workers.values()}
+
+    def check_heartbeats(self) -> int:
+        """Re-dispatches the tasks of workers that went silent, returns their number."""
+        now = time()
+        with self._condition:
+            dead = {
+                worker_id
+                for worker_id, worker in self._workers.items()
+                if worker.alive and now - worker.last_heartbeat > self.heartbeat_timeout
+            }
+            for worker_id in dead:
+                self._workers[worker_id].alive = False
+
+            redispatched = [
+                task_id for task_id, task in self._tasks.items() if task.worker_id in dead
+            ]
+            for task_id in reversed(redispatched):
+                self._tasks[task_id].worker_id = None
+                self._pending.appendleft(task_id)
+
+            if redispatched:
+                self._condition.notify_all()
+
+            return len(redispatched)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+BrokerManager.register('broker')
+
+
+class DistributedEvaluationPool:
+    """
+    Drop-in replacement of `EvaluationPool` evaluating genomes on `neat-worker` processes
+    (`python -m neat_improved.neat.worker HOST:PORT`) on any number of hosts.
+
+    The pool serves a `Broker` over TCP with `multiprocessing.managers` from a thread of the
+    coordinator. Tasks carry encoded genomes, the evaluator and the config are fetched by the
+    workers once per `install`. Workers send heartbeats, the tasks of workers silent for
+    `heartbeat_timeout` seconds are dispatched again. Remote workers enforce the frame and time
+    budget locally with the limits sent along with every task and report what they consumed.
+    The best fitness of the generation goes back and forth the same way, so `CannotBeatBestRule`
+    only misses the results of tasks still running on other workers.
+
+    Both sides unpickle what the other sends, so they authenticate each other with `authkey`:
+    given, from `$NEAT_AUTHKEY`, or generated and printed for the workers. The pool only listens
+    on localhost by default, bind it to another interface only on a trusted network.
+    """
+
+    def __init__(
+        self,
+        address: Address = ('127.0.0.1', 0),
+        authkey: Optional[bytes] = None,
+        min_workers: int = 1,
+        heartbeat_timeout: float = 10.0,
+    ):
+        authkey = authkey or authkey_from_env()
+        if authkey is None:
+            authkey = secrets.token_hex(16).encode()
+            print(f'Start the workers with {AUTHKEY_VARIABLE}={authkey.decode()}')
+
+        self.min_workers = min_workers
+        self.budget = Budget()
+        self.num_tasks = 0
+        self.num_bytes_sent = 0
+        self.broker = Broker(self.budget, heartbeat_timeout)
+        self._version = 0
+        self._genome_config = None
+
+        # registrations are per manager class, every pool serves its own broker
+        manager_type = type('CoordinatorManager', (BaseManager,), {})
+        manager_type.register('broker', callable=lambda: self.broker, exposed=_WORKER_METHODS)
+        self._server = manager_type(address=address, authkey=authkey).get_server()
+        # normally created by `Server.serve_forever`, connections are served while it is not set
+        self._server.stop_event = threading.Event()
+        self._closed = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._accept, daemon=True),
+            threading.Thread(target=self._monitor, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def address(self) -> Address:
+        return self._server.address
+
+    @property
+    def num_workers(self) -> int:
+        return max(self.broker.num_alive(), 1)
+
+    def __enter__(self) -> 'DistributedEvaluationPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def install(self, evaluator: GymEvaluator, config: Config):
+        self._version += 1
+        self._genome_config = config.genome_config
+        payload = pickle.dumps((evaluator, config), protocol=pickle.HIGHEST_PROTOCOL)
+        self.broker.install(self._version, payload)
+        self.broker.wait_for_workers(self.min_workers)
+
+    def submit(
+        self,
+        genomes: Sequence[DefaultGenome],
+        callback: Optional[Callable[[TaskResult], None]] = None,
+        error_callback: Optional[Callable[[BaseException], None]] = None,
+        profile_interval_s: Optional[float] = None,
+    ) -> DistributedJob:
+        if self._genome_config is None:
+            raise RuntimeError('Install an evaluator before submitting genomes')
+
+        encoded = [encode_genome(genome, self._genome_config) for genome in genomes]
+        self.num_tasks += 1
+        self.num_bytes_sent += sum(map(len, encoded))
+        job = DistributedJob(callback, error_callback)
+        self.broker.put(self._version, encoded, job, profile_interval_s)
+        return job
+
+    def worker_stats(self) -> Dict[str, RemoteWorkerStats]:
+        return self.broker.worker_stats()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        # workers fetch the shutdown notice, then drop their connections
+        self.broker.close()
+        # a connection wakes up the accepting thread, which sees the pool closed and stops
+        host, port = self.address
+        try:
+            socket.create_connection(('127.0.0.1' if host == '0.0.0.0' else host, port)).close()
+        except OSError:
+            pass
+        self._threads[0].join()
+        self._server.listener.close()
+        self._server.stop_event.set()
+
+    def _accept(self):
+        # `Server.serve_forever` has no way to stop accepting connections, and a failed
+        # handshake ends its accepting thread
+        while not self._closed.is_set():
+            try:
+                connection = self._server.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+
+            threading.Thread(
+                target=self._server.handle_request, args=(connection,), daemon=True
+            ).start()
+
+    def _monitor(self):
+        while not self._closed.wait(self.broker.heartbeat_timeout / 2):
+            num_redispatched = self.broker.check_heartbeats()
+            if num_redispatched:
+                print(f'Re-dispatching {num_redispatched} tasks of unresponsive workers')
+
+
+def _heartbeat(broker, worker_id: int, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        broker.heartbeat(worker_id)
+
+
+def _connect(address: Address, authkey: bytes, timeout: float):
+    deadline = time() + timeout
+    while True:
+        manager = BrokerManager(address=address, authkey=authkey)
+        try:
+            manager.connect()
+            return manager.broker()
+        except ConnectionError:
+            if time() > deadline:
+                raise
+            sleep(1.0)
+
+
+def serve(
+    address: Address,
+    authkey: bytes,
+    heartbeat_interval: float = 1.0,
+    connect_timeout: float = 60.0,
+):
+    """Evaluates tasks of the coordinator at `address` until it closes."""
+    broker = _connect(address, authkey, connect_timeout)
+    worker_id = broker.register(f'{socket.gethostname()}:{os.getpid()}')
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(broker, worker_id, heartbeat_interval, stop), daemon=True
+    )
+    heartbeat.start()
+
+    budget = Budget()
+    install_budget(budget)
+    version, evaluator, config = None, None, None
+    try:
+        while True:
+            task = broker.fetch(worker_id, heartbeat_interval)
+            if task == _SHUTDOWN:
+                break
+            if task is None:
+                continue
+
+            task_id, task_version, encoded_genomes, limits, profile_interval_s = task
+            max_frames, remaining_time, best_fitness = limits
+            start = perf_counter()
+            try:
+                if task_version != version:
+                    evaluator, config = pickle.loads(broker.state(task_version))
+                    version = task_version
+
+                budget.reset(
+                    max_frames=max_frames if not math.isinf(max_frames) else None,
+                    stop_time=remaining_time if not math.isinf(remaining_time) else None,
+                )
+                budget.record_fitness(best_fitness)
+                result = evaluate_encoded(
+                    evaluator, config, encoded_genomes, start, profile_interval_s
+                )
+            except Exception:
+                broker.fail(worker_id, task_id, traceback.format_exc())
+                continue
+
+            broker.complete(
+                worker_id,
+                task_id,
+                result,
+                budget.num_truncated,
+                budget.num_cancelled,
+                budget.best_fitness,
+            )
+    except (ConnectionError, EOFError):
+        # the coordinator is gone
+        pass
+    finally:
+        stop.set()
+
+
+def run_worker(
+    address: Address,
+    authkey: bytes,
+    num_processes: Optional[int] = None,
+    heartbeat_interval: float = 1.0,
+    connect_timeout: float = 60.0,
+):
+    """Runs `num_processes` worker processes (all cores by default) until the coordinator closes."""
+    if not authkey:
+        raise ValueError('Workers need the authkey of their coordinator')
+
+    processes = [
+        Process(target=serve, args=(address, authkey, heartbeat_interval, connect_timeout))
+        for _ in range(num_processes or cpu_count())
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,186 @@
+import abc
+import math
+from collections import Counter
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+import numpy as np
+from neat import DefaultGenome
+
+from neat_improved.neat.budget import get_budget
+
+_SECTION = 'EarlyStopping'
+
+
+class EarlyStoppingRule(abc.ABC):
+    """Decides, after every step of an episode, whether the rest of it is not worth playing."""
+
+    name: str
+
+    def reset(self, observation: np.ndarray):
+        pass
+
+    @abc.abstractmethod
+    def should_stop(self, step: int, observation: np.ndarray, reward: float, fitness: float):
+        pass
+
+
+class NoProgressRule(EarlyStoppingRule):
+    """Stops when no observation component moved by more than `tolerance` for `steps` steps."""
+
+    name = 'no_progress'
+
+    def __init__(self, steps: int, tolerance: float):
+        self.steps = steps
+        self.tolerance = tolerance
+        self._anchor = None
+        self._anchor_step = 0
+
+    def reset(self, observation: np.ndarray):
+        self._anchor = np.asarray(observation, dtype=float)
+        self._anchor_step = 0
+
+    def should_stop(self, step: int, observation: np.ndarray, reward: float, fitness: float):
+        if np.max(np.abs(observation - self._anchor), initial=0.0) > self.tolerance:
+            self._anchor = np.asarray(observation, dtype=float)
+            self._anchor_step = step
+            return False
+
+        return step - self._anchor_step >= self.steps
+
+
+class RewardRateRule(EarlyStoppingRule):
+    """Stops when the mean reward of the last `window` steps drops below `floor`."""
+
+    name = 'reward_rate'
+
+    def __init__(self, window: int, floor: float):
+        self.window = window
+        self.floor = floor
+        self._rewards = np.zeros(window)
+        self._sum = 0.0
+
+    def reset(self, observation: np.ndarray):
+        self._rewards[:] = 0.0
+        self._sum = 0.0
+
+    def should_stop(self, step: int, observation: np.ndarray, reward: float, fitness: float):
+        # ring buffer of the last `window` rewards
+        i = (step - 1) % self.window
+        self._sum += reward - self._rewards[i]
+        self._rewards[i] = reward
+        return step >= self.window and self._sum < self.floor * self.window
+
+
+class CannotBeatBestRule(EarlyStoppingRule):
+    """
+    Stops when the episode cannot beat the best fitness of the current generation even when
+    collecting `max_step_reward` in every step left until `max_steps`, the most steps an episode
+    can last. Only used with a single run per network.
+    """
+
+    name = 'cannot_beat_best'
+
+    def __init__(self, max_step_reward: float, max_steps: float):
+        self.max_step_reward = max_step_reward
+        self.max_steps = max_steps
+        self._budget = None
+
+    def reset(self, observation: np.ndarray):
+        # the budget tracking the best fitness is shared memory, installed in every worker
+        self._budget = get_budget()
+
+    def should_stop(self, step: int, observation: np.ndarray, reward: float, fitness: float):
+        best_possible = fitness + (self.max_steps - step) * self.max_step_reward
+        return best_possible < self._budget.best_fitness
+
+
+@dataclass
+class EarlyStoppingConfig:
+    """
+    Early stopping rules of an environment, read from the `[EarlyStopping]` section of its
+    NEAT config (see `NEAT_CONFIGS`). Rules without their parameters set are disabled.
+    """
+
+    no_progress_steps: Optional[int] = None
+    no_progress_tolerance: float = 1e-3
+    reward_rate_window: Optional[int] = None
+    reward_rate_floor: float = 0.0
+    max_step_reward: Optional[float] = None
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'EarlyStoppingConfig':
+        parser = ConfigParser()
+        parser.read(path)
+        if not parser.has_section(_SECTION):
+            return cls()
+
+        section = parser[_SECTION]
+        return cls(
+            no_progress_steps=section.getint('no_progress_steps'),
+            no_progress_tolerance=section.getfloat(
+                'no_progress_tolerance', cls.no_progress_tolerance
+            ),
+            reward_rate_window=section.getint('reward_rate_window'),
+            reward_rate_floor=section.getfloat('reward_rate_floor', cls.reward_rate_floor),
+            max_step_reward=section.getfloat('max_step_reward'),
+        )
+
+    def create_rules(self, max_steps: float, runs_per_network: int = 1) -> List[EarlyStoppingRule]:
+        rules = []
+        if self.no_progress_steps is not None:
+            rules.append(NoProgressRule(self.no_progress_steps, self.no_progress_tolerance))
+        if self.reward_rate_window is not None:
+            rules.append(RewardRateRule(self.reward_rate_window, self.reward_rate_floor))
+        # the best fitness is a mean over the runs of a genome, a single episode may fall short
+        # of it while the mean of its genome does not
+        cannot_beat_best = runs_per_network == 1 and not math.isinf(max_steps)
+        if self.max_step_reward is not None and cannot_beat_best:
+            rules.append(CannotBeatBestRule(self.max_step_reward, max_steps))
+
+        return rules
+
+    def optimistic_fitness(self, fitness: float, step: int, max_steps: float) -> float:
+        """Upper bound of the return of an episode stopped at `step`."""
+        if self.max_step_reward is None:
+            return math.inf
+
+        return fitness + (max_steps - step) * self.max_step_reward
+
+
+@dataclass
+class EarlyStoppingStats:
+    num_stopped: Counter = field(default_factory=Counter)
+    # frames left until `max_steps` or the time limit of the environment in the stopped episodes
+    frames_saved: Counter = field(default_factory=Counter)
+    # optimistic fitness of genomes with a stopped episode and the rules that stopped them
+    stopped_genomes: Dict[int, Tuple[float, FrozenSet[str]]] = field(default_factory=dict)
+
+    def __add__(self, other: 'EarlyStoppingStats') -> 'EarlyStoppingStats':
+        return EarlyStoppingStats(
+            num_stopped=self.num_stopped + other.num_stopped,
+            frames_saved=self.frames_saved + other.frames_saved,
+            stopped_genomes={**self.stopped_genomes, **other.stopped_genomes},
+        )
+
+    def rankings_at_risk(self, population: Mapping[int, DefaultGenome]) -> Counter:
+        """
+        Counts, per rule, the stopped genomes whose ranking may have changed had their episodes
+        been played in full, i.e. whose fitness is exceeded by another genome's fitness that
+        is still below their optimistic fitness.
+        """
+        fitnesses = np.sort([g.fitness for g in population.values() if g.fitness is not None])
+        at_risk = Counter()
+        for key, (optimistic, rules) in self.stopped_genomes.items():
+            genome = population.get(key)
+            if genome is None or genome.fitness is None:
+                continue
+
+            start = np.searchsorted(fitnesses, genome.fitness, side='right')
+            end = np.searchsorted(fitnesses, optimistic, side='left')
+            if end > start:
+                at_risk.update(rules)
+
+        return at_risk
@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from multiprocessing.util import Finalize
+from time import perf_counter
+from typing import Iterator, List, Optional, Tuple
+
+import gym
+from gym import Env
+
+
+@dataclass
+class EnvironmentPoolStats:
+    num_created: int = 0
+    num_reused: int = 0
+    construction_time_s: float = 0.0
+    saved_time_s: float = 0.0
+
+    def __add__(self, other: 'EnvironmentPoolStats') -> 'EnvironmentPoolStats':
+        return EnvironmentPoolStats(
+            *(getattr(self, f.name) + getattr(other, f.name) for f in fields(self))
+        )
+
+
+class EnvironmentPool:
+    """
+    Cache of idle environments keyed by environment id. Environments are handed out by
+    `environment()` and returned to the pool afterwards, so callers must `reset()` them before
+    every episode (which they do anyway). At most `max_size` idle environments are kept, the
+    least recently used ones are closed.
+    """
+
+    def __init__(self, max_size: int = 16):
+        self.max_size = max_size
+        self._idle: List[Tuple[str, Env]] = []
+        self._stats = EnvironmentPoolStats()
+        self._total_created = 0
+        self._total_construction_time = 0.0
+
+    def acquire(self, environment_name: str) -> Env:
+        for i in reversed(range(len(self._idle))):
+            if self._idle[i][0] == environment_name:
+                self._stats.num_reused += 1
+                self._stats.saved_time_s += self._mean_construction_time
+                return self._idle.pop(i)[1]
+
+        start = perf_counter()
+        environment = gym.make(environment_name)
+        duration = perf_counter() - start
+
+        self._stats.num_created += 1
+        self._stats.construction_time_s += duration
+        self._total_created += 1
+        self._total_construction_time += duration
+        return environment
+
+    def release(self, environment_name: str, environment: Env):
+        self._idle.append((environment_name, environment))
+        while len(self._idle) > self.max_size:
+            _, evicted = self._idle.pop(0)
+            evicted.close()
+
+    @contextmanager
+    def environment(self, environment_name: str) -> Iterator[Env]:
+        environment = self.acquire(environment_name)
+        try:
+            yield environment
+        except BaseException:
+            # the environment may be left in an inconsistent state, don't reuse it
+            environment.close()
+            raise
+        else:
+            self.release(environment_name, environment)
+
+    def take_stats(self) -> EnvironmentPoolStats:
+        """Returns the stats gathered since the previous call."""
+        stats, self._stats = self._stats, EnvironmentPoolStats()
+        return stats
+
+    def close(self):
+        for _, environment in self._idle:
+            environment.close()
+        self._idle.clear()
+
+    @property
+    def _mean_construction_time(self) -> float:
+        return self._total_construction_time / max(self._total_created, 1)
+
+
+_POOL: Optional[EnvironmentPool] = None
+
+
+def get_environment_pool(max_size: int = 16) -> EnvironmentPool:
+    """Returns the environment pool of the current process, creating it on first use."""
+    global _POOL
+    if _POOL is None:
+        _POOL = EnvironmentPool(max_size)
+        # unlike `atexit`, finalizers with an exit priority also run in `multiprocessing` workers
+        Finalize(_POOL, _POOL.close, exitpriority=10)
+
+    _POOL.max_size = max(_POOL.max_size, max_size)
+    return _POOL
@@ -1,12 +1,33 @@
 import abc
-from typing import Optional, Tuple
+import math
+from contextlib import ExitStack
+from time import perf_counter
+from typing import List, Optional, Sequence, Tuple, Type, Union
 
 import gym
+import numpy as np
 from gym import Env
 from neat import Config, DefaultGenome
 from neat.nn import FeedForwardNetwork
 
 from neat_improved.neat.action_handler import handle_action
+from neat_improved.neat.budget import Budget, get_budget
+from neat_improved.neat.early_stopping import (
+    EarlyStoppingConfig,
+    EarlyStoppingRule,
+    EarlyStoppingStats,
+)
+from neat_improved.neat.environment_pool import EnvironmentPoolStats, get_environment_pool
+from neat_improved.neat.network import CompiledNetwork, PopulationNetwork
+from neat_improved.neat.scheduling import WorkerStats
+from neat_improved.neat.telemetry import GenerationTelemetry, GenomeTelemetry
+from neat_improved.neat.torch_network import TorchPopulationNetwork
+
+Network = Union[FeedForwardNetwork, CompiledNetwork]
+PopulationNetworkType = Union[Type[PopulationNetwork], Type[TorchPopulationNetwork]]
+
+# fitness reported for evaluations cancelled because the budget was already spent
+CANCELLED_FITNESS = float('-inf')
 
 
 class GymEvaluator(abc.ABC):
@@ -17,6 +38,14 @@ class GymEvaluator(abc.ABC):
     ):
         self._environment_name = environment_name
         self._render = render
+        # environment pool stats of the last evaluated generation, gathered from all workers
+        self.environment_stats = EnvironmentPoolStats()
+        # worker utilisation of the last evaluated generation
+        self.worker_stats = WorkerStats()
+        # early stopped episodes of the last evaluated generation
+        self.early_stopping_stats = EarlyStoppingStats()
+        # evaluation timings of the last evaluated generation, if the evaluator records them
+        self.telemetry = GenerationTelemetry()
 
     @property
     @abc.abstractmethod
@@ -36,6 +65,27 @@ class GymEvaluator(abc.ABC):
     ) -> Tuple[float, int]:
         pass
 
+    def evaluate_many(
+        self,
+        genomes: Sequence[DefaultGenome],
+        config: Config,
+    ) -> List[Tuple[float, int]]:
+        return [self.evaluate(genome, config) for genome in genomes]
+
+    def take_environment_stats(self) -> EnvironmentPoolStats:
+        return get_environment_pool().take_stats()
+
+    def take_early_stopping_stats(self) -> EarlyStoppingStats:
+        return EarlyStoppingStats()
+
+    @property
+    def records_telemetry(self) -> bool:
+        return False
+
+    def take_telemetry(self) -> Optional[List[GenomeTelemetry]]:
+        """Returns the genome timings recorded since the previous call, `None` if disabled."""
+        return None
+
 
 class MultipleRunGymEvaluator(GymEvaluator):
     def __init__(
@@ -44,6 +94,10 @@ class MultipleRunGymEvaluator(GymEvaluator):
         runs_per_network: int = 1,
         max_steps: Optional[int] = None,
         render: bool = False,
+        network_type: Type[Network] = FeedForwardNetwork,
+        environment_pool_size: int = 16,
+        early_stopping: Optional[EarlyStoppingConfig] = None,
+        telemetry: bool = False,
     ):
         super().__init__(
             environment_name=environment_name,
@@ -51,6 +105,20 @@ class MultipleRunGymEvaluator(GymEvaluator):
         )
         self._runs_per_network = runs_per_network
         self._max_steps = max_steps or float('inf')
+        # steps an episode can last, the `TimeLimit` of the environment may end it earlier
+        time_limit = gym.spec(environment_name).max_episode_steps
+        self._episode_steps = min(self._max_steps, time_limit or float('inf'))
+        self._network_type = network_type
+        self._environment_pool_size = environment_pool_size
+        self._early_stopping = early_stopping
+        self._early_stopping_rules = []
+        if early_stopping is not None:
+            self._early_stopping_rules = early_stopping.create_rules(
+                self._episode_steps, runs_per_network
+            )
+        self._stopped_episodes = EarlyStoppingStats()
+        # timings are only measured when enabled, which keeps the episode loop free of timers
+        self._telemetry: Optional[List[GenomeTelemetry]] = [] if telemetry else None
         self._num_frames = 0
 
     @property
@@ -62,23 +130,80 @@ class MultipleRunGymEvaluator(GymEvaluator):
         self._num_frames = i
 
     def evaluate(self, genome: DefaultGenome, config: Config) -> Tuple[float, int]:
-        network = FeedForwardNetwork.create(genome, config)
-        environment = gym.make(self._environment_name)
+        budget = get_budget()
+        if not budget.consume(0):
+            budget.record_cancelled()
+            return CANCELLED_FITNESS, 0
+
+        record = None
+        if self._telemetry is not None:
+            record = GenomeTelemetry(genome.key)
+            self._telemetry.append(record)
+            start = perf_counter()
+
+        network = self._network_type.create(genome, config)
+        pool = get_environment_pool(self._environment_pool_size)
+
+        fitness, optimistic_fitness, frames = 0., 0., 0
+        stopped_by = set()
+        with pool.environment(self._environment_name) as environment:
+            if record is not None:
+                record.construction_time_s = perf_counter() - start
+
+            for run in range(self._runs_per_network):
+                fit, fr, truncated, rule = self._run_episode(network, environment, budget, record)
+                fitness += fit
+                frames += fr
+                if truncated:
+                    budget.record_truncated()
+                    return fitness / (run + 1), frames
+
+                if rule is not None:
+                    stopped_by.add(rule.name)
+                    fit = self._early_stopping.optimistic_fitness(fit, fr, self._episode_steps)
+                optimistic_fitness += fit
 
-        fitness, frames = 0., 0
-        for _ in range(self._runs_per_network):
-            fit, fr = self._run_episode(network, environment)
-            fitness += fit
-            frames += fr
+        fitness /= self._runs_per_network
+        if stopped_by:
+            self._stopped_episodes.stopped_genomes[genome.key] = (
+                optimistic_fitness / self._runs_per_network,
+                frozenset(stopped_by),
+            )
 
-        return fitness / self._runs_per_network, frames
+        budget.record_fitness(fitness)
+        return fitness, frames
+
+    def take_early_stopping_stats(self) -> EarlyStoppingStats:
+        stats, self._stopped_episodes = self._stopped_episodes, EarlyStoppingStats()
+        return stats
+
+    @property
+    def records_telemetry(self) -> bool:
+        return self._telemetry is not None
+
+    def take_telemetry(self) -> Optional[List[GenomeTelemetry]]:
+        if self._telemetry is None:
+            return None
+
+        telemetry, self._telemetry = self._telemetry, []
+        return telemetry
 
     def _run_episode(
         self,
-        network: FeedForwardNetwork,
+        network: Network,
         environment: Env,
-    ) -> Tuple[float, int]:
-        observation = environment.reset()
+        budget: Budget,
+        record: Optional[GenomeTelemetry] = None,
+    ) -> Tuple[float, int, bool, Optional[EarlyStoppingRule]]:
+        if record is None:
+            observation = environment.reset()
+        else:
+            start = perf_counter()
+            observation = environment.reset()
+            record.reset_time_s += perf_counter() - start
+
+        for rule in self._early_stopping_rules:
+            rule.reset(observation)
 
         fitness = 0.0
         done = False
@@ -87,10 +212,150 @@ class MultipleRunGymEvaluator(GymEvaluator):
             if step > self._max_steps:
                 break
 
-            output = network.activate(observation)
-            action = handle_action(output, environment)
-            observation, reward, done, _ = environment.step(action)
+            if not budget.consume():
+                return fitness, step, True, None
+
+            if record is None:
+                output = network.activate(observation)
+                action = handle_action(output, environment)
+                observation, reward, done, _ = environment.step(action)
+            else:
+                start = perf_counter()
+                output = network.activate(observation)
+                action = handle_action(output, environment)
+                activated = perf_counter()
+                observation, reward, done, _ = environment.step(action)
+                record.activate_time_s += activated - start
+                record.step_time_s += perf_counter() - activated
+                record.num_frames += 1
+
             fitness += reward
             step += 1
 
-        return fitness, step
+            for rule in self._early_stopping_rules:
+                if not done and rule.should_stop(step, observation, reward, fitness):
+                    self._record_stopped(rule, step)
+                    return fitness, step, False, rule
+
+        return fitness, step, False, None
+
+    def _record_stopped(self, rule: EarlyStoppingRule, step: int):
+        self._stopped_episodes.num_stopped[rule.name] += 1
+        if not math.isinf(self._episode_steps):
+            self._stopped_episodes.frames_saved[rule.name] += max(self._episode_steps - step, 0)
+
+
+class LockstepGymEvaluator(MultipleRunGymEvaluator):
+    """
+    Evaluates a chunk of genomes together: every genome gets its own environment, and on each
+    tick observations of all running episodes are stacked and fed to a single
+    `PopulationNetwork` (or `TorchPopulationNetwork`). Finished episodes drop out of the chunk.
+    """
+
+    def __init__(
+        self,
+        environment_name: str,
+        runs_per_network: int = 1,
+        max_steps: Optional[int] = None,
+        render: bool = False,
+        environment_pool_size: int = 16,
+        recompile_threshold: float = 0.5,
+        population_network_type: PopulationNetworkType = PopulationNetwork,
+    ):
+        super().__init__(
+            environment_name=environment_name,
+            runs_per_network=runs_per_network,
+            max_steps=max_steps,
+            render=render,
+            network_type=CompiledNetwork,
+            environment_pool_size=environment_pool_size,
+        )
+        # the population network is rebuilt for the running episodes only once their share
+        # drops below this fraction of the networks it was built for
+        self._recompile_threshold = recompile_threshold
+        self._population_network_type = population_network_type
+
+    def evaluate(self, genome: DefaultGenome, config: Config) -> Tuple[float, int]:
+        return self.evaluate_many([genome], config)[0]
+
+    def evaluate_many(
+        self,
+        genomes: Sequence[DefaultGenome],
+        config: Config,
+    ) -> List[Tuple[float, int]]:
+        budget = get_budget()
+        if not budget.consume(0):
+            budget.record_cancelled(len(genomes))
+            return [(CANCELLED_FITNESS, 0)] * len(genomes)
+
+        networks = [CompiledNetwork.create(genome, config) for genome in genomes]
+        # keep a whole chunk of environments around for the next one
+        pool = get_environment_pool(max(self._environment_pool_size, len(genomes)))
+
+        fitness = np.zeros(len(genomes))
+        frames = np.zeros(len(genomes), dtype=int)
+        with ExitStack() as stack:
+            environments = [
+                stack.enter_context(pool.environment(self._environment_name)) for _ in genomes
+            ]
+            num_runs = 0
+            while num_runs < self._runs_per_network:
+                fit, fr, num_truncated = self._run_lockstep_episodes(
+                    networks, environments, budget
+                )
+                fitness += fit
+                frames += fr
+                num_runs += 1
+                if num_truncated:
+                    budget.record_truncated(num_truncated)
+                    break
+
+        fitness /= num_runs
+        return list(zip(fitness.tolist(), frames.tolist()))
+
+    def _run_lockstep_episodes(
+        self,
+        networks: Sequence[CompiledNetwork],
+        environments: Sequence[Env],
+        budget: Budget,
+    ) -> Tuple[np.ndarray, np.ndarray, int]:
+        observations = np.stack([environment.reset() for environment in environments])
+
+        fitness = np.zeros(len(networks))
+        steps = np.zeros(len(networks), dtype=int)
+        running = np.arange(len(networks))
+        population_network = self._population_network_type.create(networks)
+        compiled_for = running
+
+        step = 0
+        while len(running) and step <= self._max_steps:
+            if not budget.consume(len(running)):
+                return fitness, steps, len(running)
+
+            if len(running) < self._recompile_threshold * len(compiled_for):
+                population_network = self._population_network_type.create(
+                    [networks[i] for i in running]
+                )
+                compiled_for = running
+
+            if len(compiled_for) == len(running):
+                outputs = population_network.activate(observations[running])
+            else:
+                # feed the finished networks their last observation, their outputs are ignored
+                outputs = population_network.activate(observations[compiled_for])
+                outputs = outputs[np.isin(compiled_for, running)]
+
+            still_running = []
+            for i, output in zip(running, outputs):
+                environment = environments[i]
+                action = handle_action(output, environment)
+                observations[i], reward, done, _ = environment.step(action)
+                fitness[i] += reward
+                steps[i] += 1
+                if not done:
+                    still_running.append(i)
+
+            running = np.array(still_running, dtype=int)
+            step += 1
+
+        return fitness, steps, 0
@@ -0,0 +1,112 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+from neat import DefaultGenome
+
+
+def structural_hash(genome: DefaultGenome) -> bytes:
+    """
+    Hash of the genome's phenotype: its node genes and enabled connection genes with all their
+    attributes, in canonical order. The genome key and disabled connections are left out, so
+    elites and un-mutated offspring hash equal to the genome they were copied from.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for key in sorted(genome.nodes):
+        node = genome.nodes[key]
+        gene = (key, node.bias, node.response, node.activation, node.aggregation)
+        digest.update(repr(gene).encode())
+
+    for key in sorted(genome.connections):
+        connection = genome.connections[key]
+        if connection.enabled:
+            digest.update(repr((key, connection.weight)).encode())
+
+    return digest.digest()
+
+
+@dataclass
+class CachedFitness:
+    # running means over `num_evaluations` evaluations
+    fitness: float
+    num_frames: float
+    num_evaluations: int = 1
+
+    @property
+    def frames(self) -> int:
+        return round(self.num_frames)
+
+
+@dataclass
+class FitnessCacheStats:
+    num_hits: int = 0
+    num_misses: int = 0
+    num_frames_saved: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        num_lookups = self.num_hits + self.num_misses
+        return self.num_hits / num_lookups if num_lookups else 0.0
+
+
+class FitnessCache:
+    """
+    LRU cache of fitnesses keyed by `structural_hash`. Genomes of a stochastic environment can
+    be re-evaluated up to `max_evaluations` times, their cached fitness being the running mean
+    of the evaluations, before they are served from the cache.
+
+    Frames of the episodes served from the cache are counted as if they were played, so frame
+    budgets and logged learning curves stay comparable to runs without the cache; the cache
+    saves wall time.
+    """
+
+    def __init__(self, max_size: int = 10000, max_evaluations: int = 1):
+        self.max_size = max_size
+        self.max_evaluations = max_evaluations
+        self._entries: 'OrderedDict[bytes, CachedFitness]' = OrderedDict()
+        self._stats = FitnessCacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def partition(
+        self,
+        genomes: Sequence[DefaultGenome],
+    ) -> Tuple[List[Tuple[DefaultGenome, CachedFitness]], List[DefaultGenome]]:
+        """Splits genomes into ones served from the cache, with their entries, and ones to run."""
+        hits, misses = [], []
+        for genome in genomes:
+            key = structural_hash(genome)
+            entry = self._entries.get(key)
+            if entry is not None and entry.num_evaluations >= self.max_evaluations:
+                self._entries.move_to_end(key)
+                self._stats.num_frames_saved += entry.frames
+                hits.append((genome, entry))
+            else:
+                misses.append(genome)
+
+        self._stats.num_hits += len(hits)
+        self._stats.num_misses += len(misses)
+        return hits, misses
+
+    def update(self, genome: DefaultGenome, fitness: float, num_frames: int) -> float:
+        """Records an evaluation of the genome, returns its (mean) fitness to be assigned."""
+        key = structural_hash(genome)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = CachedFitness(fitness, num_frames)
+        else:
+            entry.num_evaluations += 1
+            entry.fitness += (fitness - entry.fitness) / entry.num_evaluations
+            entry.num_frames += (num_frames - entry.num_frames) / entry.num_evaluations
+
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        return entry.fitness
+
+    def take_stats(self) -> FitnessCacheStats:
+        stats, self._stats = self._stats, FitnessCacheStats()
+        return stats
@@ -0,0 +1,91 @@
+import numpy as np
+from neat import DefaultGenome
+from neat.genome import DefaultGenomeConfig
+
+# Genomes are encoded as a header followed by struct-of-arrays node and connection records.
+# Activation and aggregation names are stored as indices into the sorted function names known
+# to the genome config, so both ends must use the same config. Genome types storing their genes
+# in these records (see `CompactGenome`) are encoded and decoded without conversion.
+_HEADER = np.dtype([('key', '<i8'), ('num_nodes', '<i4'), ('num_connections', '<i4')])
+NODE_RECORD = np.dtype(
+    [
+        ('key', '<i4'),
+        ('bias', '<f8'),
+        ('response', '<f8'),
+        ('activation', 'u1'),
+        ('aggregation', 'u1'),
+    ]
+)
+CONNECTION_RECORD = np.dtype([('in', '<i4'), ('out', '<i4'), ('weight', '<f8'), ('enabled', '?')])
+
+
+def function_names(genome_config: DefaultGenomeConfig):
+    activations = sorted(genome_config.activation_defs.functions)
+    aggregations = sorted(genome_config.aggregation_function_defs.functions)
+    return activations, aggregations
+
+
+def encode_genome(genome: DefaultGenome, genome_config: DefaultGenomeConfig) -> bytes:
+    if hasattr(genome, 'node_genes'):
+        nodes, connections = genome.node_genes, genome.connection_genes
+        header = np.array([(genome.key, len(nodes), len(connections))], dtype=_HEADER)
+        return header.tobytes() + nodes.tobytes() + connections.tobytes()
+
+    activations, aggregations = function_names(genome_config)
+
+    header = np.array([(genome.key, len(genome.nodes), len(genome.connections))], dtype=_HEADER)
+    nodes = np.array(
+        [
+            (
+                key,
+                node.bias,
+                node.response,
+                activations.index(node.activation),
+                aggregations.index(node.aggregation),
+            )
+            for key, node in genome.nodes.items()
+        ],
+        dtype=NODE_RECORD,
+    )
+    connections = np.array(
+        [
+            (in_key, out_key, connection.weight, connection.enabled)
+            for (in_key, out_key), connection in genome.connections.items()
+        ],
+        dtype=CONNECTION_RECORD,
+    )
+
+    return header.tobytes() + nodes.tobytes() + connections.tobytes()
+
+
+def decode_genome(data: bytes, genome_type, genome_config: DefaultGenomeConfig) -> DefaultGenome:
+    header = np.frombuffer(data, dtype=_HEADER, count=1)[0]
+    offset = _HEADER.itemsize
+    nodes = np.frombuffer(data, dtype=NODE_RECORD, count=header['num_nodes'], offset=offset)
+    offset += nodes.nbytes
+    connections = np.frombuffer(
+        data, dtype=CONNECTION_RECORD, count=header['num_connections'], offset=offset
+    )
+    if hasattr(genome_type, 'from_records'):
+        # the buffer is read-only
+        return genome_type.from_records(
+            int(header['key']), nodes.copy(), connections.copy(), genome_config
+        )
+
+    activations, aggregations = function_names(genome_config)
+    genome = genome_type(int(header['key']))
+    for key, bias, response, activation, aggregation in nodes.tolist():
+        node = genome_config.node_gene_type(key)
+        node.bias = bias
+        node.response = response
+        node.activation = activations[activation]
+        node.aggregation = aggregations[aggregation]
+        genome.nodes[key] = node
+
+    for in_key, out_key, weight, enabled in connections.tolist():
+        connection = genome_config.connection_gene_type((in_key, out_key))
+        connection.weight = weight
+        connection.enabled = enabled
+        genome.connections[in_key, out_key] = connection
+
+    return genome
@@ -0,0 +1,166 @@
+import csv
+import queue
+import threading
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Logs are tables of structured rows, written either to `<name>.csv` or to numbered
+# `<name>-<chunk>.npz` files holding one array per column.
+CSV = 'csv'
+NPZ = 'npz'
+_FORMATS = (CSV, NPZ)
+
+
+class LogWriter:
+    """
+    Writes rows of log tables on a background thread. At most `max_pending` chunks of rows wait
+    to be written, `write` blocks beyond that, which bounds the memory of a slow disk.
+    """
+
+    def __init__(self, directory: Path, file_format: str = CSV, max_pending: int = 4):
+        if file_format not in _FORMATS:
+            raise ValueError(f'Unknown log format: {file_format}')
+
+        self.directory = directory
+        self.file_format = file_format
+        self.busy_time_s = 0.0
+
+        self._chunks: Dict[str, int] = {}
+        self._queue = queue.Queue(max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, name: str, rows: np.ndarray):
+        self._check()
+        self._queue.put((name, rows))
+
+    def flush(self) -> threading.Event:
+        """Returns an event set once all the rows written so far are on disk."""
+        self._check()
+        written = threading.Event()
+        self._queue.put(written)
+        return written
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('Writing logs failed') from self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            start = perf_counter()
+            try:
+                self._write(*item)
+            except BaseException as error:  # reported to the training loop by the next call
+                self._error = error
+            self.busy_time_s += perf_counter() - start
+
+    def _write(self, name: str, rows: np.ndarray):
+        if self.file_format == CSV:
+            with (self.directory / f'{name}.csv').open('a', newline='') as file:
+                writer = csv.writer(file)
+                if file.tell() == 0:
+                    writer.writerow(rows.dtype.names)
+                writer.writerows(rows.tolist())
+        else:
+            if name not in self._chunks:
+                self._chunks[name] = len(_chunk_paths(self.directory, name))
+            path = self.directory / f'{name}-{self._chunks[name]:05d}.npz'
+            np.savez_compressed(path, **{field: rows[field] for field in rows.dtype.names})
+            self._chunks[name] += 1
+
+
+class ColumnBuffer:
+    """Preallocated rows of a log table, handed over to a `LogWriter` once full."""
+
+    def __init__(self, name: str, dtype: np.dtype, writer: LogWriter, capacity: int = 1 << 16):
+        self.name = name
+        self.writer = writer
+        self._rows = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def append(self, num_rows: int) -> np.ndarray:
+        """Returns the next `num_rows` rows of the buffer, to be filled in place."""
+        if self._size + num_rows > len(self._rows):
+            self.flush()
+            if num_rows > len(self._rows):
+                self._rows = np.empty(num_rows, dtype=self._rows.dtype)
+
+        rows = self._rows[self._size : self._size + num_rows]
+        self._size += num_rows
+        return rows
+
+    def flush(self):
+        if self._size:
+            # the writer owns the filled rows from now on
+            self.writer.write(self.name, self._rows[: self._size])
+            self._rows = np.empty_like(self._rows)
+            self._size = 0
+
+
+def _chunk_paths(directory: Path, name: str) -> List[Path]:
+    return sorted(directory.glob(f'{name}-[0-9]*.npz'))
+
+
+def read_log(directory: Path, name: str, dtype: np.dtype) -> Dict[str, np.ndarray]:
+    """Columns of a log table, from its CSV file or its `.npz` chunks."""
+    path = directory / f'{name}.csv'
+    if path.exists():
+        with path.open(newline='') as file:
+            reader = csv.reader(file)
+            names = next(reader)
+            columns = list(zip(*reader)) or [()] * len(names)
+
+        # empty values (unknown fitness) are read as NaN
+        return {
+            field: np.array(
+                [value or 'nan' for value in values],
+                dtype=float if dtype[field].kind == 'f' else dtype[field],
+            )
+            for field, values in zip(names, columns)
+        }
+
+    chunks = []
+    for path in _chunk_paths(directory, name):
+        with np.load(path) as chunk:
+            chunks.append({field: chunk[field] for field in chunk.files})
+
+    return {
+        field: np.concatenate([chunk[field] for chunk in chunks] or [np.empty(0, dtype[field])])
+        for field in dtype.names
+    }
+
+
+def truncate_log(directory: Path, name: str, iteration: int):
+    """Drops the rows of a log table logged at `iteration` or later."""
+    path = directory / f'{name}.csv'
+    if path.exists():
+        with path.open(newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            column = header.index('iteration')
+            rows = [row for row in reader if int(row[column]) < iteration]
+
+        with path.open('w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    # rows are logged in iteration order, so the kept chunks stay numbered from zero
+    for path in _chunk_paths(directory, name):
+        with np.load(path) as chunk:
+            columns = {field: chunk[field] for field in chunk.files}
+
+        keep = columns['iteration'] < iteration
+        if not keep.any():
+            path.unlink()
+        elif not keep.all():
+            np.savez_compressed(path, **{field: values[keep] for field, values in columns.items()})
@@ -0,0 +1,295 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+from neat import Config, DefaultGenome
+from neat.graphs import feed_forward_layers
+
+
+def _clip(z: np.ndarray, low: float, high: float) -> np.ndarray:
+    # noticeably cheaper than `np.clip` for the small arrays of a single layer
+    return np.minimum(np.maximum(z, low), high)
+
+
+def _inv(z: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', over='ignore'):
+        result = 1.0 / z
+    return np.where(np.isfinite(result), result, 0.0)
+
+
+# NumPy counterparts of `neat.activations`, including their input clamping
+ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'sigmoid': lambda z: 1.0 / (1.0 + np.exp(-_clip(5.0 * z, -60.0, 60.0))),
+    'tanh': lambda z: np.tanh(_clip(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: np.sin(_clip(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: np.exp(-5.0 * _clip(z, -3.4, 3.4) ** 2),
+    'relu': lambda z: np.maximum(z, 0.0),
+    'softplus': lambda z: 0.2 * np.log1p(np.exp(_clip(5.0 * z, -60.0, 60.0))),
+    'identity': lambda z: z,
+    'clamped': lambda z: _clip(z, -1.0, 1.0),
+    'inv': _inv,
+    'log': lambda z: np.log(np.maximum(z, 1e-7)),
+    'exp': lambda z: np.exp(_clip(z, -60.0, 60.0)),
+    'abs': np.abs,
+    'hat': lambda z: np.maximum(0.0, 1.0 - np.abs(z)),
+    'square': np.square,
+    'cube': lambda z: z ** 3,
+}
+
+
+def _maxabs(weighted: np.ndarray) -> np.ndarray:
+    indices = np.nanargmax(np.abs(weighted), axis=-1)
+    return np.take_along_axis(weighted, indices[..., None], axis=-1)[..., 0]
+
+
+# Reductions over the last axis of a NaN-padded `(..., nodes, sources)` array, NaN marking a
+# missing connection. `sum` never reaches these, it is computed with a matrix product instead.
+AGGREGATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'product': lambda w: np.nanprod(w, axis=-1),
+    'max': lambda w: np.nanmax(w, axis=-1),
+    'min': lambda w: np.nanmin(w, axis=-1),
+    'maxabs': _maxabs,
+    'median': lambda w: np.nanmedian(w, axis=-1),
+    'mean': lambda w: np.nanmean(w, axis=-1),
+}
+
+
+class LayerGroup(NamedTuple):
+    """Nodes of one topological layer sharing an activation and an aggregation."""
+
+    layer: int
+    targets: np.ndarray  # (nodes,) indices in the value vector written by this group
+    sources: np.ndarray  # (sources,) indices in the value vector read by this group
+    weights: np.ndarray  # (nodes, sources), zero (or NaN for non-sum) where not connected
+    bias: np.ndarray
+    response: np.ndarray
+    activation: Callable[[np.ndarray], np.ndarray]
+    aggregation: str
+
+
+class CompiledNetwork:
+    """
+    Array-backed drop-in replacement for `neat.nn.FeedForwardNetwork`.
+
+    The genome is compiled into topological layers; every layer is a dense weight matrix over
+    the values it actually reads, so a single activation costs a few NumPy operations per layer
+    instead of a Python loop over every node and connection. Values are laid out as
+    `[inputs, outputs, hidden]`, so outputs that are not connected stay at 0.0, like in the
+    reference implementation.
+    """
+
+    def __init__(
+        self,
+        num_inputs: int,
+        num_outputs: int,
+        num_values: int,
+        groups: Sequence[LayerGroup],
+    ):
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.num_values = num_values
+        self.groups = tuple(groups)
+        self.values = np.zeros(num_values)
+
+    def activate(self, inputs: Sequence[float]) -> np.ndarray:
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if inputs.shape[-1] != self.num_inputs:
+            raise RuntimeError(f'Expected {self.num_inputs} inputs, got {inputs.shape[-1]}')
+
+        if inputs.ndim == 1:
+            values = self.values
+        else:
+            values = np.zeros((*inputs.shape[:-1], self.num_values))
+
+        values[..., : self.num_inputs] = inputs
+        for group in self.groups:
+            _activate_group(values, group)
+
+        return values[..., self.num_inputs : self.num_inputs + self.num_outputs].copy()
+
+    @staticmethod
+    def create(genome: DefaultGenome, config: Config) -> 'CompiledNetwork':
+        """Receives a genome and returns its compiled phenotype."""
+        genome_config = config.genome_config
+        input_keys, output_keys = genome_config.input_keys, genome_config.output_keys
+
+        connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+        layers = feed_forward_layers(input_keys, output_keys, connections)
+
+        incoming = defaultdict(list)
+        for in_key, out_key in connections:
+            incoming[out_key].append((in_key, genome.connections[in_key, out_key].weight))
+
+        index = {key: i for i, key in enumerate((*input_keys, *output_keys))}
+        for layer in layers:
+            for key in sorted(layer):
+                if key not in index:
+                    index[key] = len(index)
+
+        groups = []
+        for depth, layer in enumerate(layers):
+            by_function = defaultdict(list)
+            for key in sorted(layer):
+                node = genome.nodes[key]
+                by_function[node.activation, node.aggregation].append(key)
+
+            for (activation, aggregation), keys in by_function.items():
+                groups.append(
+                    _compile_group(depth, keys, genome, incoming, index, activation, aggregation)
+                )
+
+        return CompiledNetwork(len(input_keys), len(output_keys), len(index), groups)
+
+
+def _activate_group(values: np.ndarray, group: LayerGroup):
+    x = values[..., group.sources]
+    if group.aggregation == 'sum':
+        s = x @ group.weights.T
+    else:
+        s = AGGREGATIONS[group.aggregation](x[..., None, :] * group.weights)
+    values[..., group.targets] = group.activation(group.bias + group.response * s)
+
+
+def _compile_group(
+    depth: int,
+    keys: List[int],
+    genome: DefaultGenome,
+    incoming: Dict[int, List],
+    index: Dict[int, int],
+    activation: str,
+    aggregation: str,
+) -> LayerGroup:
+    if activation not in ACTIVATIONS:
+        raise ValueError(f'Activation {activation!r} is not supported by CompiledNetwork')
+    if aggregation != 'sum' and aggregation not in AGGREGATIONS:
+        raise ValueError(f'Aggregation {aggregation!r} is not supported by CompiledNetwork')
+
+    sources = sorted({index[in_key] for key in keys for in_key, _ in incoming[key]})
+    column = {source: i for i, source in enumerate(sources)}
+
+    weights = np.full((len(keys), len(sources)), 0.0 if aggregation == 'sum' else np.nan)
+    for row, key in enumerate(keys):
+        for in_key, weight in incoming[key]:
+            weights[row, column[index[in_key]]] = weight
+
+    return LayerGroup(
+        layer=depth,
+        targets=np.array([index[key] for key in keys]),
+        sources=np.array(sources, dtype=int),
+        weights=weights,
+        bias=np.array([genome.nodes[key].bias for key in keys]),
+        response=np.array([genome.nodes[key].response for key in keys]),
+        activation=ACTIVATIONS[activation],
+        aggregation=aggregation,
+    )
+
+
+class PopulationLayer(NamedTuple):
+    """All `sum`-aggregated nodes at one depth of a `PopulationNetwork`, stored as an edge list."""
+
+    nodes: np.ndarray  # (nodes,) indices in the flat value vector
+    edge_sources: np.ndarray  # (edges,) indices in the flat value vector
+    edge_targets: np.ndarray  # (edges,) positions in `nodes`
+    edge_weights: np.ndarray
+    bias: np.ndarray
+    response: np.ndarray
+    activations: Tuple[Tuple[Callable[[np.ndarray], np.ndarray], np.ndarray], ...]
+    other_groups: Tuple[LayerGroup, ...]  # groups with aggregations other than `sum`
+
+
+class PopulationNetwork:
+    """
+    Several `CompiledNetwork`s merged into one block-diagonal network.
+
+    Values of every network live in a single flat vector and each depth is evaluated for the
+    whole population at once, with `np.bincount` summing the weighted edges, so the cost of
+    one `activate` call barely depends on the number of networks.
+    """
+
+    def __init__(
+        self,
+        input_indices: np.ndarray,
+        output_indices: np.ndarray,
+        num_values: int,
+        layers: Sequence[PopulationLayer],
+    ):
+        self.input_indices = input_indices
+        self.output_indices = output_indices
+        self.layers = tuple(layers)
+        self.values = np.zeros(num_values)
+
+    def __len__(self):
+        return len(self.input_indices)
+
+    def activate(self, inputs: np.ndarray) -> np.ndarray:
+        """Activates network `i` with `inputs[i]`, returns outputs of shape (networks, outputs)."""
+        values = self.values
+        values[self.input_indices] = inputs
+
+        for layer in self.layers:
+            weighted = values[layer.edge_sources] * layer.edge_weights
+            s = np.bincount(layer.edge_targets, weighted, minlength=len(layer.nodes))
+            z = layer.bias + layer.response * s
+            for activation, positions in layer.activations:
+                values[layer.nodes[positions]] = activation(z[positions])
+
+            for group in layer.other_groups:
+                _activate_group(values, group)
+
+        return values[self.output_indices]
+
+    @staticmethod
+    def create(networks: Sequence[CompiledNetwork]) -> 'PopulationNetwork':
+        offsets = np.cumsum([0] + [network.num_values for network in networks])
+        input_indices = np.array(
+            [offset + np.arange(network.num_inputs) for offset, network in zip(offsets, networks)]
+        )
+        output_indices = np.array(
+            [
+                offset + network.num_inputs + np.arange(network.num_outputs)
+                for offset, network in zip(offsets, networks)
+            ]
+        )
+
+        by_depth = defaultdict(list)
+        for offset, network in zip(offsets, networks):
+            for group in network.groups:
+                by_depth[group.layer].append(
+                    group._replace(targets=group.targets + offset, sources=group.sources + offset)
+                )
+
+        layers = [_merge_groups(by_depth[depth]) for depth in sorted(by_depth)]
+        return PopulationNetwork(input_indices, output_indices, offsets[-1], layers)
+
+
+def _merge_groups(groups: Sequence[LayerGroup]) -> PopulationLayer:
+    nodes, edge_sources, edge_targets, edge_weights, bias, response = [], [], [], [], [], []
+    positions = defaultdict(list)
+    other_groups = []
+    for group in groups:
+        if group.aggregation != 'sum':
+            other_groups.append(group)
+            continue
+
+        rows, columns = np.nonzero(group.weights)
+        edge_sources.append(group.sources[columns])
+        edge_targets.append(rows + len(bias))
+        edge_weights.append(group.weights[rows, columns])
+        positions[group.activation].extend(range(len(bias), len(bias) + len(group.targets)))
+        nodes.extend(group.targets)
+        bias.extend(group.bias)
+        response.extend(group.response)
+
+    def concatenate(arrays, dtype):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+    return PopulationLayer(
+        nodes=np.array(nodes, dtype=int),
+        edge_sources=concatenate(edge_sources, int),
+        edge_targets=concatenate(edge_targets, int),
+        edge_weights=concatenate(edge_weights, float),
+        bias=np.array(bias, dtype=float),
+        response=np.array(response, dtype=float),
+        activations=tuple((f, np.array(p)) for f, p in positions.items()),
+        other_groups=tuple(other_groups),
+    )
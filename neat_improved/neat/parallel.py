@@ -0,0 +1,180 @@
+import os
+import pickle
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import AsyncResult
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from neat import Config, DefaultGenome
+
+from neat_improved.neat.budget import Budget, install_budget
+from neat_improved.neat.early_stopping import EarlyStoppingStats
+from neat_improved.neat.environment_pool import EnvironmentPoolStats
+from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.genome_encoding import decode_genome, encode_genome
+from neat_improved.neat.telemetry import TaskTelemetry
+from neat_improved.profiling import Samples, get_profiler
+
+
+class TaskResult(NamedTuple):
+    results: List[Tuple[float, int]]
+    # the worker's environment pool stats travel back with the results
+    environment_stats: EnvironmentPoolStats
+    worker_id: int
+    busy_time_s: float
+    early_stopping_stats: EarlyStoppingStats
+    telemetry: Optional[TaskTelemetry] = None  # if the evaluator records it
+    profile: Optional[Samples] = None  # if the task was profiled
+
+
+class _WorkerState(NamedTuple):
+    version: int
+    evaluator: GymEvaluator
+    config: Config
+
+
+_STATE_DIR: Optional[Path] = None
+_STATE: Optional[_WorkerState] = None
+
+
+def _state_path(state_dir: Path, version: int) -> Path:
+    return state_dir / f'state-{version}.pkl'
+
+
+def _init_worker(state_dir: Path, version: int, payload: bytes, budget: Budget):
+    global _STATE_DIR, _STATE
+    _STATE_DIR = state_dir
+    _STATE = _WorkerState(version, *pickle.loads(payload))
+    install_budget(budget)
+
+
+def _get_state(version: int) -> _WorkerState:
+    global _STATE
+    if _STATE.version != version:
+        # the pool was reused for another run, fetch the state installed for it
+        payload = _state_path(_STATE_DIR, version).read_bytes()
+        _STATE = _WorkerState(version, *pickle.loads(payload))
+
+    return _STATE
+
+
+def _evaluate_encoded(
+    version: int,
+    encoded_genomes: Sequence[bytes],
+    profile_interval_s: Optional[float] = None,
+) -> TaskResult:
+    start = perf_counter()
+    evaluator, config = _get_state(version)[1:]
+    return evaluate_encoded(evaluator, config, encoded_genomes, start, profile_interval_s)
+
+
+def evaluate_encoded(
+    evaluator: GymEvaluator,
+    config: Config,
+    encoded_genomes: Sequence[bytes],
+    start: float,
+    profile_interval_s: Optional[float] = None,
+) -> TaskResult:
+    """
+    Evaluates genomes encoded by `encode_genome`, busy time is measured since `start`. With
+    a `profile_interval_s`, the evaluation is sampled by the profiler of the worker.
+    """
+    profiler = None
+    if profile_interval_s is not None:
+        profiler = get_profiler(profile_interval_s)
+        profiler.start()
+
+    started_at = time()
+    decode_start = perf_counter()
+    genomes = [
+        decode_genome(data, config.genome_type, config.genome_config) for data in encoded_genomes
+    ]
+    decode_time_s = perf_counter() - decode_start
+    results = evaluator.evaluate_many(genomes, config)
+
+    telemetry = evaluator.take_telemetry()
+    if telemetry is not None:
+        telemetry = TaskTelemetry(telemetry, decode_time_s, started_at, finished_at=time())
+
+    profile = profiler.stop() if profiler is not None else None
+    return TaskResult(
+        results=results,
+        environment_stats=evaluator.take_environment_stats(),
+        worker_id=os.getpid(),
+        busy_time_s=perf_counter() - start,
+        early_stopping_stats=evaluator.take_early_stopping_stats(),
+        telemetry=telemetry,
+        profile=profile,
+    )
+
+
+class EvaluationPool:
+    """
+    Process pool evaluating genomes with an evaluator and a config that are shipped to every
+    worker once, by `install`, instead of with every task. Tasks carry compactly encoded
+    genomes only. The pool can be reused across runs by installing a new evaluator and config;
+    workers pick them up lazily on their next task.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None):
+        self.num_workers = num_workers or cpu_count()
+        # shared with the workers, so it has to exist before they are started
+        self.budget = Budget()
+        self.num_tasks = 0
+        self.num_bytes_sent = 0
+        self._pool: Optional[Pool] = None
+        self._state_dir = Path(tempfile.mkdtemp(prefix='neat-evaluation-pool-'))
+        self._version = 0
+        self._genome_config = None
+
+    def __enter__(self) -> 'EvaluationPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def install(self, evaluator: GymEvaluator, config: Config):
+        payload = pickle.dumps((evaluator, config), protocol=pickle.HIGHEST_PROTOCOL)
+        self._version += 1
+        self._genome_config = config.genome_config
+
+        if self._pool is None:
+            self._pool = Pool(
+                self.num_workers,
+                initializer=_init_worker,
+                initargs=(self._state_dir, self._version, payload, self.budget),
+            )
+        else:
+            _state_path(self._state_dir, self._version - 1).unlink(missing_ok=True)
+            _state_path(self._state_dir, self._version).write_bytes(payload)
+
+    def submit(
+        self,
+        genomes: Sequence[DefaultGenome],
+        callback: Optional[Callable[[TaskResult], None]] = None,
+        error_callback: Optional[Callable[[BaseException], None]] = None,
+        profile_interval_s: Optional[float] = None,
+    ) -> AsyncResult:
+        if self._pool is None:
+            raise RuntimeError('Install an evaluator before submitting genomes')
+
+        encoded = [encode_genome(genome, self._genome_config) for genome in genomes]
+        self.num_tasks += 1
+        self.num_bytes_sent += sum(map(len, encoded))
+        return self._pool.apply_async(
+            _evaluate_encoded,
+            (self._version, encoded, profile_interval_s),
+            callback=callback,
+            error_callback=error_callback,
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        shutil.rmtree(self._state_dir, ignore_errors=True)
@@ -0,0 +1,110 @@
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from neat import DefaultGenome
+
+EvaluateRound = Callable[[List[DefaultGenome]], List[Tuple[float, int]]]
+
+
+@dataclass
+class RacingStats:
+    num_episodes: int = 0
+    num_episodes_saved: int = 0
+
+
+class RacingEvaluator:
+    """
+    Races a population over up to `max_runs` episodes per genome, instead of playing all of
+    them for every genome.
+
+    Every genome plays one episode. Further rounds of one episode go only to genomes whose
+    confidence interval still overlaps the threshold of their species, the lower bound of its
+    `num_elites`-th best genome, i.e. to genomes that may still turn out to be an elite or the
+    species best. The fitness of a genome is the mean return of the episodes it played.
+
+    Episode returns are assumed to share a single noise level, estimated from all genomes that
+    played at least two episodes and carried over to the next generations. Until it is known,
+    every genome keeps racing.
+    """
+
+    def __init__(self, max_runs: int, num_elites: int = 1, confidence: float = 0.95):
+        self.max_runs = max_runs
+        self.num_elites = max(num_elites, 1)
+        self._z = NormalDist().inv_cdf((1.0 + confidence) / 2.0)
+        self._noise_std = math.inf
+        self._stats = RacingStats()
+
+    @property
+    def noise_std(self) -> float:
+        return self._noise_std
+
+    def evaluate(
+        self,
+        genomes: Sequence[DefaultGenome],
+        species_ids: Dict[int, int],
+        evaluate_round: EvaluateRound,
+    ) -> List[Tuple[float, int]]:
+        """
+        Runs the race, `evaluate_round` plays one episode of every given genome and returns
+        their `(fitness, frames)`. Returns the mean fitness and total frames of every genome.
+        """
+        returns = [[] for _ in genomes]
+        frames = [0] * len(genomes)
+        racing = list(range(len(genomes)))
+        while racing:
+            results = evaluate_round([genomes[i] for i in racing])
+            for i, (fitness, num_frames) in zip(racing, results):
+                returns[i].append(fitness)
+                frames[i] += num_frames
+
+            self._update_noise(returns)
+            racing = self._contenders(genomes, species_ids, returns)
+
+        num_episodes = sum(map(len, returns))
+        self._stats.num_episodes += num_episodes
+        self._stats.num_episodes_saved += self.max_runs * len(genomes) - num_episodes
+        return [(float(np.mean(r)), f) for r, f in zip(returns, frames)]
+
+    def take_stats(self) -> RacingStats:
+        stats, self._stats = self._stats, RacingStats()
+        return stats
+
+    def _update_noise(self, returns: List[List[float]]):
+        repeated = [r for r in returns if len(r) > 1 and np.all(np.isfinite(r))]
+        if repeated:
+            # pooled sample variance
+            sum_squares = sum(np.var(r, ddof=1) * (len(r) - 1) for r in repeated)
+            self._noise_std = math.sqrt(sum_squares / sum(len(r) - 1 for r in repeated))
+
+    def _contenders(
+        self,
+        genomes: Sequence[DefaultGenome],
+        species_ids: Dict[int, int],
+        returns: List[List[float]],
+    ) -> List[int]:
+        counts = np.array([len(r) for r in returns])
+        means = np.array([np.mean(r) for r in returns])
+        if math.isinf(self._noise_std):
+            half_widths = np.full(len(returns), math.inf)
+        else:
+            half_widths = self._z * self._noise_std / np.sqrt(counts)
+
+        species = defaultdict(list)
+        for i, genome in enumerate(genomes):
+            species[species_ids.get(genome.key)].append(i)
+
+        contenders = []
+        for members in species.values():
+            lower = np.sort(means[members] - half_widths[members])
+            threshold = lower[-min(self.num_elites, len(members))]
+            contenders.extend(
+                i
+                for i in members
+                if counts[i] < self.max_runs and means[i] + half_widths[i] >= threshold
+            )
+
+        return sorted(contenders)
@@ -1,38 +1,55 @@
 import csv
 from contextlib import contextmanager
 from pathlib import Path
-from time import time
-from typing import Iterator
+from time import perf_counter, time
+from typing import Collection, Dict, Iterator, Optional
 
+import numpy as np
 from neat.reporting import BaseReporter
 
+from neat_improved.neat.checkpoint import Checkpoint
+from neat_improved.neat.distributed import DistributedEvaluationPool
 from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.fitness_cache import FitnessCache
+from neat_improved.neat.log_writer import CSV, ColumnBuffer, LogWriter, read_log, truncate_log
+from neat_improved.neat.racing import RacingEvaluator
+from neat_improved.profiling import MergedProfile, Samples, SamplingProfiler
 
 _SPECIES = 'species'
 _POPULATION = 'population'
-_FIELDS = {
-    _SPECIES: (
-        'iteration',
-        'num_frames',
-        'time_in_s',
-        'species_id',
-        'size',
-        'age',
-        'stagnation',
-        'fitness',
-        'adjusted_fitness',
+LOG_DTYPES = {
+    _SPECIES: np.dtype(
+        [
+            ('iteration', '<i8'),
+            ('num_frames', '<i8'),
+            ('time_in_s', '<f8'),
+            ('species_id', '<i8'),
+            ('size', '<i8'),
+            ('age', '<i8'),
+            ('stagnation', '<i8'),
+            ('fitness', '<f8'),
+            ('adjusted_fitness', '<f8'),
+        ]
     ),
-    _POPULATION: (
-        'iteration',
-        'num_frames',
-        'time_in_s',
-        'individual_id',
-        'species_id',
-        'fitness',
-        'num_nodes',
-        'num_connections',
+    _POPULATION: np.dtype(
+        [
+            ('iteration', '<i8'),
+            ('num_frames', '<i8'),
+            ('time_in_s', '<f8'),
+            ('individual_id', '<i8'),
+            ('species_id', '<i8'),
+            ('fitness', '<f8'),
+            ('num_nodes', '<i8'),
+            ('num_connections', '<i8'),
+        ]
     ),
 }
+_FIELDS = {name: dtype.names for name, dtype in LOG_DTYPES.items()}
+
+
+def load_log(save_dir_path: Path, name: str) -> Dict[str, np.ndarray]:
+    """Columns of the `species` or `population` log of a run, in either format."""
+    return read_log(save_dir_path, name, LOG_DTYPES[name])
 
 
 class FileReporter(BaseReporter):
@@ -47,9 +64,13 @@ class FileReporter(BaseReporter):
         self.save_dir_path = save_dir_path
         self.save_dir_path.mkdir(exist_ok=True, parents=True)
 
-        for key, fieldnames in _FIELDS.items():
-            with self._get_writer(key, fieldnames, 'w') as file:
-                file.writeheader()
+    def restore(self, checkpoint: Checkpoint):
+        """Continues the logs of a resumed run, dropping rows logged after its checkpoint."""
+        for key in _FIELDS:
+            truncate_log(self.save_dir_path, key, checkpoint.generation)
+
+        self.generation = checkpoint.generation
+        self.start_time = time() - checkpoint.elapsed_s
 
     @contextmanager
     def _get_writer(self, filename, fieldnames, mode) -> Iterator[csv.DictWriter]:
@@ -64,7 +85,11 @@ class FileReporter(BaseReporter):
 
     def post_evaluate(self, config, population, species, best_genome):
         if self.start_time is None:
+            # headers are written with the first rows, restored runs keep those of their logs
             self.start_time = time()
+            for key, fieldnames in _FIELDS.items():
+                with self._get_writer(key, fieldnames, 'w') as writer:
+                    writer.writeheader()
 
         with self._get_writer(_POPULATION, _FIELDS[_POPULATION], 'a') as writer:
             for key, individual in population.items():
@@ -97,3 +122,228 @@ class FileReporter(BaseReporter):
                         'time_in_s': time() - self.start_time,
                     }
                 )
+
+
+class BufferedFileReporter(FileReporter):
+    """
+    `FileReporter` appending rows to preallocated column buffers, which a background thread
+    writes to CSV or to `.npz` chunks (see `log_writer`) once full, with every checkpoint and
+    on `close`. At most `buffer_size` rows per log and a few full buffers are held in memory.
+    """
+
+    def __init__(
+        self,
+        save_dir_path: Path,
+        evaluator: GymEvaluator,
+        file_format: str = CSV,
+        buffer_size: int = 1 << 16,
+    ):
+        super().__init__(save_dir_path, evaluator)
+        self.writer = LogWriter(save_dir_path, file_format)
+        self.buffers = {
+            name: ColumnBuffer(name, dtype, self.writer, buffer_size)
+            for name, dtype in LOG_DTYPES.items()
+        }
+        # time spent in the training loop by the last `post_evaluate`
+        self.post_evaluate_s = 0.0
+
+    def post_evaluate(self, config, population, species, best_genome):
+        start = perf_counter()
+        now = time()
+        if self.start_time is None:
+            self.start_time = now
+
+        genomes = list(population.values())
+        rows = self.buffers[_POPULATION].append(len(genomes))
+        rows['iteration'] = self.generation
+        rows['num_frames'] = self.evaluator.num_frames
+        rows['time_in_s'] = now - self.start_time
+        rows['individual_id'] = list(population)
+        rows['species_id'] = [species.genome_to_species[key] for key in population]
+        rows['fitness'] = [genome.fitness for genome in genomes]
+        rows['num_nodes'] = [len(genome.nodes) for genome in genomes]
+        rows['num_connections'] = [len(genome.connections) for genome in genomes]
+
+        species_list = list(species.species.values())
+        rows = self.buffers[_SPECIES].append(len(species_list))
+        rows['iteration'] = self.generation
+        rows['num_frames'] = self.evaluator.num_frames
+        rows['time_in_s'] = now - self.start_time
+        rows['species_id'] = [specie.key for specie in species_list]
+        rows['size'] = [len(specie.members) for specie in species_list]
+        rows['age'] = [self.generation - specie.created for specie in species_list]
+        rows['stagnation'] = [self.generation - specie.last_improved for specie in species_list]
+        rows['fitness'] = [specie.fitness for specie in species_list]
+        rows['adjusted_fitness'] = [specie.adjusted_fitness for specie in species_list]
+
+        self.post_evaluate_s = perf_counter() - start
+
+    def flush(self):
+        """Hands the buffered rows to the writer, returns an event set once they are on disk."""
+        for buffer in self.buffers.values():
+            buffer.flush()
+        return self.writer.flush()
+
+    def close(self):
+        self.flush().wait()
+
+
+class EnvironmentPoolReporter(BaseReporter):
+    def __init__(self, evaluator: GymEvaluator):
+        self.evaluator = evaluator
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.evaluator.environment_stats
+        print(
+            f'Environments created: {stats.num_created}, reused: {stats.num_reused}, '
+            f'construction time: {stats.construction_time_s:.3f}s, saved: {stats.saved_time_s:.3f}s'
+        )
+
+
+class WorkerUtilisationReporter(BaseReporter):
+    def __init__(self, evaluator: GymEvaluator):
+        self.evaluator = evaluator
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.evaluator.worker_stats
+        print(
+            f'Evaluation wall time: {stats.wall_time_s:.3f}s, '
+            f'worker utilisation: {100 * stats.utilisation:.1f}%'
+        )
+
+
+class TelemetryReporter(BaseReporter):
+    """Summarises where the evaluation time went, for evaluators recording telemetry."""
+
+    def __init__(self, evaluator: GymEvaluator, num_slowest: int = 3):
+        self.evaluator = evaluator
+        self.num_slowest = num_slowest
+
+    def post_evaluate(self, config, population, species, best_genome):
+        telemetry = self.evaluator.telemetry
+        if not telemetry.genomes:
+            return
+
+        times = {
+            name: sum(getattr(genome, f'{name}_time_s') for genome in telemetry.genomes)
+            for name in ('construction', 'reset', 'step', 'activate')
+        }
+        print(
+            f'Telemetry of {len(telemetry.genomes)} genomes: '
+            + ', '.join(f'{name} {seconds:.3f}s' for name, seconds in times.items())
+        )
+        slowest = ', '.join(
+            f'{genome.key} ({genome.total_time_s:.3f}s, {genome.num_frames} frames)'
+            for genome in telemetry.slowest(self.num_slowest)
+        )
+        print(f'Slowest genomes: {slowest}')
+
+        for worker_id, stats in sorted(telemetry.workers().items()):
+            print(
+                f'Worker {worker_id}: {stats.num_tasks} tasks, {stats.frames_per_s:,.0f} frames/s, '
+                f'busy {stats.busy_time_s:.3f}s, idle {stats.idle_time_s:.3f}s '
+                f'({stats.barrier_time_s:.3f}s at the barrier), IPC {stats.ipc_time_s:.3f}s'
+            )
+
+
+class ProfilingReporter(BaseReporter):
+    """
+    Profiles the selected generations with sampling profilers in the trainer and in every
+    evaluation worker (see `ParallelEvaluator`). Samples of all processes are merged, and
+    written by `close` to `profile.collapsed` and `profile.pstats` in `save_dir_path`.
+    """
+
+    def __init__(
+        self,
+        save_dir_path: Path,
+        generations: Collection[int],
+        interval_s: float = 0.005,
+    ):
+        self.save_dir_path = save_dir_path
+        self.generations = generations
+        self.interval_s = interval_s
+        self.profile = MergedProfile()
+        # samples the thread creating the reporter, the one running the training loop
+        self._profiler = SamplingProfiler(interval_s)
+        self._active = False
+
+    @property
+    def worker_interval_s(self) -> Optional[float]:
+        """Sampling interval for the workers, `None` when the generation is not profiled."""
+        return self.interval_s if self._active else None
+
+    def add_worker_samples(self, samples: Samples):
+        self.profile.add('worker', samples)
+
+    def start_generation(self, generation):
+        self._active = generation in self.generations
+        if self._active:
+            self._profiler.start()
+
+    def end_generation(self, config, population, species_set):
+        self._stop()
+
+    def close(self):
+        # the budget may run out in the middle of a profiled generation
+        self._stop()
+        if self.profile.samples.counts:
+            collapsed_path, pstats_path = self.profile.write(self.save_dir_path)
+            print(f'Profile written to {collapsed_path} and {pstats_path}')
+
+    def _stop(self):
+        if self._active:
+            self.profile.add('trainer', self._profiler.stop())
+            self._active = False
+
+
+class FitnessCacheReporter(BaseReporter):
+    def __init__(self, fitness_cache: FitnessCache):
+        self.fitness_cache = fitness_cache
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.fitness_cache.take_stats()
+        print(
+            f'Fitness cache hits: {stats.num_hits}, misses: {stats.num_misses} '
+            f'({100 * stats.hit_rate:.1f}% hit rate), frames saved: {stats.num_frames_saved}, '
+            f'entries: {len(self.fitness_cache)}'
+        )
+
+
+class RacingReporter(BaseReporter):
+    def __init__(self, racing: RacingEvaluator):
+        self.racing = racing
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.racing.take_stats()
+        print(
+            f'Racing episodes: {stats.num_episodes}, saved: {stats.num_episodes_saved}, '
+            f'return noise std: {self.racing.noise_std:.3f}'
+        )
+
+
+class EarlyStoppingReporter(BaseReporter):
+    def __init__(self, evaluator: GymEvaluator):
+        self.evaluator = evaluator
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.evaluator.early_stopping_stats
+        at_risk = stats.rankings_at_risk(population)
+        for rule, num_stopped in sorted(stats.num_stopped.items()):
+            print(
+                f'Early stopping {rule}: {num_stopped} episodes stopped, '
+                f'{stats.frames_saved[rule]} frames saved, '
+                f'{at_risk[rule]} genome rankings at risk'
+            )
+
+
+class RemoteWorkerReporter(BaseReporter):
+    def __init__(self, pool: DistributedEvaluationPool):
+        self.pool = pool
+
+    def post_evaluate(self, config, population, species, best_genome):
+        for name, stats in sorted(self.pool.worker_stats().items()):
+            status = 'alive' if stats.alive else 'dead'
+            print(
+                f'Worker {name} ({status}): {stats.num_tasks} tasks, '
+                f'{stats.genomes_per_s:.1f} genomes/s, {stats.frames_per_s:,.0f} frames/s'
+            )
@@ -0,0 +1,102 @@
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+from neat import DefaultGenome
+
+
+class FixedSizeScheduler:
+    def __init__(self, chunk_size: int = 1):
+        self.chunk_size = chunk_size
+
+    def schedule(self, genomes: Sequence[DefaultGenome]) -> List[List[DefaultGenome]]:
+        return [
+            list(genomes[i : i + self.chunk_size]) for i in range(0, len(genomes), self.chunk_size)
+        ]
+
+    def record(self, genomes: Sequence[DefaultGenome], frames: Sequence[int]):
+        pass
+
+
+class CostAwareScheduler(FixedSizeScheduler):
+    """
+    Orders genomes longest-expected-first and splits them into chunks holding a shrinking share
+    of the remaining expected cost (guided self-scheduling), so the generation ends with
+    single-genome chunks. Workers pull chunks from the pool's shared task queue, so an idle
+    worker always takes over the next pending chunk instead of waiting for a busy one.
+
+    The expected cost of a genome is its expected episode length, taken from its own previous
+    evaluation (elites) or from its parents', times a per-step cost growing with the number of
+    enabled connections.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        ancestors: Dict[int, Tuple[int, ...]],
+        min_chunk_size: int = 1,
+        chunks_per_worker: int = 2,
+        connection_cost: float = 0.01,
+    ):
+        super().__init__(chunk_size=min_chunk_size)
+        self.num_workers = num_workers
+        self.chunks_per_worker = chunks_per_worker
+        self.connection_cost = connection_cost
+        # `DefaultReproduction.ancestors`, updated in place by the reproduction
+        self._ancestors = ancestors
+        self._frames: Dict[int, int] = {}
+
+    def expected_cost(self, genome: DefaultGenome) -> float:
+        num_connections = sum(1 for c in genome.connections.values() if c.enabled)
+        return self._expected_frames(genome.key) * (1.0 + self.connection_cost * num_connections)
+
+    def _expected_frames(self, key: int) -> float:
+        if key in self._frames:
+            return self._frames[key]
+
+        parents = [p for p in self._ancestors.get(key, ()) if p in self._frames]
+        if parents:
+            return sum(self._frames[p] for p in parents) / len(parents)
+
+        if self._frames:
+            return sum(self._frames.values()) / len(self._frames)
+
+        return 1.0
+
+    def schedule(self, genomes: Sequence[DefaultGenome]) -> List[List[DefaultGenome]]:
+        costs = sorted(((self.expected_cost(g), g) for g in genomes), key=lambda c: -c[0])
+        remaining = sum(cost for cost, _ in costs)
+
+        chunks, chunk, chunk_cost = [], [], 0.0
+        target = remaining / (self.chunks_per_worker * self.num_workers)
+        for cost, genome in costs:
+            chunk.append(genome)
+            chunk_cost += cost
+            if len(chunk) >= self.chunk_size and chunk_cost >= target:
+                chunks.append(chunk)
+                remaining -= chunk_cost
+                chunk, chunk_cost = [], 0.0
+                target = remaining / (self.chunks_per_worker * self.num_workers)
+
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+    def record(self, genomes: Sequence[DefaultGenome], frames: Sequence[int]):
+        # parents of the next generation all come from the generation that was just evaluated
+        self._frames = {genome.key: num_frames for genome, num_frames in zip(genomes, frames)}
+
+
+@dataclass
+class WorkerStats:
+    num_workers: int = 0
+    wall_time_s: float = 0.0
+    busy_time_s: Dict[int, float] = field(default_factory=dict)
+
+    @property
+    def utilisation(self) -> float:
+        if not self.wall_time_s or not self.num_workers:
+            return math.nan
+
+        return sum(self.busy_time_s.values()) / (self.wall_time_s * self.num_workers)
@@ -0,0 +1,260 @@
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+from neat import DefaultGenome, DefaultSpeciesSet
+from neat.genome import DefaultGenomeConfig
+from neat.six_util import iteritems, iterkeys
+from neat.species import Species
+
+Labels = Callable[[str], int]
+
+
+def _node_attributes(genes: Sequence, labels: Labels) -> np.ndarray:
+    return np.array(
+        [(g.bias, g.response, labels(g.activation), labels(g.aggregation)) for g in genes],
+        dtype=float,
+    ).reshape(len(genes), 4)
+
+
+def _node_distances(a: np.ndarray, b: np.ndarray, weight_coefficient: float) -> np.ndarray:
+    # same operations, in the same order, as `DefaultNodeGene.distance`
+    d = np.abs(a[..., 0] - b[..., 0]) + np.abs(a[..., 1] - b[..., 1])
+    d = d + (a[..., 2] != b[..., 2])
+    d = d + (a[..., 3] != b[..., 3])
+    return d * weight_coefficient
+
+
+def _connection_attributes(genes: Sequence, labels: Labels) -> np.ndarray:
+    attributes = np.empty((len(genes), 2))
+    attributes[:, 0] = [g.weight for g in genes]
+    attributes[:, 1] = [g.enabled for g in genes]
+    return attributes
+
+
+def _connection_distances(a: np.ndarray, b: np.ndarray, weight_coefficient: float) -> np.ndarray:
+    # same operations, in the same order, as `DefaultConnectionGene.distance`
+    d = np.abs(a[..., 0] - b[..., 0]) + (a[..., 1] != b[..., 1])
+    return d * weight_coefficient
+
+
+class GeneKind(NamedTuple):
+    attribute: str  # `nodes` or `connections`
+    attributes: Callable[[Sequence, Labels], np.ndarray]  # (genes, attributes)
+    distances: Callable[[np.ndarray, np.ndarray, float], np.ndarray]
+
+
+GENE_KINDS = (
+    GeneKind('nodes', _node_attributes, _node_distances),
+    GeneKind('connections', _connection_attributes, _connection_distances),
+)
+
+
+class GeneArrays(NamedTuple):
+    """Genes of one kind of a population, sorted by genome row and then by gene key."""
+
+    columns: Dict  # gene key -> dense column
+    codes: np.ndarray  # (genes,) row * len(columns) + column, sorted
+    attributes: np.ndarray  # (genes, attributes) in the order of `codes`
+    counts: np.ndarray  # (genomes,) number of genes of every genome
+
+
+class PopulationGenes:
+    """
+    Array-backed genes of a population, computing the compatibility distances of
+    `DefaultGenome.distance` from one genome to many genomes at once.
+
+    The distance of a homologous gene and the disjoint count come from looking up the genes
+    of the first genome in the sorted `codes` of the others. Homologous gene distances are
+    summed in the gene order of the first genome, so results are bit-for-bit identical to the
+    reference implementation.
+    """
+
+    def __init__(self, genomes: Sequence[DefaultGenome], genome_config: DefaultGenomeConfig):
+        self._genome_config = genome_config
+        self._labels = {}
+        self.genes = tuple(self._encode_population(genomes, kind) for kind in GENE_KINDS)
+
+    def _label(self, value: str) -> int:
+        return self._labels.setdefault(value, len(self._labels))
+
+    def _encode_population(self, genomes: Sequence[DefaultGenome], kind: GeneKind) -> GeneArrays:
+        keys, genes = [], []
+        for genome in genomes:
+            genome_genes = getattr(genome, kind.attribute)
+            keys.extend(genome_genes)
+            genes.extend(genome_genes.values())
+
+        columns = {key: column for column, key in enumerate(dict.fromkeys(keys))}
+        counts = np.array([len(getattr(genome, kind.attribute)) for genome in genomes])
+        rows = np.repeat(np.arange(len(genomes), dtype=np.int64), counts)
+        codes = rows * len(columns) + np.array([columns[key] for key in keys], dtype=np.int64)
+        order = np.argsort(codes, kind='stable')
+        attributes = kind.attributes(genes, self._label)
+        return GeneArrays(columns, codes[order], attributes[order], counts)
+
+    def distances(self, genome: DefaultGenome, rows: np.ndarray) -> np.ndarray:
+        """`genome.distance(other)` for the population genomes at `rows`."""
+        genome_config = self._genome_config
+        total = np.zeros(len(rows))
+        for kind, arrays in zip(GENE_KINDS, self.genes):
+            genes = getattr(genome, kind.attribute)
+            if not genes and not arrays.counts[rows].any():
+                continue
+
+            if not len(arrays.codes):
+                # the population has no genes of this kind, all of the genome's are disjoint
+                disjoint = len(genes)
+                total = total + (
+                    genome_config.compatibility_disjoint_coefficient * disjoint
+                ) / disjoint
+                continue
+
+            # genes unknown to the population are disjoint with all its genomes
+            columns = np.array([arrays.columns.get(key, -1) for key in genes], dtype=np.int64)
+            attributes = kind.attributes(list(genes.values()), self._label)
+
+            queries = rows[:, None] * len(arrays.columns) + columns
+            positions = np.searchsorted(arrays.codes, queries)
+            positions = np.minimum(positions, max(len(arrays.codes) - 1, 0))
+            homologous = (columns >= 0) & (arrays.codes[positions] == queries)
+
+            gene_distances = kind.distances(
+                attributes,
+                arrays.attributes[positions],
+                genome_config.compatibility_weight_coefficient,
+            )
+            gene_distances = np.where(homologous, gene_distances, 0.0)
+            # `cumsum` adds sequentially, unlike the pairwise summation of `sum`
+            distance = gene_distances.cumsum(axis=1)[:, -1] if len(genes) else 0.0
+
+            counts = arrays.counts[rows]
+            disjoint = len(genes) + counts - 2 * homologous.sum(axis=1)
+            max_genes = np.maximum(len(genes), counts)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                distance = (
+                    distance + genome_config.compatibility_disjoint_coefficient * disjoint
+                ) / max_genes
+            total = total + np.where(max_genes > 0, distance, 0.0)
+
+        return total
+
+
+class VectorizedSpeciesSet(DefaultSpeciesSet):
+    """
+    Drop-in replacement of `DefaultSpeciesSet` computing compatibility distances with
+    `PopulationGenes`, a representative against the whole population at a time. Genomes are
+    visited in the same order as in `DefaultSpeciesSet.speciate`, so the resulting species,
+    representatives and members are identical.
+    """
+
+    def speciate(self, config, population, generation):
+        assert isinstance(population, dict)
+
+        compatibility_threshold = self.species_set_config.compatibility_threshold
+        row_of = {key: row for row, key in enumerate(population)}
+        genes = PopulationGenes(list(population.values()), config.genome_config)
+
+        # built like in `DefaultSpeciesSet.speciate`, so that it is iterated in the same order
+        unspeciated = set(iterkeys(population))
+        # (representative keys, genome keys, distances) for the reported statistics
+        computed: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+        # Find the best representatives for each existing species.
+        new_representatives = {}
+        new_members = {}
+        for sid, s in iteritems(self.species):
+            candidates = np.fromiter(unspeciated, dtype=np.int64, count=len(unspeciated))
+            distances = genes.distances(s.representative, _keys_to_rows(candidates, row_of))
+            computed.append((np.full(len(candidates), s.representative.key), candidates, distances))
+
+            # The new representative is the genome closest to the current representative.
+            new_rid = int(candidates[np.argmin(distances)])
+            new_representatives[sid] = new_rid
+            new_members[sid] = [new_rid]
+            unspeciated.remove(new_rid)
+
+        # distances from every representative to every genome, grown with new species
+        all_rows = np.arange(len(population))
+        capacity = max(len(new_representatives), 16)
+        representative_distances = np.empty((capacity, len(population)))
+        representative_keys = np.empty(capacity, dtype=np.int64)
+        species_ids = []
+
+        def add_representative(sid, rid):
+            nonlocal representative_distances, representative_keys
+            if len(species_ids) == len(representative_keys):
+                representative_distances = np.concatenate(
+                    [representative_distances, np.empty_like(representative_distances)]
+                )
+                representative_keys = np.concatenate(
+                    [representative_keys, np.empty_like(representative_keys)]
+                )
+            representative_distances[len(species_ids)] = genes.distances(population[rid], all_rows)
+            representative_keys[len(species_ids)] = rid
+            species_ids.append(sid)
+
+        for sid, rid in new_representatives.items():
+            add_representative(sid, rid)
+
+        # Partition population into species based on genetic similarity.
+        while unspeciated:
+            gid = unspeciated.pop()
+
+            # Find the species with the most similar representative.
+            num_species = len(species_ids)
+            distances = representative_distances[:num_species, row_of[gid]]
+            computed.append(
+                (representative_keys[:num_species], np.full(num_species, gid), distances.copy())
+            )
+            compatible = distances < compatibility_threshold
+            if compatible.any():
+                sid = species_ids[np.argmin(np.where(compatible, distances, np.inf))]
+                new_members[sid].append(gid)
+            else:
+                # No species is similar enough, create a new species, using
+                # this genome as its representative.
+                sid = next(self.indexer)
+                new_representatives[sid] = gid
+                new_members[sid] = [gid]
+                add_representative(sid, gid)
+
+        # Update species collection based on new speciation.
+        self.genome_to_species = {}
+        for sid, rid in iteritems(new_representatives):
+            s = self.species.get(sid)
+            if s is None:
+                s = Species(sid, generation)
+                self.species[sid] = s
+
+            members = new_members[sid]
+            for gid in members:
+                self.genome_to_species[gid] = sid
+
+            member_dict = dict((gid, population[gid]) for gid in members)
+            s.update(population[rid], member_dict)
+
+        gdmean, gdstdev = _distance_statistics(computed)
+        self.reporters.info(
+            'Mean genetic distance {0:.3f}, standard deviation {1:.3f}'.format(gdmean, gdstdev)
+        )
+
+
+def _keys_to_rows(genome_keys: np.ndarray, row_of: Dict[int, int]) -> np.ndarray:
+    return np.array([row_of[key] for key in genome_keys.tolist()], dtype=np.int64)
+
+
+def _distance_statistics(
+    computed: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+) -> Tuple[float, float]:
+    """
+    Mean and standard deviation of the distances as they end up in `GenomeDistanceCache`: each
+    pair is stored once per direction, and a pair computed again is a cache hit.
+    """
+    first, second, distances = (np.concatenate(arrays) for arrays in zip(*computed))
+    low, high = np.minimum(first, second), np.maximum(first, second)
+    _, unique = np.unique((low << 32) + high, return_index=True)
+    weights = np.where(low[unique] == high[unique], 1, 2)
+    distances = distances[unique]
+    mean = np.sum(weights * distances) / np.sum(weights)
+    variance = np.sum(weights * (distances - mean) ** 2) / np.sum(weights)
+    return float(mean), float(np.sqrt(variance))
@@ -0,0 +1,264 @@
+import math
+import random
+from collections import deque
+from queue import SimpleQueue
+from time import perf_counter
+from typing import Dict, Optional
+
+from neat import DefaultGenome, Population
+from neat.math_util import mean
+from neat.population import CompleteExtinctionException
+from neat.species import Species
+
+from neat_improved.neat.early_stopping import EarlyStoppingStats
+from neat_improved.neat.environment_pool import EnvironmentPoolStats
+from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.parallel import EvaluationPool, TaskResult
+from neat_improved.neat.scheduling import WorkerStats
+
+# breeding weight of species without a (positive) adjusted fitness yet
+_MIN_SPECIES_WEIGHT = 0.05
+
+
+class SteadyStateEvolution:
+    """
+    Asynchronous steady-state variant of `neat.Population.run`.
+
+    Every evaluated genome immediately joins the population, replacing the genome with the
+    worst fitness shared within its species (species champions are kept), and a new offspring
+    bred from the current species state is sent to the freed worker, so workers never wait for
+    a generation barrier. Every `pop_size` insertions form a pseudo-generation: reporters are
+    called as in the generational loop, stagnation and adjusted fitnesses are updated and the
+    population is re-speciated.
+    """
+
+    def __init__(
+        self,
+        population: Population,
+        pool: EvaluationPool,
+        evaluator: GymEvaluator,
+        max_in_flight: Optional[int] = None,
+    ):
+        self.population = population
+        self.pool = pool
+        self.evaluator = evaluator
+        self.max_in_flight = max_in_flight or 2 * pool.num_workers
+
+        self._config = population.config
+        self._species = population.species
+        self._reproduction = population.reproduction
+        self._reporters = population.reporters
+        self._pop_size = self._config.pop_size
+
+        self._evaluated: Dict[int, DefaultGenome] = {}
+        self._results = SimpleQueue()
+        self._num_in_flight = 0
+        self._num_inserted = 0
+        self._environment_stats = EnvironmentPoolStats()
+        self._worker_stats = WorkerStats()
+        self._early_stopping_stats = EarlyStoppingStats()
+        self._generation_start = perf_counter()
+
+    def run(self, max_num_frames: float) -> DefaultGenome:
+        budget = self.pool.budget
+        unevaluated = deque(self.population.population.values())
+        self._start_generation()
+
+        stop = False
+        while not stop or self._num_in_flight:
+            while not stop and self._num_in_flight < self.max_in_flight:
+                if unevaluated:
+                    self._submit(unevaluated.popleft())
+                elif self._evaluated:
+                    self._submit(self._breed())
+                else:
+                    # nothing to breed from until the first evaluation comes back
+                    break
+
+            genome, task = self._get_result()
+            # workers flush frames lazily, so an interrupted evaluation may be the first sign
+            interrupted = budget.num_truncated + budget.num_cancelled
+            if self.evaluator.num_frames >= max_num_frames or budget.exhausted() or interrupted:
+                stop = True
+
+            if stop:
+                # evaluations finishing after the stop may have been truncated by the budget
+                self.evaluator.num_frames += sum(frames for _, frames in task.results)
+                continue
+
+            self._insert(genome, task)
+            if self._num_inserted % self._pop_size == 0:
+                stop = self._end_generation()
+
+        self.population.population = dict(self._evaluated)
+        return self.population.best_genome
+
+    def _submit(self, genome: DefaultGenome):
+        self._num_in_flight += 1
+        self.pool.submit(
+            [genome],
+            callback=lambda task: self._results.put((genome, task)),
+            error_callback=lambda error: self._results.put((genome, error)),
+        )
+
+    def _get_result(self):
+        genome, task = self._results.get()
+        self._num_in_flight -= 1
+        if isinstance(task, BaseException):
+            raise task
+
+        return genome, task
+
+    def _insert(self, genome: DefaultGenome, task: TaskResult):
+        [(genome.fitness, num_frames)] = task.results
+        self.evaluator.num_frames += num_frames
+        self._environment_stats += task.environment_stats
+        self._early_stopping_stats += task.early_stopping_stats
+        busy_time = self._worker_stats.busy_time_s.get(task.worker_id, 0.0)
+        self._worker_stats.busy_time_s[task.worker_id] = busy_time + task.busy_time_s
+
+        if len(self._evaluated) >= self._pop_size:
+            self._remove(self._worst_genome())
+
+        self._evaluated[genome.key] = genome
+        self._speciate(genome)
+        self._num_inserted += 1
+
+        best = self.population.best_genome
+        if best is None or genome.fitness > best.fitness:
+            self.population.best_genome = genome
+
+    def _worst_genome(self) -> DefaultGenome:
+        champions = set()
+        for s in self._species.species.values():
+            members = [m for m in s.members.values() if m.key in self._evaluated]
+            if members:
+                champions.add(max(members, key=lambda m: m.fitness).key)
+
+        candidates = [g for key, g in self._evaluated.items() if key not in champions]
+        # like the adjusted fitness of `DefaultReproduction`, fitnesses are shifted to start at 0
+        # before sharing, dividing negative fitnesses would favour the genomes of large species
+        min_fitness = min(g.fitness for g in self._evaluated.values())
+
+        def shared_fitness(genome: DefaultGenome):
+            species_size = len(self._species.get_species(genome.key).members)
+            # ties, e.g. of the genomes with the minimum fitness, go to the largest species
+            return (genome.fitness - min_fitness) / species_size, -species_size
+
+        return min(candidates or self._evaluated.values(), key=shared_fitness)
+
+    def _remove(self, genome: DefaultGenome):
+        del self._evaluated[genome.key]
+        sid = self._species.genome_to_species.pop(genome.key)
+        species = self._species.species[sid]
+        del species.members[genome.key]
+        if not species.members:
+            del self._species.species[sid]
+
+    def _speciate(self, genome: DefaultGenome):
+        if genome.key in self._species.genome_to_species:
+            # a genome of the initial population, speciated by `Population`
+            return
+
+        genome_config = self._config.genome_config
+        threshold = self._species.species_set_config.compatibility_threshold
+        candidates = [
+            (genome.distance(s.representative, genome_config), sid)
+            for sid, s in self._species.species.items()
+        ]
+        distance, sid = min(candidates, default=(math.inf, None), key=lambda c: c[0])
+        if distance >= threshold:
+            sid = next(self._species.indexer)
+            species = Species(sid, self.population.generation)
+            species.representative = genome
+            self._species.species[sid] = species
+
+        self._species.species[sid].members[genome.key] = genome
+        self._species.genome_to_species[genome.key] = sid
+
+    def _breed(self) -> DefaultGenome:
+        candidates = []
+        for s in self._species.species.values():
+            members = [m for m in s.members.values() if m.key in self._evaluated]
+            if members:
+                candidates.append((s, members))
+
+        weights = [max(s.adjusted_fitness or 0.0, _MIN_SPECIES_WEIGHT) for s, _ in candidates]
+        species, members = random.choices(candidates, weights)[0]
+
+        # as in `DefaultReproduction.reproduce`, parents come from the fittest members
+        reproduction_config = self._reproduction.reproduction_config
+        members.sort(reverse=True, key=lambda m: m.fitness)
+        cutoff = max(math.ceil(reproduction_config.survival_threshold * len(members)), 2)
+        parent1 = random.choice(members[:cutoff])
+        parent2 = random.choice(members[:cutoff])
+
+        key = next(self._reproduction.genome_indexer)
+        child = self._config.genome_type(key)
+        child.configure_crossover(parent1, parent2, self._config.genome_config)
+        child.mutate(self._config.genome_config)
+        self._reproduction.ancestors[key] = (parent1.key, parent2.key)
+        return child
+
+    def _start_generation(self):
+        self._reporters.start_generation(self.population.generation)
+        self._environment_stats = EnvironmentPoolStats()
+        self._worker_stats = WorkerStats(num_workers=self.pool.num_workers)
+        self._early_stopping_stats = EarlyStoppingStats()
+        self._generation_start = perf_counter()
+
+    def _end_generation(self) -> bool:
+        """Closes the current pseudo-generation, returns whether evolution should stop."""
+        self._worker_stats.wall_time_s = perf_counter() - self._generation_start
+        self.evaluator.environment_stats = self._environment_stats
+        self.evaluator.worker_stats = self._worker_stats
+        self.evaluator.early_stopping_stats = self._early_stopping_stats
+
+        # drop initial genomes that are still being evaluated from the species
+        for sid, s in list(self._species.species.items()):
+            s.members = {k: m for k, m in s.members.items() if k in self._evaluated}
+            if not s.members:
+                del self._species.species[sid]
+
+        population = dict(self._evaluated)
+        best = max(population.values(), key=lambda g: g.fitness)
+        self._reporters.post_evaluate(self._config, population, self._species, best)
+
+        if not self._config.no_fitness_termination:
+            fv = self.population.fitness_criterion(g.fitness for g in population.values())
+            if fv >= self._config.fitness_threshold:
+                self._reporters.found_solution(self._config, self.population.generation, best)
+                return True
+
+        self._update_species_fitness()
+        if not self._species.species:
+            self._reporters.complete_extinction()
+            raise CompleteExtinctionException()
+
+        self._species.speciate(self._config, self._evaluated, self.population.generation)
+        self._reporters.end_generation(self._config, self._evaluated, self._species)
+        self.population.generation += 1
+        self._start_generation()
+        return False
+
+    def _update_species_fitness(self):
+        # mirrors the stagnation handling and adjusted fitness of `DefaultReproduction.reproduce`
+        generation = self.population.generation
+        remaining = []
+        for sid, s, stagnant in self._reproduction.stagnation.update(self._species, generation):
+            if stagnant:
+                self._reporters.species_stagnant(sid, s)
+                for key in list(s.members):
+                    self._remove(self._evaluated[key])
+            else:
+                remaining.append(s)
+
+        if not remaining:
+            return
+
+        fitnesses = [m.fitness for s in remaining for m in s.members.values()]
+        min_fitness = min(fitnesses)
+        fitness_range = max(1.0, max(fitnesses) - min_fitness)
+        for s in remaining:
+            msf = mean(m.fitness for m in s.members.values())
+            s.adjusted_fitness = (msf - min_fitness) / fitness_range
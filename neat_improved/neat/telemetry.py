@@ -0,0 +1,84 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple
+
+
+@dataclass
+class GenomeTelemetry:
+    """Where the evaluation time of a genome went, summed over its episodes."""
+
+    key: int
+    construction_time_s: float = 0.0  # creating the network and getting an environment
+    reset_time_s: float = 0.0
+    step_time_s: float = 0.0
+    activate_time_s: float = 0.0
+    num_frames: int = 0
+
+    @property
+    def total_time_s(self) -> float:
+        return (
+            self.construction_time_s + self.reset_time_s + self.step_time_s + self.activate_time_s
+        )
+
+
+class TaskTelemetry(NamedTuple):
+    """
+    Timings of a task evaluated by a worker. Timestamps come from `time()` of the worker and of
+    the trainer, so the transfer times are only meaningful on the same host or with
+    synchronised clocks.
+    """
+
+    genomes: List[GenomeTelemetry]
+    decode_time_s: float
+    started_at: float
+    finished_at: float
+    submit_time_s: float = 0.0  # encoding and sending, set by the trainer
+    received_at: float = 0.0  # set by the trainer when the result arrives
+
+    @property
+    def ipc_time_s(self) -> float:
+        # the result transfer ends when the result arrives in the trainer, before it is picked up
+        return self.submit_time_s + self.decode_time_s + (self.received_at - self.finished_at)
+
+
+class WorkerTelemetry(NamedTuple):
+    num_tasks: int
+    num_frames: int
+    busy_time_s: float
+    idle_time_s: float
+    barrier_time_s: float  # idle at the end of the generation, waiting for stragglers
+    ipc_time_s: float
+
+    @property
+    def frames_per_s(self) -> float:
+        return self.num_frames / self.busy_time_s if self.busy_time_s else 0.0
+
+
+@dataclass
+class GenerationTelemetry:
+    genomes: List[GenomeTelemetry] = field(default_factory=list)
+    tasks: Dict[int, List[TaskTelemetry]] = field(default_factory=dict)  # by worker id
+    started_at: float = 0.0
+    finished_at: float = 0.0
+
+    def add_task(self, worker_id: int, task: TaskTelemetry):
+        self.genomes.extend(task.genomes)
+        self.tasks.setdefault(worker_id, []).append(task)
+
+    def workers(self) -> Dict[int, WorkerTelemetry]:
+        wall_time_s = self.finished_at - self.started_at
+        workers = {}
+        for worker_id, tasks in self.tasks.items():
+            busy_time_s = sum(task.finished_at - task.started_at for task in tasks)
+            workers[worker_id] = WorkerTelemetry(
+                num_tasks=len(tasks),
+                num_frames=sum(g.num_frames for task in tasks for g in task.genomes),
+                busy_time_s=busy_time_s,
+                idle_time_s=max(wall_time_s - busy_time_s, 0.0),
+                barrier_time_s=max(self.finished_at - max(t.finished_at for t in tasks), 0.0),
+                ipc_time_s=sum(task.ipc_time_s for task in tasks),
+            )
+
+        return workers
+
+    def slowest(self, n: int = 1) -> List[GenomeTelemetry]:
+        return sorted(self.genomes, key=lambda g: -g.total_time_s)[:n]
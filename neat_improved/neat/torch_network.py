@@ -0,0 +1,239 @@
+import warnings
+from collections import defaultdict
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from neat_improved.neat.network import ACTIVATIONS, CompiledNetwork, LayerGroup
+
+TorchFunction = Callable[[torch.Tensor], torch.Tensor]
+
+
+def _clamp(z: torch.Tensor, low: float, high: float) -> torch.Tensor:
+    return torch.clamp(z, low, high)
+
+
+def _inv(z: torch.Tensor) -> torch.Tensor:
+    result = 1.0 / z
+    return torch.where(torch.isfinite(result), result, torch.zeros_like(result))
+
+
+# torch counterparts of `ACTIVATIONS`
+TORCH_ACTIVATIONS: Dict[str, TorchFunction] = {
+    'sigmoid': lambda z: torch.sigmoid(_clamp(5.0 * z, -60.0, 60.0)),
+    'tanh': lambda z: torch.tanh(_clamp(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: torch.sin(_clamp(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: torch.exp(-5.0 * _clamp(z, -3.4, 3.4) ** 2),
+    'relu': torch.relu,
+    'softplus': lambda z: 0.2 * torch.log1p(torch.exp(_clamp(5.0 * z, -60.0, 60.0))),
+    'identity': lambda z: z,
+    'clamped': lambda z: _clamp(z, -1.0, 1.0),
+    'inv': _inv,
+    'log': lambda z: torch.log(torch.clamp(z, min=1e-7)),
+    'exp': lambda z: torch.exp(_clamp(z, -60.0, 60.0)),
+    'abs': torch.abs,
+    'hat': lambda z: torch.clamp(1.0 - torch.abs(z), min=0.0),
+    'square': torch.square,
+    'cube': lambda z: z ** 3,
+}
+_ACTIVATION_NAMES = {function: name for name, function in ACTIVATIONS.items()}
+
+
+def _maxabs(weighted: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+    indices = torch.where(mask, weighted.abs(), torch.full_like(weighted, -1.0)).argmax(dim=-1)
+    return weighted.gather(-1, indices[:, None])[:, 0]
+
+
+# Reductions over the connected entries (`mask`) of padded `(nodes, max_sources)` rows
+TORCH_AGGREGATIONS: Dict[str, Callable[[torch.Tensor, torch.Tensor], torch.Tensor]] = {
+    'sum': lambda w, mask: torch.where(mask, w, torch.zeros_like(w)).sum(dim=-1),
+    'product': lambda w, mask: torch.where(mask, w, torch.ones_like(w)).prod(dim=-1),
+    'max': lambda w, mask: torch.where(mask, w, torch.full_like(w, -np.inf)).amax(dim=-1),
+    'min': lambda w, mask: torch.where(mask, w, torch.full_like(w, np.inf)).amin(dim=-1),
+    'maxabs': _maxabs,
+    # unlike `nanmedian`, averages the two middle entries of an even count like NumPy
+    'median': lambda w, mask: torch.where(mask, w, torch.full_like(w, np.nan)).nanquantile(0.5, -1),
+    'mean': lambda w, mask: torch.where(mask, w, torch.zeros_like(w)).sum(dim=-1) / mask.sum(-1),
+}
+
+
+class TorchPopulationLayer(NamedTuple):
+    """All nodes at one depth of a `TorchPopulationNetwork`."""
+
+    nodes: torch.Tensor  # (nodes,) indices in the flat value vector
+    bias: torch.Tensor
+    response: torch.Tensor
+    # `sum` nodes computed with one sparse matrix-vector product (sparse layout only)
+    sparse_positions: torch.Tensor  # (sparse nodes,) positions in `nodes`
+    sparse_weights: Optional[torch.Tensor]  # CSR (sparse nodes, values)
+    # all the other nodes, their incoming connections padded to the largest in-degree
+    padded_positions: torch.Tensor  # (padded nodes,) positions in `nodes`
+    padded_sources: torch.Tensor  # (padded nodes, max in-degree) indices in the value vector
+    padded_weights: torch.Tensor
+    padded_mask: torch.Tensor  # connected entries of the padded rows
+    aggregations: Tuple[Tuple[str, torch.Tensor], ...]  # rows of the padded nodes
+    activations: Tuple[Tuple[TorchFunction, torch.Tensor], ...]  # positions in `nodes`
+
+
+class TorchPopulationNetwork:
+    """
+    torch engine with the interface of `PopulationNetwork`: a generation of `CompiledNetwork`s
+    is packed into one block-diagonal network over a flat value vector, and every topological
+    depth is activated for all networks at once. Networks shallower than the deepest one
+    simply have no nodes in the last depths.
+
+    With the `sparse` layout, the `sum` nodes of a depth are a single sparse CSR matrix
+    (falling back to `padded` on torch builds without CSR support). With the `padded` layout,
+    and for other aggregations, the incoming connections of every node are padded to the
+    largest in-degree of the depth and reduced with per-aggregation node masks. Activation
+    functions are applied through per-activation node masks.
+
+    Evaluations run in worker processes, which should limit torch to a single thread
+    (`torch.set_num_threads(1)`) to avoid oversubscribing the cores.
+    """
+
+    def __init__(
+        self,
+        input_indices: torch.Tensor,
+        output_indices: torch.Tensor,
+        num_values: int,
+        layers: Sequence[TorchPopulationLayer],
+    ):
+        self.input_indices = input_indices
+        self.output_indices = output_indices
+        self.layers = tuple(layers)
+        self.values = torch.zeros(num_values, dtype=torch.float64)
+
+    def __len__(self):
+        return len(self.input_indices)
+
+    def activate(self, inputs: np.ndarray) -> np.ndarray:
+        """Activates network `i` with `inputs[i]`, returns outputs of shape (networks, outputs)."""
+        values = self.values
+        values[self.input_indices] = torch.as_tensor(inputs, dtype=torch.float64)
+
+        for layer in self.layers:
+            s = torch.empty(len(layer.nodes), dtype=torch.float64)
+            if layer.sparse_weights is not None:
+                s[layer.sparse_positions] = torch.mv(layer.sparse_weights, values)
+
+            if len(layer.padded_positions):
+                weighted = values[layer.padded_sources] * layer.padded_weights
+                for aggregation, rows in layer.aggregations:
+                    s[layer.padded_positions[rows]] = TORCH_AGGREGATIONS[aggregation](
+                        weighted[rows], layer.padded_mask[rows]
+                    )
+
+            z = layer.bias + layer.response * s
+            for activation, positions in layer.activations:
+                values[layer.nodes[positions]] = activation(z[positions])
+
+        return values[self.output_indices].numpy()
+
+    @staticmethod
+    def create(
+        networks: Sequence[CompiledNetwork],
+        layout: str = 'sparse',
+    ) -> 'TorchPopulationNetwork':
+        if layout not in ('sparse', 'padded'):
+            raise ValueError(f'Unknown layout {layout!r}')
+        if not hasattr(torch, 'sparse_csr_tensor'):
+            layout = 'padded'
+
+        offsets = np.cumsum([0] + [network.num_values for network in networks])
+        input_indices = [
+            offset + np.arange(network.num_inputs) for offset, network in zip(offsets, networks)
+        ]
+        output_indices = [
+            offset + network.num_inputs + np.arange(network.num_outputs)
+            for offset, network in zip(offsets, networks)
+        ]
+
+        by_depth = defaultdict(list)
+        for offset, network in zip(offsets, networks):
+            for group in network.groups:
+                by_depth[group.layer].append(
+                    group._replace(targets=group.targets + offset, sources=group.sources + offset)
+                )
+
+        num_values = int(offsets[-1])
+        layers = [_pack_groups(by_depth[depth], num_values, layout) for depth in sorted(by_depth)]
+        return TorchPopulationNetwork(
+            torch.as_tensor(np.array(input_indices, dtype=np.int64)),
+            torch.as_tensor(np.array(output_indices, dtype=np.int64)),
+            num_values,
+            layers,
+        )
+
+
+def _pack_groups(groups: Sequence[LayerGroup], num_values: int, layout: str):
+    nodes, bias, response = [], [], []
+    activations, aggregations = defaultdict(list), defaultdict(list)
+    # sum nodes of the sparse layout: (row, source, weight) entries
+    sparse_positions, sparse_entries = [], []
+    # every other node: (sources, weights) of its incoming connections
+    padded_positions, padded_rows = [], []
+    for group in groups:
+        connected = group.weights != 0.0 if group.aggregation == 'sum' else ~np.isnan(group.weights)
+        for row, target in enumerate(group.targets):
+            position = len(nodes)
+            columns = np.flatnonzero(connected[row])
+            if layout == 'sparse' and group.aggregation == 'sum':
+                sparse_row = len(sparse_positions)
+                sparse_entries.extend(
+                    (sparse_row, group.sources[c], group.weights[row, c]) for c in columns
+                )
+                sparse_positions.append(position)
+            else:
+                aggregations[group.aggregation].append(len(padded_positions))
+                padded_positions.append(position)
+                padded_rows.append((group.sources[columns], group.weights[row, columns]))
+
+            nodes.append(target)
+            bias.append(group.bias[row])
+            response.append(group.response[row])
+            activations[_ACTIVATION_NAMES[group.activation]].append(position)
+
+    sparse_weights = None
+    if sparse_positions:
+        rows, columns, weights = zip(*sparse_entries) if sparse_entries else ((), (), ())
+        # entries are ordered by row, so the row pointers are their cumulative counts
+        counts = np.bincount(np.array(rows, dtype=np.int64), minlength=len(sparse_positions))
+        with warnings.catch_warnings():
+            # CSR support is marked as beta
+            warnings.simplefilter('ignore', UserWarning)
+            sparse_weights = torch.sparse_csr_tensor(
+                torch.as_tensor(np.concatenate([[0], np.cumsum(counts)]), dtype=torch.int64),
+                torch.as_tensor(np.array(columns, dtype=np.int64)),
+                torch.as_tensor(np.array(weights, dtype=np.float64)),
+                size=(len(sparse_positions), num_values),
+            )
+
+    max_in_degree = max((len(sources) for sources, _ in padded_rows), default=0)
+    padded_sources = np.zeros((len(padded_rows), max_in_degree), dtype=np.int64)
+    padded_weights = np.zeros((len(padded_rows), max_in_degree))
+    padded_mask = np.zeros((len(padded_rows), max_in_degree), dtype=bool)
+    for row, (sources, weights) in enumerate(padded_rows):
+        padded_sources[row, : len(sources)] = sources
+        padded_weights[row, : len(weights)] = weights
+        padded_mask[row, : len(sources)] = True
+
+    def indices(values) -> torch.Tensor:
+        return torch.as_tensor(np.array(values, dtype=np.int64))
+
+    return TorchPopulationLayer(
+        nodes=indices(nodes),
+        bias=torch.as_tensor(np.array(bias, dtype=np.float64)),
+        response=torch.as_tensor(np.array(response, dtype=np.float64)),
+        sparse_positions=indices(sparse_positions),
+        sparse_weights=sparse_weights,
+        padded_positions=indices(padded_positions),
+        padded_sources=torch.as_tensor(padded_sources),
+        padded_weights=torch.as_tensor(padded_weights),
+        padded_mask=torch.as_tensor(padded_mask),
+        aggregations=tuple((name, indices(rows)) for name, rows in aggregations.items()),
+        activations=tuple(
+            (TORCH_ACTIVATIONS[name], indices(positions)) for name, positions in activations.items()
+        ),
+    )
@@ -1,13 +1,24 @@
 import multiprocessing
-from functools import wraps
-from multiprocessing import Pool
-from time import time
-from typing import Optional, Sequence, Tuple, Callable
+from contextlib import ExitStack
+from pathlib import Path
+from time import perf_counter, time
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
 
-from neat import Config, DefaultGenome, Population
+from neat import Config, DefaultGenome, DefaultSpeciesSet, Population
 from neat.reporting import BaseReporter
 
+from neat_improved.neat.budget import Budget, get_budget
+from neat_improved.neat.checkpoint import Checkpointer, load_checkpoint, restore_checkpoint
+from neat_improved.neat.early_stopping import EarlyStoppingStats
+from neat_improved.neat.environment_pool import EnvironmentPoolStats
 from neat_improved.neat.evaluator import GymEvaluator
+from neat_improved.neat.fitness_cache import CachedFitness, FitnessCache
+from neat_improved.neat.parallel import EvaluationPool
+from neat_improved.neat.racing import EvaluateRound, RacingEvaluator
+from neat_improved.neat.reporters import ProfilingReporter
+from neat_improved.neat.scheduling import CostAwareScheduler, FixedSizeScheduler, WorkerStats
+from neat_improved.neat.steady_state import SteadyStateEvolution
+from neat_improved.neat.telemetry import GenerationTelemetry
 from neat_improved.trainer import BaseTrainer
 
 
@@ -18,93 +29,367 @@ class NEATRunner(BaseTrainer):
         evaluator: GymEvaluator,
         reporters: Optional[Sequence[BaseReporter]] = None,
         num_workers: Optional[int] = multiprocessing.cpu_count(),
+        chunk_size: int = 1,
+        pool: Optional[EvaluationPool] = None,
+        cost_aware_scheduling: bool = False,
+        steady_state: bool = False,
+        fitness_cache: Optional[FitnessCache] = None,
+        racing: Optional[RacingEvaluator] = None,
+        checkpoint_dir: Optional[Path] = None,
+        checkpoint_interval: int = 1,
+        profile_dir: Optional[Path] = None,
+        profile_generations: Collection[int] = (),
     ):
+        if steady_state and pool is None and num_workers is None:
+            raise ValueError('Steady-state evolution requires worker processes')
+        if steady_state and fitness_cache is not None:
+            raise ValueError('Fitness cache is not supported by steady-state evolution')
+        if steady_state and racing is not None:
+            raise ValueError('Racing is not supported by steady-state evolution')
+        if steady_state and checkpoint_dir is not None:
+            raise ValueError('Checkpoints are not supported by steady-state evolution')
+        if profile_generations and profile_dir is None:
+            raise ValueError('Profiling requires a directory for the profile')
+
         self._evaluator = evaluator
+        self._chunk_size = chunk_size
+        self._cost_aware_scheduling = cost_aware_scheduling
+        self._steady_state = steady_state
+        self._fitness_cache = fitness_cache
+        self._racing = racing
 
         self._population = Population(config)
+        self._elapsed_s = 0.0
 
         reporters = reporters or []
         for reporter in reporters:
             self._population.add_reporter(reporter)
 
+        self._checkpointer = None
+        if checkpoint_dir is not None:
+            self._checkpointer = Checkpointer(
+                directory=checkpoint_dir,
+                population=self._population,
+                evaluator=evaluator,
+                interval=checkpoint_interval,
+            )
+            self._population.add_reporter(self._checkpointer)
+
+        self._profiler = None
+        if profile_generations:
+            self._profiler = ProfilingReporter(profile_dir, profile_generations)
+            self._population.add_reporter(self._profiler)
+
         self._num_workers = num_workers
+        self._pool = pool
+
+    def resume(self, path: Path):
+        """
+        Restores the population, RNG states, frame count and elapsed time from the checkpoint
+        directory at `path`, so that `train` continues the checkpointed run within the same budget.
+        Reporters with a `restore` method (e.g. `FileReporter`) continue their logs.
+        """
+        checkpoint = load_checkpoint(path)
+        restore_checkpoint(path, checkpoint, self._population)
+        self._evaluator.num_frames = checkpoint.num_frames
+        self._elapsed_s = checkpoint.elapsed_s
+
+        for reporter in self._population.reporters.reporters:
+            if reporter is self._checkpointer:
+                self._checkpointer.restore(path, checkpoint)
+            elif hasattr(reporter, 'restore'):
+                reporter.restore(checkpoint)
+
+        self._population.reporters.info(
+            f'Resumed generation {checkpoint.generation} from {path}: '
+            f'{checkpoint.num_frames} frames, {checkpoint.elapsed_s:.1f}s elapsed'
+        )
 
     def _train(self, num_frames: Optional[int], stop_time: Optional[int]) -> DefaultGenome:
-        if self._num_workers is None:
-            func = lambda g, c: self._evaluate_population_fitness(g, c, num_frames)
+        if stop_time is not None:
+            # the time spent before a resumed checkpoint counts towards the budget
+            stop_time = stop_time - self._elapsed_s
+
+        with ExitStack() as stack:
+            # e.g. checkpoints and buffered logs are written before training returns
+            for reporter in self._population.reporters.reporters:
+                if hasattr(reporter, 'close'):
+                    stack.callback(reporter.close)
+            return self._run(num_frames, stop_time, stack)
+
+    def _run(
+        self,
+        num_frames: Optional[int],
+        stop_time: Optional[int],
+        stack: ExitStack,
+    ) -> DefaultGenome:
+        max_num_frames = num_frames or float('inf')
+        if self._pool is None and self._num_workers is None:
+            budget = get_budget()
+            budget.reset(num_frames, stop_time, self._evaluator.num_frames)
+            func = lambda g, c: self._evaluate_population_fitness(g, c, max_num_frames)
         else:
+            pool = self._pool
+            if pool is None:
+                pool = stack.enter_context(EvaluationPool(self._num_workers))
+
+            budget = pool.budget
+            budget.reset(num_frames, stop_time, self._evaluator.num_frames)
+            pool.install(self._evaluator, self._population.config)
+            if self._steady_state:
+                evolution = SteadyStateEvolution(self._population, pool, self._evaluator)
+                best_genome = evolution.run(max_num_frames)
+                self._report_budget(budget)
+                return best_genome
+
+            if self._cost_aware_scheduling:
+                scheduler = CostAwareScheduler(
+                    num_workers=pool.num_workers,
+                    ancestors=self._population.reproduction.ancestors,
+                    min_chunk_size=self._chunk_size,
+                )
+            else:
+                scheduler = FixedSizeScheduler(self._chunk_size)
+
             parallel = ParallelEvaluator(
-                num_workers=self._num_workers,
+                pool=pool,
                 evaluator=self._evaluator,
-                max_num_frames=num_frames or float('inf'),
+                max_num_frames=max_num_frames,
+                scheduler=scheduler,
+                fitness_cache=self._fitness_cache,
+                racing=self._racing,
+                species_set=self._population.species,
+                profiler=self._profiler,
             )
             func = parallel.evaluate
 
-        if stop_time is not None:
-            # it may not be 100% reliable but it's the best we can achieve without writing a custom
-            # parallel executor
-            func = _timeout_func(func, time(), stop_time)
-
         try:
             return self._population.run(
                 fitness_function=func,
                 n=float('inf'),
             )
         except TimeoutError:
+            # the budget ran out, possibly in the middle of a generation, whose results are
+            # then discarded
+            self._report_budget(budget)
             return self._population.best_genome
 
+    def _report_budget(self, budget: Budget):
+        self._population.reporters.info(
+            f'Budget exhausted: {budget.num_truncated} evaluations truncated, '
+            f'{budget.num_cancelled} cancelled'
+        )
+
     def _evaluate_population_fitness(
         self,
         genomes: Sequence[Tuple[int, DefaultGenome]],
         config: Config,
         max_num_frames: int,
     ):
-        if self._evaluator.num_frames >= max_num_frames:
+        budget = get_budget()
+        if self._evaluator.num_frames >= max_num_frames or budget.exhausted():
             raise TimeoutError()
 
-        for _, genome in genomes:
-            genome.fitness, num_frames = self._evaluator.evaluate(genome, config)
-            self._evaluator.num_frames += num_frames
+        num_interrupted = budget.num_truncated + budget.num_cancelled
+        budget.reset_best_fitness()
+        telemetry = GenerationTelemetry(started_at=time())
+        cached, genomes = _lookup_cached(self._fitness_cache, [g for _, g in genomes], budget)
+        cached_frames = sum(entry.frames for _, entry in cached)
+        self._evaluator.num_frames += cached_frames
+        # the budget of the episodes counts the frames of cached evaluations like played ones
+        budget.add_frames(cached_frames)
 
+        evaluate_round = lambda round_genomes: self._evaluate_round(
+            round_genomes, config, budget, num_interrupted
+        )
+        results = _race(self._racing, genomes, self._population.species, evaluate_round)
 
-def _timeout_func(
-    func: Callable,
-    start_time,
-    stop_time,
-):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        if (time() - start_time) >= stop_time:
-            raise TimeoutError()
+        self._evaluator.environment_stats = self._evaluator.take_environment_stats()
+        self._evaluator.early_stopping_stats = self._evaluator.take_early_stopping_stats()
+        telemetry.genomes = self._evaluator.take_telemetry() or []
+        telemetry.finished_at = time()
+        self._evaluator.telemetry = telemetry
+        _assign_fitness(genomes, results, cached, self._fitness_cache)
+
+    def _evaluate_round(
+        self,
+        genomes: List[DefaultGenome],
+        config: Config,
+        budget: Budget,
+        num_interrupted: int,
+    ) -> List[Tuple[float, int]]:
+        scheduler = FixedSizeScheduler(self._chunk_size)
+        results = []
+        for chunk in scheduler.schedule(genomes):
+            chunk_results = self._evaluator.evaluate_many(chunk, config)
+            self._evaluator.num_frames += sum(num_frames for _, num_frames in chunk_results)
+            results.extend(chunk_results)
+
+        _check_interrupted(budget, num_interrupted)
+        return results
+
+
+def _lookup_cached(
+    fitness_cache: Optional[FitnessCache],
+    genomes: List[DefaultGenome],
+    budget: Budget,
+) -> Tuple[List[Tuple[DefaultGenome, CachedFitness]], List[DefaultGenome]]:
+    if fitness_cache is None:
+        return [], genomes
+
+    cached, genomes = fitness_cache.partition(genomes)
+    for _, entry in cached:
+        # cached genomes raise the bar for early stopping right away
+        budget.record_fitness(entry.fitness)
 
-        return func(*args, **kwargs)
+    return cached, genomes
 
-    return wrapper
+
+def _race(
+    racing: Optional[RacingEvaluator],
+    genomes: List[DefaultGenome],
+    species_set: DefaultSpeciesSet,
+    evaluate_round: EvaluateRound,
+) -> List[Tuple[float, int]]:
+    if racing is None:
+        return evaluate_round(genomes)
+
+    return racing.evaluate(genomes, species_set.genome_to_species, evaluate_round)
+
+
+def _check_interrupted(budget: Budget, num_interrupted: int):
+    # elites are re-evaluated as the very same objects as `Population.best_genome`, so results
+    # of a generation interrupted by the budget must not touch the genomes (nor the cache)
+    if budget.num_truncated + budget.num_cancelled > num_interrupted:
+        raise TimeoutError()
+
+
+def _assign_fitness(
+    genomes: Sequence[DefaultGenome],
+    results: Sequence[Tuple[float, int]],
+    cached: Sequence[Tuple[DefaultGenome, CachedFitness]],
+    fitness_cache: Optional[FitnessCache],
+):
+    for genome, (fitness, num_frames) in zip(genomes, results):
+        if fitness_cache is not None:
+            fitness = fitness_cache.update(genome, fitness, num_frames)
+        genome.fitness = fitness
+
+    for genome, entry in cached:
+        genome.fitness = entry.fitness
 
 
 class ParallelEvaluator:
-    def __init__(self, num_workers, evaluator: GymEvaluator, max_num_frames):
-        self.num_workers = num_workers
+    def __init__(
+        self,
+        pool: EvaluationPool,
+        evaluator: GymEvaluator,
+        max_num_frames,
+        scheduler: Optional[FixedSizeScheduler] = None,
+        fitness_cache: Optional[FitnessCache] = None,
+        racing: Optional[RacingEvaluator] = None,
+        species_set: Optional[DefaultSpeciesSet] = None,
+        profiler: Optional[ProfilingReporter] = None,
+    ):
+        if racing is not None and species_set is None:
+            raise ValueError('Racing requires the species set of the population')
+
+        self.pool = pool
         self.evaluator = evaluator
-        self.pool = Pool(num_workers)
         self.max_num_frames = max_num_frames
-
-    def __del__(self):
-        self.pool.close()
-        self.pool.join()
+        self.scheduler = scheduler or FixedSizeScheduler()
+        self.fitness_cache = fitness_cache
+        self.racing = racing
+        self.species_set = species_set
+        self.profiler = profiler
 
     def evaluate(self, genomes, config):
-        if self.evaluator.num_frames >= self.max_num_frames:
+        budget = self.pool.budget
+        if self.evaluator.num_frames >= self.max_num_frames or budget.exhausted():
             raise TimeoutError()
 
-        jobs = []
-        for ignored_genome_id, genome in genomes:
-            jobs.append(self.pool.apply_async(self.evaluator.evaluate, (genome, config)))
+        num_interrupted = budget.num_truncated + budget.num_cancelled
+        budget.reset_best_fitness()
+        start = perf_counter()
+        self.evaluator.environment_stats = EnvironmentPoolStats()
+        self.evaluator.worker_stats = WorkerStats(num_workers=self.pool.num_workers)
+        self.evaluator.early_stopping_stats = EarlyStoppingStats()
+        self.evaluator.telemetry = GenerationTelemetry(started_at=time())
+        cached, genomes = _lookup_cached(self.fitness_cache, [g for _, g in genomes], budget)
+        cached_frames = [entry.frames for _, entry in cached]
+        # counted before the evaluations, so that the workers stop where the generation would
+        budget.add_frames(sum(cached_frames))
+
+        evaluate_round = lambda round_genomes: self._evaluate_round(
+            round_genomes, budget, num_interrupted
+        )
+        results = _race(self.racing, genomes, self.species_set, evaluate_round)
+        self.evaluator.worker_stats.wall_time_s = perf_counter() - start
+        self.evaluator.telemetry.finished_at = time()
+
+        self.scheduler.record(
+            genomes + [genome for genome, _ in cached],
+            [num_frames for _, num_frames in results] + cached_frames,
+        )
+        self.evaluator.num_frames += sum(cached_frames)
+        _assign_fitness(genomes, results, cached, self.fitness_cache)
+
+    def _evaluate_round(
+        self,
+        genomes: List[DefaultGenome],
+        budget: Budget,
+        num_interrupted: int,
+    ) -> List[Tuple[float, int]]:
+        chunks = self.scheduler.schedule(genomes)
+        profile_interval_s = None
+        if self.profiler is not None:
+            profile_interval_s = self.profiler.worker_interval_s
+
+        if self.evaluator.records_telemetry:
+            jobs, submit_times, received_at = self._submit_timed(chunks, profile_interval_s)
+        else:
+            jobs = [
+                self.pool.submit(chunk, profile_interval_s=profile_interval_s) for chunk in chunks
+            ]
+
+        results = {}
+        worker_stats = self.evaluator.worker_stats
+        for i, (job, chunk) in enumerate(zip(jobs, chunks)):
+            task = job.get()
+            for genome, result in zip(chunk, task.results):
+                results[genome.key] = result
+
+            if task.telemetry is not None:
+                telemetry = task.telemetry._replace(
+                    submit_time_s=submit_times[i], received_at=received_at[i]
+                )
+                self.evaluator.telemetry.add_task(task.worker_id, telemetry)
+            if task.profile is not None:
+                self.profiler.add_worker_samples(task.profile)
 
-        frames = 0
-        for job, (ignored_genome_id, genome) in zip(jobs, genomes):
-            genome.fitness, num_frames = job.get()
-            frames += num_frames
+            self.evaluator.num_frames += sum(num_frames for _, num_frames in task.results)
+            self.evaluator.environment_stats += task.environment_stats
+            self.evaluator.early_stopping_stats += task.early_stopping_stats
+            busy_time = worker_stats.busy_time_s.get(task.worker_id, 0.0)
+            worker_stats.busy_time_s[task.worker_id] = busy_time + task.busy_time_s
 
-        self.evaluator.num_frames += frames
+        _check_interrupted(budget, num_interrupted)
+        # chunks may be scheduled in any order
+        return [results[genome.key] for genome in genomes]
+
+    def _submit_timed(
+        self,
+        chunks: List[List[DefaultGenome]],
+        profile_interval_s: Optional[float],
+    ) -> Tuple[List, List[float], Dict[int, float]]:
+        jobs, submit_times, received_at = [], [], {}
+        for i, chunk in enumerate(chunks):
+            start = perf_counter()
+            # called on arrival of the result, not when the trainer gets to it
+            callback = lambda _, i=i: received_at.__setitem__(i, time())
+            jobs.append(
+                self.pool.submit(chunk, callback=callback, profile_interval_s=profile_interval_s)
+            )
+            submit_times.append(perf_counter() - start)
 
+        return jobs, submit_times, received_at
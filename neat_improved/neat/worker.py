@@ -0,0 +1,36 @@
+"""
+`neat-worker`, evaluates genomes for a `DistributedEvaluationPool` running on another host:
+
+    NEAT_AUTHKEY=KEY python -m neat_improved.neat.worker HOST:PORT [--processes N]
+"""
+import argparse
+
+from neat_improved.neat.distributed import AUTHKEY_VARIABLE, authkey_from_env, run_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='neat-worker', description=__doc__.splitlines()[1])
+    parser.add_argument('address', help='HOST:PORT of the coordinator')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to all cores')
+    parser.add_argument(
+        '--authkey',
+        type=str.encode,
+        default=authkey_from_env(),
+        help=f'shared secret of the coordinator, ${AUTHKEY_VARIABLE} by default',
+    )
+    parser.add_argument('--heartbeat-interval', type=float, default=1.0)
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f'the coordinator authkey is required, set ${AUTHKEY_VARIABLE} or --authkey')
+
+    host, port = args.address.rsplit(':', 1)
+    run_worker(
+        address=(host, int(port)),
+        authkey=args.authkey,
+        num_processes=args.processes,
+        heartbeat_interval=args.heartbeat_interval,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import marshal
+import sys
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# functions are identified like in `pstats`: (file name, first line, function name)
+Function = Tuple[str, int, str]
+# a sampled call stack, outermost frame first
+Stack = Tuple[Function, ...]
+
+COLLAPSED_FILE = 'profile.collapsed'
+PSTATS_FILE = 'profile.pstats'
+
+
+class Samples(NamedTuple):
+    counts: Counter  # stack -> number of samples
+    seconds: Counter  # stack -> time between its samples and the previous ones
+
+    @classmethod
+    def empty(cls) -> 'Samples':
+        return cls(Counter(), Counter())
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of the thread that created it every `interval_s` seconds, from a
+    background thread. Unlike `cProfile` it does not instrument the profiled code, so its
+    overhead is low and independent of the number of calls, but call counts are unknown.
+    The sampling thread sleeps while the profiler is stopped. Samples are weighted with the
+    time since the previous one, as the GIL delays them while the profiled thread runs.
+    """
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self._thread_id = threading.get_ident()
+        self._enabled = threading.Event()
+        self._lock = threading.Lock()
+        self._samples = Samples.empty()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._enabled.set()
+
+    def stop(self) -> Samples:
+        """Stops sampling, returns the samples taken since `start`."""
+        self._enabled.clear()
+        with self._lock:
+            samples, self._samples = self._samples, Samples.empty()
+        return samples
+
+    def _run(self):
+        previous = None
+        while True:
+            if not self._enabled.is_set():
+                self._enabled.wait()
+                previous = None
+
+            sleep(self.interval_s)
+            now = perf_counter()
+            seconds = now - previous if previous is not None else self.interval_s
+            previous = now
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+
+            with self._lock:
+                if stack and self._enabled.is_set():
+                    stack = tuple(reversed(stack))
+                    self._samples.counts[stack] += 1
+                    self._samples.seconds[stack] += seconds
+
+
+_PROFILER: Optional[SamplingProfiler] = None
+
+
+def get_profiler(interval_s: float) -> SamplingProfiler:
+    """Returns the profiler of the current process, sampling the thread of the first call."""
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = SamplingProfiler(interval_s)
+
+    _PROFILER.interval_s = interval_s
+    return _PROFILER
+
+
+class MergedProfile:
+    """
+    Samples of several processes, each stack under a root frame naming the role of its process
+    (e.g. `trainer` or `worker`), written as collapsed stacks (for flame graphs) and as a
+    `pstats` file. In the latter, call counts are sample counts.
+    """
+
+    def __init__(self):
+        self.samples = Samples.empty()
+
+    def add(self, role: str, samples: Samples):
+        root = ('~', 0, role)
+        for stack, count in samples.counts.items():
+            self.samples.counts[(root,) + stack] += count
+            self.samples.seconds[(root,) + stack] += samples.seconds[stack]
+
+    def write(self, directory: Path) -> Tuple[Path, Path]:
+        directory.mkdir(exist_ok=True, parents=True)
+        collapsed_path = directory / COLLAPSED_FILE
+        with collapsed_path.open('w') as file:
+            for stack, count in sorted(self.samples.counts.items()):
+                file.write(';'.join(_label(function) for function in stack) + f' {count}\n')
+
+        pstats_path = directory / PSTATS_FILE
+        with pstats_path.open('wb') as file:
+            marshal.dump(_pstats(self.samples), file)
+
+        return collapsed_path, pstats_path
+
+
+def _label(function: Function) -> str:
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return f'{name} ({Path(filename).name}:{line})'
+
+
+def _pstats(samples: Samples) -> Dict:
+    """Stats in the format of `cProfile.Profile.create_stats`, loadable by `pstats.Stats`."""
+    counts = Counter()
+    own_time = Counter()
+    total_time = Counter()
+    callers = defaultdict(Counter)
+    caller_time = defaultdict(Counter)
+    for stack, count in samples.counts.items():
+        seconds = samples.seconds[stack]
+        own_time[stack[-1]] += seconds
+        # recursive functions are counted once per sample
+        for function in set(stack):
+            counts[function] += count
+            total_time[function] += seconds
+        for caller, callee in set(zip(stack, stack[1:])):
+            callers[callee][caller] += count
+            caller_time[callee][caller] += seconds
+
+    return {
+        function: (
+            count,
+            count,
+            own_time[function],
+            total_time[function],
+            {
+                caller: (n, n, 0.0, caller_time[function][caller])
+                for caller, n in callers[function].items()
+            },
+        )
+        for function, count in counts.items()
+    }
@@ -106,6 +106,11 @@ class PolicyA2C(nn.Module):
 
         return action, critic_values, action_log_probs, dist_entropy
 
+    def evaluate_actions(self, inputs, actions):
+        critic_values, actor_features = self.actor_critic(inputs)
+        dist = self.dist(actor_features)
+        return critic_values, dist.log_probs(actions), dist.entropy()
+
     def get_critic_values(self, inputs):
         critic_values, _ = self.actor_critic(inputs)
         return critic_values
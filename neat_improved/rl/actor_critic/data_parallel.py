@@ -0,0 +1,146 @@
+from time import time
+from typing import Callable, Optional, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from neat_improved.rl.actor_critic.trainer import A2CTrainer
+from neat_improved.rl.episodes import EpisodeStats
+
+
+class DataParallelA2CTrainer(A2CTrainer):
+    """
+    A learner of synchronous data-parallel A2C: every rank of the default process group rolls out
+    its own shard of environments and the gradients are averaged over the ranks before each
+    optimizer step, so the parameters, initialized from rank 0, stay the same on all of them.
+    Ranks stop together, reporters get the episode statistics and frames of all ranks and only
+    rank 0 logs. Takes the arguments of `A2CTrainer`, the process group has to be initialized.
+    Learners run on the CPU only (`use_gpu=False`), the gloo backend reduces CPU tensors.
+    """
+
+    def __init__(self, *args, use_gpu: bool = False, **kwargs):
+        if use_gpu:
+            raise ValueError('Data-parallel learners run on the CPU, set use_gpu=False')
+
+        super(DataParallelA2CTrainer, self).__init__(*args, use_gpu=False, **kwargs)
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        with torch.no_grad():
+            for tensor in self.policy.state_dict().values():
+                dist.broadcast(tensor, src=0)
+
+    def _reduce_gradients(self):
+        # a single all-reduce of all gradients, the policy is too small for bucketing to pay off
+        grads = [param.grad for param in self.policy.parameters() if param.grad is not None]
+        flat = torch.cat([grad.flatten() for grad in grads])
+        dist.all_reduce(flat)
+        flat.div_(self.world_size)
+        offset = 0
+        for grad in grads:
+            grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+            offset += grad.numel()
+
+    def _should_stop(
+            self, start_time: float, num_frames: Optional[int], stop_time: Optional[int]
+    ) -> bool:
+        stop = super()._should_stop(start_time, num_frames, stop_time)
+        # with `stop_time`, clocks of the ranks may disagree on the last update
+        flag = torch.tensor([float(stop)])
+        dist.all_reduce(flag, op=dist.ReduceOp.MAX)
+        return bool(flag.item())
+
+    def _stats(self) -> Tuple[EpisodeStats, int]:
+        episodes = self.episodes.stats()
+        size = min(episodes.num_episodes, self.episodes.window)
+        local = torch.tensor(
+            [
+                episodes.num_episodes,
+                size,
+                episodes.mean_return * size,
+                episodes.min_return,
+                episodes.max_return,
+                episodes.mean_length * size,
+                self._num_frames,
+            ],
+            dtype=torch.float64,
+        )
+        gathered = [torch.zeros_like(local) for _ in range(self.world_size)]
+        dist.all_gather(gathered, local)
+        stats = torch.stack(gathered)
+
+        num_frames = int(stats[:, 6].sum().item())
+        num_episodes = int(stats[:, 0].sum().item())
+        finished = stats[stats[:, 1] > 0]  # ranks without a completed episode have no returns
+        if not len(finished):
+            return EpisodeStats(num_episodes, 0.0, 0.0, 0.0, 0.0), num_frames
+
+        total_size = finished[:, 1].sum().item()
+        pooled = EpisodeStats(
+            num_episodes=num_episodes,
+            mean_return=finished[:, 2].sum().item() / total_size,
+            min_return=finished[:, 3].min().item(),
+            max_return=finished[:, 4].max().item(),
+            mean_length=finished[:, 5].sum().item() / total_size,
+        )
+        return pooled, num_frames
+
+    def _log(self, *args, **kwargs):
+        if self.rank == 0:
+            super()._log(*args, **kwargs)
+
+
+def _run_rank(
+        rank: int,
+        num_ranks: int,
+        make_trainer: CloudpickleWrapper,
+        num_frames: Optional[int],
+        stop_time: Optional[int],
+        port: int,
+        results: mp.SimpleQueue,
+):
+    # ranks are processes of their own, threads would only oversubscribe the cores
+    torch.set_num_threads(1)
+    dist.init_process_group(
+        'gloo',
+        init_method=f'tcp://127.0.0.1:{port}',
+        rank=rank,
+        world_size=num_ranks,
+    )
+    try:
+        trainer = make_trainer.var(rank, num_ranks)
+        start = time()
+        trainer.train(
+            num_frames=num_frames // num_ranks if num_frames else None,
+            stop_time=stop_time,
+        )
+        duration = time() - start
+        _, total_frames = trainer._stats()
+        trainer.vec_envs.close()
+        if rank == 0:
+            results.put((total_frames, duration))
+    finally:
+        dist.destroy_process_group()
+
+
+def train_data_parallel(
+        make_trainer: Callable[[int, int], DataParallelA2CTrainer],
+        num_ranks: int,
+        num_frames: Optional[int] = None,
+        stop_time: Optional[int] = None,
+        port: int = 29500,
+) -> Tuple[int, float]:
+    """
+    Trains in `num_ranks` processes on this machine, each with the trainer `make_trainer` creates
+    given its rank and the number of ranks. `num_frames` is the budget of all ranks together.
+    Returns the number of frames of all ranks and the duration of training.
+    """
+    ctx = mp.get_context('spawn')
+    results = ctx.SimpleQueue()
+    mp.spawn(
+        _run_rank,
+        args=(num_ranks, CloudpickleWrapper(make_trainer), num_frames, stop_time, port, results),
+        nprocs=num_ranks,
+    )
+    return results.get()
@@ -0,0 +1,356 @@
+import copy
+import queue
+from itertools import count
+from time import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from gym.spaces import Box
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from torch import nn, optim
+
+from neat_improved.rl.actor_critic.a2c import PolicyA2C
+from neat_improved.rl.actor_critic.storage import discounted_sum
+from neat_improved.rl.actor_critic.utils import clip_action, explained_variance
+from neat_improved.rl.episodes import EpisodeTracker
+from neat_improved.rl.reporters import BaseRLReporter
+from neat_improved.trainer import BaseTrainer
+
+# Actors write trajectories into slots of shared buffers: the index of a free slot is taken from
+# the free queue, and put on the full queue, with the index of the actor, once written.
+Buffers = Dict[str, torch.Tensor]
+
+
+def _create_buffers(
+        num_buffers: int,
+        n_steps: int,
+        n_envs: int,
+        observation_space,
+        action_space,
+) -> Buffers:
+    if isinstance(action_space, Box):
+        action_shape, action_dtype = action_space.shape, torch.float32
+    else:
+        action_shape, action_dtype = (1,), torch.long
+
+    shape = (num_buffers, n_steps)
+    buffers = {
+        'observations': torch.zeros(num_buffers, n_steps + 1, n_envs, *observation_space.shape),
+        'actions': torch.zeros(*shape, n_envs, *action_shape, dtype=action_dtype),
+        'log_probs': torch.zeros(*shape, n_envs, 1),  # of the behaviour policy
+        'rewards': torch.zeros(*shape, n_envs, 1),
+        'dones': torch.zeros(*shape, n_envs, 1),
+    }
+    for buffer in buffers.values():
+        buffer.share_memory_()
+
+    return buffers
+
+
+def _actor(
+        actor_index: int,
+        make_envs: CloudpickleWrapper,
+        shared_policy: PolicyA2C,
+        version: mp.Value,
+        lock: mp.Lock,
+        buffers: Buffers,
+        free_queue: mp.SimpleQueue,
+        full_queue: mp.Queue,
+):
+    torch.set_num_threads(1)
+    envs: VecEnv = make_envs.var(actor_index)
+    policy = copy.deepcopy(shared_policy)
+    policy_version = -1
+    n_steps = buffers['actions'].shape[1]
+
+    observations = torch.as_tensor(envs.reset(), dtype=torch.float32)
+    try:
+        while True:
+            index = free_queue.get()
+            if index is None:
+                break
+
+            if policy_version != version.value:
+                with lock:
+                    policy.load_state_dict(shared_policy.state_dict())
+                    policy_version = version.value
+
+            buffers['observations'][index, 0] = observations
+            with torch.no_grad():
+                for step in range(n_steps):
+                    action, _, log_prob, _ = policy(observations)
+                    state, reward, done, _ = envs.step(clip_action(action, envs.action_space))
+                    observations = torch.as_tensor(state, dtype=torch.float32)
+
+                    buffers['actions'][index, step] = action
+                    buffers['log_probs'][index, step] = log_prob
+                    buffers['rewards'][index, step, :, 0] = torch.as_tensor(reward)
+                    buffers['dones'][index, step, :, 0] = torch.as_tensor(done)
+                    buffers['observations'][index, step + 1] = observations
+
+            full_queue.put((index, actor_index))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        envs.close()
+
+
+def vtrace(
+        behaviour_log_probs: torch.Tensor,
+        target_log_probs: torch.Tensor,
+        rewards: torch.Tensor,
+        discounts: torch.Tensor,
+        values: torch.Tensor,
+        rho_bar: float = 1.0,
+        c_bar: float = 1.0,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    V-trace targets of the values and policy gradient advantages of trajectories of a behaviour
+    policy, off-policy corrected for the target policy (Espeholt et al., 2018, IMPALA).
+    Tensors have a leading time dimension, values have one more step, to bootstrap from.
+    """
+    rhos = torch.exp(target_log_probs - behaviour_log_probs)
+    clipped_rhos = rhos.clamp(max=rho_bar)
+    cs = rhos.clamp(max=c_bar)
+
+    # vs - V(x_s) = sum_t (prod_i<t c_i gamma_i) * rho_t * delta_t, in a single reverse pass
+    vs_minus_values = torch.zeros_like(values)
+    deltas = vs_minus_values[:-1]
+    torch.addcmul(rewards, discounts, values[1:], out=deltas)
+    deltas.sub_(values[:-1]).mul_(clipped_rhos)
+    discounted_sum(vs_minus_values.unbind(), (discounts * cs).unbind())
+    vs = vs_minus_values + values
+
+    advantages = clipped_rhos * (rewards + discounts * vs[1:] - values[:-1])
+    return vs[:-1], advantages
+
+
+class ImpalaTrainer(BaseTrainer):
+    """
+    Decoupled actor-learner training (IMPALA). `num_actors` processes step their environments
+    with CPU copies of the policy, writing trajectories of `n_steps` steps into shared memory,
+    while the learner trains on batches of `batch_size` trajectories. Actors reload the weights
+    the learner publishes to a shared copy of the policy before each trajectory, the policy lag
+    is corrected with V-trace. `make_envs` creates the vectorized environments of an actor,
+    `n_envs` of them, given the index of the actor.
+    """
+
+    def __init__(
+            self,
+            policy: PolicyA2C,
+            make_envs: Callable[[int], VecEnv],
+            observation_space,
+            action_space,
+            num_actors: int = 4,
+            n_envs: int = 4,
+            n_steps: int = 20,
+            batch_size: int = 4,
+            num_buffers: Optional[int] = None,
+            lr: float = 7e-4,
+            eps: float = 1e-5,
+            alpha: float = 0.99,
+            max_grad_norm: float = 0.5,
+            gamma: float = 0.99,
+            value_loss_coef: float = 0.5,
+            entropy_coef: float = 0.01,
+            rho_bar: float = 1.0,
+            c_bar: float = 1.0,
+            log_interval: int = 100,
+            use_gpu: bool = True,
+            critic_loss_func: Callable = F.mse_loss,
+            reporters: Optional[Sequence[BaseRLReporter]] = None,
+            episode_window: int = 100,
+            start_method: str = 'forkserver',
+    ):
+        super(ImpalaTrainer, self).__init__()
+
+        self.device = 'cuda' if use_gpu else 'cpu'
+        self.policy = policy.to(self.device)
+        self.make_envs = make_envs
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.num_actors = num_actors
+        self.n_envs = n_envs
+        self.n_steps = n_steps
+        self.batch_size = batch_size
+        self.num_buffers = num_buffers or max(2 * num_actors, batch_size)
+
+        self.gamma = gamma
+        self.value_loss_coef = value_loss_coef
+        self.entropy_coef = entropy_coef
+        self.rho_bar = rho_bar
+        self.c_bar = c_bar
+        self.max_grad_norm = max_grad_norm
+        self.critic_loss_func = critic_loss_func
+        self.optimizer = optim.RMSprop(self.policy.parameters(), lr, eps=eps, alpha=alpha)
+
+        self.reporters = reporters or ()
+        self.log_interval = log_interval
+        self.start_method = start_method
+        self._num_frames = 0
+        # fitness is the mean return of the last `episode_window` episodes of all actors
+        self.episodes = EpisodeTracker(num_actors * n_envs, episode_window)
+
+    @property
+    def num_frames(self) -> int:
+        """Frames of the trajectories learned from."""
+        return self._num_frames
+
+    def _train(self, num_frames: Optional[int] = None, stop_time: Optional[int] = None):
+        ctx = mp.get_context(self.start_method)
+        self._buffers = _create_buffers(
+            self.num_buffers,
+            self.n_steps,
+            self.n_envs,
+            self.observation_space,
+            self.action_space,
+        )
+        self._shared_policy = copy.deepcopy(self.policy).cpu().share_memory()
+        self._version = ctx.Value('l', 0)
+        self._lock = ctx.Lock()
+        self._free_queue = ctx.SimpleQueue()
+        self._full_queue = ctx.Queue()
+        for index in range(self.num_buffers):
+            self._free_queue.put(index)
+
+        self._actors = []
+        for actor_index in range(self.num_actors):
+            args = (
+                actor_index,
+                CloudpickleWrapper(self.make_envs),
+                self._shared_policy,
+                self._version,
+                self._lock,
+                self._buffers,
+                self._free_queue,
+                self._full_queue,
+            )
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            actor = ctx.Process(target=_actor, args=args, daemon=True)
+            actor.start()
+            self._actors.append(actor)
+
+        try:
+            self._learn(num_frames, stop_time)
+        finally:
+            for _ in self._actors:
+                self._free_queue.put(None)
+            for actor in self._actors:
+                actor.join(timeout=10)
+                if actor.is_alive():
+                    actor.terminate()
+
+    def _learn(self, num_frames: Optional[int], stop_time: Optional[int]):
+        start_time = time()
+        for update in count():
+            if stop_time and (time() - start_time) >= stop_time:
+                break
+
+            if num_frames and (self._num_frames >= num_frames):
+                break
+
+            entropy, actor_loss, critic_loss, loss, values, vs = self.update(self._next_batch())
+            self._publish()
+
+            episodes = self.episodes.stats()
+            self._call_reporters(
+                'on_update_end',
+                iteration=update,
+                fitness=episodes.mean_return,
+                min_fitness=episodes.min_return,
+                max_fitness=episodes.max_return,
+                num_episodes=episodes.num_episodes,
+                policy_loss=loss.item(),
+                num_frames=self._num_frames,
+            )
+
+            if (update % self.log_interval) == 0:
+                fps = int(self._num_frames / (time() - start_time))
+                print(f"Updates: {update}, total env steps: {self._num_frames}, fps: {fps}")
+                print(f"Entropy: {entropy:.4f}, policy loss: {loss:.4f}")
+                print(f"Explained variance: {float(explained_variance(values, vs)):.4f}")
+                print(
+                    f"Fitness: {episodes.mean_return} (min: {episodes.min_return}, "
+                    f"max: {episodes.max_return}, episodes: {episodes.num_episodes})"
+                )
+                print("---")
+
+    def _next_batch(self) -> Buffers:
+        """Trajectories of `batch_size` slots, flattened to (time, actors * envs, ...)."""
+        indices = []
+        while len(indices) < self.batch_size:
+            try:
+                index, actor_index = self._full_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not all(actor.is_alive() for actor in self._actors):
+                    raise RuntimeError('An actor process exited unexpectedly')
+                continue
+
+            indices.append(index)
+            self._record_episodes(index, actor_index)
+
+        # indexing copies the trajectories, so that their slots can be reused right away
+        batch = {name: buffer[indices] for name, buffer in self._buffers.items()}
+        for index in indices:
+            self._free_queue.put(index)
+
+        return {
+            name: trajectories.transpose(0, 1).flatten(1, 2).to(self.device)
+            for name, trajectories in batch.items()
+        }
+
+    def _record_episodes(self, index: int, actor_index: int):
+        envs = slice(actor_index * self.n_envs, (actor_index + 1) * self.n_envs)
+        rewards = self._buffers['rewards'][index, :, :, 0].numpy()
+        dones = self._buffers['dones'][index, :, :, 0].numpy().astype(bool)
+        for step in range(self.n_steps):
+            self.episodes.step(rewards[step], dones[step], envs)
+        self._num_frames += self.n_steps * self.n_envs
+
+    def _publish(self):
+        # `load_state_dict` copies in place, into the shared memory
+        with self._lock:
+            self._shared_policy.load_state_dict(self.policy.state_dict())
+            self._version.value += 1
+
+    def update(self, batch: Buffers):
+        observations = batch['observations']
+        n_steps, n_envs = batch['rewards'].shape[:2]
+        values, log_probs, entropy = self.policy.evaluate_actions(
+            observations[:-1].flatten(0, 1),
+            batch['actions'].flatten(0, 1),
+        )
+        values = values.view(n_steps, n_envs, 1)
+        log_probs = log_probs.view(n_steps, n_envs, 1)
+        entropy = entropy.mean()
+
+        with torch.no_grad():
+            bootstrap_value = self.policy.get_critic_values(observations[-1])
+            vs, advantages = vtrace(
+                behaviour_log_probs=batch['log_probs'],
+                target_log_probs=log_probs,
+                rewards=batch['rewards'],
+                discounts=self.gamma * (1.0 - batch['dones']),
+                values=torch.cat([values, bootstrap_value.unsqueeze(0)]),
+                rho_bar=self.rho_bar,
+                c_bar=self.c_bar,
+            )
+
+        actor_loss = -(log_probs * advantages).mean()
+        critic_loss = self.critic_loss_func(vs, values)
+
+        loss = actor_loss + self.value_loss_coef * critic_loss - self.entropy_coef * entropy
+
+        self.optimizer.zero_grad()
+        loss.backward()
+        nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+        self.optimizer.step()
+
+        return entropy, actor_loss, critic_loss, loss, values, vs
+
+    def _call_reporters(self, stage: str, *args, **kwargs):
+        for reporter in self.reporters:
+            getattr(reporter, stage)(*args, **kwargs)
@@ -0,0 +1,97 @@
+from typing import Sequence
+
+import numpy as np
+import torch
+
+
+class RolloutStorage:
+    """
+    Transitions of `n_steps` steps in `n_envs` environments, held in tensors allocated once and
+    filled in place. Observations, values, returns and advantages have one more step: the last
+    observation is the one the returns are bootstrapped from and the first observation of the
+    next rollout.
+    """
+
+    def __init__(
+            self,
+            n_steps: int,
+            n_envs: int,
+            obs_shape: Sequence[int],
+            action_shape: Sequence[int],
+            action_dtype: torch.dtype,
+            device: str,
+    ):
+        self.n_steps = n_steps
+        self.observations = torch.zeros(n_steps + 1, n_envs, *obs_shape, device=device)
+        self.actions = torch.zeros(
+            n_steps, n_envs, *action_shape, dtype=action_dtype, device=device
+        )
+        self.rewards = torch.zeros(n_steps, n_envs, 1, device=device)
+        self.masks = torch.ones(n_steps, n_envs, 1, device=device)  # 0 once an episode ended
+        self.values = torch.zeros(n_steps + 1, n_envs, 1, device=device)
+        self.returns = torch.zeros(n_steps + 1, n_envs, 1, device=device)
+        self.advantages = torch.zeros(n_steps + 1, n_envs, 1, device=device)
+        self._discounts = torch.zeros(n_steps, n_envs, 1, device=device)
+        # views of single steps, created once as indexing costs as much as the arithmetic
+        self._returns_steps = self.returns.unbind()
+        self._advantage_steps = self.advantages.unbind()
+        self._discount_steps = self._discounts.unbind()
+
+    def reset(self, observations: np.ndarray):
+        self.observations[0].copy_(torch.as_tensor(observations))
+
+    def insert(
+            self,
+            step: int,
+            actions: torch.Tensor,
+            values: torch.Tensor,
+            observations: np.ndarray,
+            rewards: np.ndarray,
+            dones: np.ndarray,
+            envs: slice = slice(None),
+    ):
+        """
+        Stores a step of the environments `envs` taken from `observations[step]`, the arrays are
+        not copied to tensors.
+        """
+        self.actions[step, envs].copy_(actions)
+        self.values[step, envs].copy_(values)
+        self.observations[step + 1, envs].copy_(torch.as_tensor(observations))
+        self.rewards[step, envs, 0].copy_(torch.as_tensor(rewards))
+        masks = self.masks[step, envs, 0]
+        masks.copy_(torch.as_tensor(dones))
+        masks.neg_().add_(1.0)
+
+    def compute_returns(self, gamma: float, gae_lambda: float = 1.0):
+        """
+        Fills `returns[:-1]` with discounted returns bootstrapped from `values[-1]` or, if
+        `gae_lambda < 1`, with Generalized Advantage Estimation (GAE) returns. Both are computed
+        in a single reverse pass of in-place operations on whole steps, the recursion over steps
+        is the only Python loop.
+        """
+        torch.mul(self.masks, gamma, out=self._discounts)
+        if gae_lambda == 1.0:
+            # GAE with lambda = 1 equals the discounted returns, computed without the values
+            self.returns[:-1].copy_(self.rewards)
+            self.returns[-1].copy_(self.values[-1])
+            discounted_sum(self._returns_steps, self._discount_steps)
+            return
+
+        # temporal difference errors: r_t + gamma * V(s_t+1) - V(s_t)
+        deltas = self.advantages[:-1]
+        torch.addcmul(self.rewards, self._discounts, self.values[1:], out=deltas)
+        deltas.sub_(self.values[:-1])
+        self.advantages[-1].zero_()
+
+        self._discounts.mul_(gae_lambda)
+        discounted_sum(self._advantage_steps, self._discount_steps)
+        torch.add(self.advantages, self.values, out=self.returns)
+
+    def after_update(self):
+        self.observations[0].copy_(self.observations[-1])
+
+
+def discounted_sum(steps: Sequence[torch.Tensor], discounts: Sequence[torch.Tensor]):
+    """`steps[t] += discounts[t] * steps[t + 1]`, in a single reverse pass."""
+    for step in reversed(range(len(discounts))):
+        steps[step].addcmul_(discounts[step], steps[step + 1])
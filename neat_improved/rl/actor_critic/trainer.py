@@ -1,20 +1,30 @@
-from collections import defaultdict
 from itertools import count
+from pathlib import Path
 from time import time
-from typing import Callable, Optional, Sequence
+from typing import Callable, Collection, Optional, Sequence, Tuple
 
-import numpy as np
 import torch
 import torch.nn.functional as F
 from gym.spaces import Box
-from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env import SubprocVecEnv, VecEnv
 from torch import nn, optim
 
-from neat_improved.rl.actor_critic.utils import explained_variance
+from neat_improved.profiling import MergedProfile, SamplingProfiler
+from neat_improved.rl.actor_critic.storage import RolloutStorage
+from neat_improved.rl.actor_critic.utils import clip_action, explained_variance
+from neat_improved.rl.episodes import EpisodeStats, EpisodeTracker
+from neat_improved.rl.profiling import ProfiledEnv
 from neat_improved.rl.reporters import BaseRLReporter
+from neat_improved.rl.vec_env import PipelinedVecEnv, SharedMemoryVecEnv
 from neat_improved.trainer import BaseTrainer
 
 
+def _in_subprocesses(vec_envs: VecEnv) -> bool:
+    if isinstance(vec_envs, PipelinedVecEnv):
+        return all(map(_in_subprocesses, vec_envs.groups))
+    return isinstance(vec_envs, (SubprocVecEnv, SharedMemoryVecEnv))
+
+
 class A2CTrainer(BaseTrainer):
     def __init__(
             self,
@@ -27,6 +37,7 @@ class A2CTrainer(BaseTrainer):
             alpha: float = 0.99,
             max_grad_norm: float = 0.5,
             gamma: float = 0.99,
+            gae_lambda: float = 1.0,
             value_loss_coef: float = 0.5,
             entropy_coef: float = 0.01,
             log_interval: int = 10000,
@@ -34,8 +45,14 @@ class A2CTrainer(BaseTrainer):
             use_gpu: bool = True,
             critic_loss_func: Callable = F.mse_loss,
             reporters: Optional[Sequence[BaseRLReporter]] = None,
+            episode_window: int = 100,
+            profile_dir: Optional[Path] = None,
+            profile_updates: Collection[int] = (),
+            profile_interval_s: float = 0.005,
     ):
         super(A2CTrainer, self).__init__()
+        if profile_updates and profile_dir is None:
+            raise ValueError('Profiling requires a directory for the profile')
 
         self.device = 'cuda' if use_gpu else 'cpu'
         self.policy = policy.to(self.device)
@@ -47,6 +64,7 @@ class A2CTrainer(BaseTrainer):
 
         self.max_grad_norm = max_grad_norm
         self.gamma = gamma
+        self.gae_lambda = gae_lambda
         self.normalize_advantage = normalize_advantage
 
         self.optimizer = optim.RMSprop(
@@ -70,6 +88,34 @@ class A2CTrainer(BaseTrainer):
         self.n_steps = n_steps
         self.mini_batch = self.n_steps * self.n_envs
         self._num_frames = 0
+        # fitness is the mean return of the last `episode_window` episodes
+        self.episodes = EpisodeTracker(self.n_envs, episode_window)
+
+        if isinstance(self.action_space, Box):
+            action_shape, action_dtype = self.action_space.shape, torch.float32
+        else:
+            action_shape, action_dtype = (1,), torch.long
+        self.storage = RolloutStorage(
+            n_steps=self.n_steps,
+            n_envs=self.n_envs,
+            obs_shape=self.vec_envs.observation_space.shape,
+            action_shape=action_shape,
+            action_dtype=action_dtype,
+            device=self.device,
+        )
+
+        # the selected updates are sampled in the trainer and, if their environments are
+        # wrapped with `ProfiledEnv`, in the subprocesses of the vectorized environment
+        self.profile_dir = profile_dir
+        self.profile_updates = profile_updates
+        self._profiler = SamplingProfiler(profile_interval_s) if profile_updates else None
+        self._profile = MergedProfile()
+        self._profiling = False
+        self._profile_children = (
+            bool(profile_updates)
+            and _in_subprocesses(vec_envs)
+            and all(vec_envs.env_is_wrapped(ProfiledEnv))
+        )
 
     def _update_learn_progress_remaining(self, total_frames: int):
         self._current_learn_progress_remaining = 1. - float(self._num_frames) / float(total_frames)
@@ -81,26 +127,23 @@ class A2CTrainer(BaseTrainer):
         start_time = time()
         iter_ = count()
 
-        state = self.vec_envs.reset()
-        fitness_scores = [0] * self.vec_envs.num_envs
+        self.storage.reset(self.vec_envs.reset())
 
-        fitness = 0.0
         for update in iter_:
-            if stop_time and (time() - start_time) >= stop_time:
+            if self._should_stop(start_time, num_frames, stop_time):
                 break
 
-            if self._num_frames and (self._num_frames >= num_frames):
-                break
+            if self._profiler is not None:
+                self._update_profiling(update in self.profile_updates)
 
             (
                 entropy,
                 actor_loss,
                 critic_loss,
                 policy_loss,
-                episode_end_fitness_scores,
                 values,
                 returns,
-            ) = self.update(state, fitness_scores)
+            ) = self.update()
             n_seconds = time() - start_time
 
             if stop_time and not num_frames:
@@ -109,92 +152,86 @@ class A2CTrainer(BaseTrainer):
                 )
             self._update_learn_progress_remaining(total_frames=num_frames)
 
-            if episode_end_fitness_scores:
-                fitness = np.array(episode_end_fitness_scores).mean()
-
+            episodes, total_frames = self._stats()
             self._call_reporters(
                 'on_update_end',
                 iteration=update,
-                fitness=fitness,
+                fitness=episodes.mean_return,
+                min_fitness=episodes.min_return,
+                max_fitness=episodes.max_return,
+                num_episodes=episodes.num_episodes,
                 policy_loss=policy_loss.item(),
-                num_frames=self._num_frames,
+                num_frames=total_frames,
             )
 
-            # Calculate the fps (frame per second)
-            fps = int((update * self.mini_batch) / n_seconds)
-
             if (update % self.log_interval) == 0 or update == 1:
-                ev = explained_variance(values, returns)
-
-                total_num_steps = (update + 1) * self.n_envs * self.n_steps
-                print(f"Updates: {update}, total env steps: {total_num_steps}, fps: {fps}")
-                print(f"Entropy: {entropy:.4f}, policy loss: {policy_loss:.4f}")
-                print(f"Explained variance: {float(ev):.4f}")
-                print(f"Fitness: {fitness}")
-                print(f"Optimizer lr: {self.optimizer.param_groups[0]['lr']}")
-                print("---")
-
-    def update(self, state, fitness_scores):
-        buffer = defaultdict(list)
-        entropy = 0.0
-        episode_end_fitness_scores = []
-
-        n = 0
-        for _ in range(self.n_steps):
-            state = torch.tensor(state, dtype=torch.float32, device=self.device)
-            action, critic_values, action_log_probs, dist_entropy = self.policy(state)
-            action = action.cpu().numpy()
-
-            # Clip the actions to avoid out of bound error
-            clipped_action = action
-            if isinstance(self.action_space, Box):
-                clipped_action = np.clip(action, self.action_space.low, self.action_space.high)
-            else:
-                clipped_action = clipped_action.flatten()
-
-            # take action in env and look the results
-            state, reward, done, infos = self.vec_envs.step(clipped_action)
-
-            entropy += dist_entropy.sum()
-            n += len(dist_entropy)
-
-            for i, (r, d) in enumerate(zip(reward, done)):
-                if not d:
-                    fitness_scores[i] += r
-                else:
-                    episode_end_fitness_scores.append(fitness_scores[i])
-                    fitness_scores[i] = 0.0
-
-            self._num_frames += self.vec_envs.num_envs
-
-            buffer['log_probs'].append(action_log_probs)
-            buffer['values'].append(critic_values)
-            buffer['rewards'].append(
-                torch.tensor(
-                    reward,
-                    dtype=torch.float,
-                    device=self.device,
-                ).unsqueeze(1)
-            )
-            buffer['masks'].append(
-                torch.tensor(
-                    1 - done,
-                    device=self.device,
-                ).unsqueeze(1)
-            )
+                # Calculate the fps (frame per second)
+                fps = int(total_frames / n_seconds)
+                self._log(
+                    update, total_frames, fps, entropy, policy_loss, values, returns, episodes
+                )
 
-        entropy /= n
-        next_state = torch.tensor(
-            state,
-            dtype=torch.float,
-            device=self.device,
+        if self._profiler is not None:
+            self._update_profiling(False)
+            if self._profile.samples.counts:
+                collapsed_path, pstats_path = self._profile.write(self.profile_dir)
+                print(f'Profile written to {collapsed_path} and {pstats_path}')
+
+    def _should_stop(
+            self, start_time: float, num_frames: Optional[int], stop_time: Optional[int]
+    ) -> bool:
+        if stop_time and (time() - start_time) >= stop_time:
+            return True
+        return bool(self._num_frames and (self._num_frames >= num_frames))
+
+    def _stats(self) -> Tuple[EpisodeStats, int]:
+        """Statistics of the last episodes and the number of frames, as reported."""
+        return self.episodes.stats(), self._num_frames
+
+    def _log(self, update, total_frames, fps, entropy, policy_loss, values, returns, episodes):
+        ev = explained_variance(values, returns)
+
+        print(f"Updates: {update}, total env steps: {total_frames}, fps: {fps}")
+        print(f"Entropy: {entropy:.4f}, policy loss: {policy_loss:.4f}")
+        print(f"Explained variance: {float(ev):.4f}")
+        print(
+            f"Fitness: {episodes.mean_return} (min: {episodes.min_return}, "
+            f"max: {episodes.max_return}, episodes: {episodes.num_episodes})"
         )
-        next_value = self.policy.get_critic_values(next_state)
-        returns = self.compute_returns(next_value, buffer['rewards'], buffer['masks'])
-
-        log_probs = torch.cat(buffer['log_probs'])
-        returns = torch.cat(returns).detach()
-        values = torch.cat(buffer['values'])
+        print(f"Optimizer lr: {self.optimizer.param_groups[0]['lr']}")
+        print("---")
+
+    def _update_profiling(self, profiled: bool):
+        # profilers keep running over consecutive profiled updates, so children are only
+        # messaged when profiling starts or stops
+        if profiled and not self._profiling:
+            self._profiler.start()
+            if self._profile_children:
+                self.vec_envs.env_method('start_profiling', self._profiler.interval_s)
+        elif not profiled and self._profiling:
+            self._profile.add('trainer', self._profiler.stop())
+            if self._profile_children:
+                for samples in self.vec_envs.env_method('stop_profiling'):
+                    self._profile.add('env', samples)
+
+        self._profiling = profiled
+
+    def update(self):
+        storage = self.storage
+
+        # actions are sampled without building a graph, log probabilities and values are
+        # recomputed for the whole rollout at once below
+        with torch.no_grad():
+            self._rollout()
+            storage.values[-1].copy_(self.policy.get_critic_values(storage.observations[-1]))
+        storage.compute_returns(self.gamma, self.gae_lambda)
+
+        values, log_probs, entropy = self.policy.evaluate_actions(
+            storage.observations[:-1].flatten(0, 1),
+            storage.actions.flatten(0, 1),
+        )
+        entropy = entropy.mean()
+        returns = storage.returns[:-1].flatten(0, 1)
 
         advantage = returns - values
 
@@ -208,22 +245,41 @@ class A2CTrainer(BaseTrainer):
 
         self.optimizer.zero_grad()
         loss.backward()
+        self._reduce_gradients()
         nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
         self.optimizer.step()
 
         if self.use_scheduler:
             self.lr_scheduler.step()
 
-        return entropy, actor_loss, critic_loss, loss, episode_end_fitness_scores, values, returns
-
-    def compute_returns(self, next_value, rewards, masks):
-        r = next_value
-        returns = []
-        for step in reversed(range(len(rewards))):
-            r = rewards[step] + self.gamma * r * masks[step]
-            returns.insert(0, r)
-
-        return returns
+        storage.after_update()
+        return entropy, actor_loss, critic_loss, loss, values, returns
+
+    def _reduce_gradients(self):
+        pass
+
+    def _rollout(self):
+        if isinstance(self.vec_envs, PipelinedVecEnv):
+            groups = list(zip(self.vec_envs.groups, self.vec_envs.slices))
+        else:
+            groups = [(self.vec_envs, slice(None))]
+
+        # each group steps in the background while actions are chosen for the next one, its
+        # actions and values wait in `in_flight` for the step results
+        in_flight = [None] * len(groups)
+        for step in range(self.n_steps + 1):
+            for i, (group, envs) in enumerate(groups):
+                if step:
+                    state, reward, done, infos = group.step_wait()
+                    action, critic_values = in_flight[i]
+                    self.storage.insert(step - 1, action, critic_values, state, reward, done, envs)
+                    self.episodes.step(reward, done, envs)
+                    self._num_frames += group.num_envs
+
+                if step < self.n_steps:
+                    action, critic_values, _, _ = self.policy(self.storage.observations[step, envs])
+                    group.step_async(clip_action(action, self.action_space))
+                    in_flight[i] = action, critic_values
 
     def _call_reporters(self, stage: str, *args, **kwargs):
         for reporter in self.reporters:
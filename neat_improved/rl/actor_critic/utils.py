@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+from gym.spaces import Box
 
 
 def init(module, weight_init, bias_init, gain: float = 1.0):
@@ -27,3 +28,13 @@ def explained_variance(ypred: torch.Tensor, y: torch.Tensor):
 
 def safemean(xs):
     return np.nan if len(xs) == 0 else np.mean(xs)
+
+
+def clip_action(action: torch.Tensor, action_space) -> np.ndarray:
+    """Actions of the policy as accepted by a `VecEnv`."""
+    action = action.cpu().numpy()
+
+    # Clip the actions to avoid out of bound error
+    if isinstance(action_space, Box):
+        return np.clip(action, action_space.low, action_space.high)
+    return action.flatten()
@@ -0,0 +1,61 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class EpisodeStats(NamedTuple):
+    num_episodes: int  # completed since the start of training
+    mean_return: float  # over the window of the last completed episodes
+    min_return: float
+    max_return: float
+    mean_length: float
+
+
+class EpisodeTracker:
+    """
+    Returns and lengths of the episodes of vectorized environments, updated with array
+    operations on all environments at once. The last `window` completed episodes are kept in
+    a ring buffer, statistics are zero until an episode completes.
+    """
+
+    def __init__(self, n_envs: int, window: int = 100):
+        self.window = window
+        self.returns = np.zeros(n_envs)  # of the running episodes
+        self.lengths = np.zeros(n_envs, dtype=np.int64)
+        self.num_episodes = 0
+        self._window_returns = np.zeros(window)
+        self._window_lengths = np.zeros(window, dtype=np.int64)
+
+    def step(self, rewards: np.ndarray, dones: np.ndarray, envs: slice = slice(None)):
+        """Records a step of the environments `envs`."""
+        returns, lengths = self.returns[envs], self.lengths[envs]
+        returns += rewards
+        lengths += 1
+        if dones.any():
+            finished = np.flatnonzero(dones)
+            self._record(returns[finished], lengths[finished])
+            returns[finished] = 0.0
+            lengths[finished] = 0
+
+    def _record(self, returns: np.ndarray, lengths: np.ndarray):
+        window = self.window
+        # episodes pushed out of the window by the same call are never written
+        skipped = max(len(returns) - window, 0)
+        indices = (self.num_episodes + np.arange(skipped, len(returns))) % window
+        self._window_returns[indices] = returns[skipped:]
+        self._window_lengths[indices] = lengths[skipped:]
+        self.num_episodes += len(returns)
+
+    def stats(self) -> EpisodeStats:
+        size = min(self.num_episodes, self.window)
+        if not size:
+            return EpisodeStats(0, 0.0, 0.0, 0.0, 0.0)
+
+        returns = self._window_returns[:size]
+        return EpisodeStats(
+            num_episodes=self.num_episodes,
+            mean_return=float(returns.mean()),
+            min_return=float(returns.min()),
+            max_return=float(returns.max()),
+            mean_length=float(self._window_lengths[:size].mean()),
+        )
@@ -0,0 +1,26 @@
+from typing import Optional
+
+import gym
+
+from neat_improved.profiling import Samples, get_profiler
+
+
+class ProfiledEnv(gym.Wrapper):
+    """
+    Lets `A2CTrainer` profile the process stepping the environment, e.g. a `SubprocVecEnv`
+    child, through `VecEnv.env_method`. The profiler samples the thread of the first call.
+    """
+
+    def __init__(self, env: gym.Env):
+        super().__init__(env)
+        self._interval_s: Optional[float] = None
+
+    def start_profiling(self, interval_s: float):
+        self._interval_s = interval_s
+        get_profiler(interval_s).start()
+
+    def stop_profiling(self) -> Samples:
+        if self._interval_s is None:
+            return Samples.empty()
+
+        return get_profiler(self._interval_s).stop()
@@ -5,7 +5,16 @@ from time import time
 from typing import Iterator
 
 _NAME = 'actor_critic'
-_FIELDS = 'iteration', 'num_frames', 'time_in_s', 'fitness', 'loss'
+_FIELDS = (
+    'iteration',
+    'num_frames',
+    'time_in_s',
+    'fitness',
+    'min_fitness',
+    'max_fitness',
+    'num_episodes',
+    'loss',
+)
 
 
 class BaseRLReporter:
@@ -40,6 +49,9 @@ class FileRLReporter(BaseRLReporter):
         num_frames,
         fitness,
         policy_loss,
+        min_fitness=None,
+        max_fitness=None,
+        num_episodes=None,
         **kwargs,
     ):
         if self.start_time is None:
@@ -51,6 +63,9 @@ class FileRLReporter(BaseRLReporter):
                     'iteration': iteration,
                     'num_frames': num_frames,
                     'fitness': fitness,
+                    'min_fitness': min_fitness,
+                    'max_fitness': max_fitness,
+                    'num_episodes': num_episodes,
                     'loss': policy_loss,
                     'time_in_s': time() - self.start_time,
                 }
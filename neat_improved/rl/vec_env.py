@@ -0,0 +1,306 @@
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import gym
+import numpy as np
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper, VecEnvIndices
+
+
+def _shapes(num_envs: int, observation_space, action_space) -> List[Tuple[Tuple, np.dtype]]:
+    # observations, actions, rewards and dones
+    return [
+        ((num_envs, *observation_space.shape), np.dtype(observation_space.dtype)),
+        ((num_envs, *action_space.shape), np.dtype(action_space.dtype)),
+        ((num_envs,), np.dtype(np.float32)),
+        ((num_envs,), np.dtype(bool)),
+    ]
+
+
+def _attach(
+        names: Sequence[Optional[str]], shapes: List[Tuple[Tuple, np.dtype]]
+) -> Tuple[List[SharedMemory], List[np.ndarray]]:
+    """Creates (for missing names) or attaches the shared memory blocks and arrays over them."""
+    memories, arrays = [], []
+    for name, (shape, dtype) in zip(names, shapes):
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        memory = SharedMemory(name=name, create=name is None, size=size)
+        memories.append(memory)
+        arrays.append(np.ndarray(shape, dtype, buffer=memory.buf))
+
+    return memories, arrays
+
+
+def _worker(remote: Connection, parent_remote: Connection, env_fns: CloudpickleWrapper, start: int):
+    parent_remote.close()
+    envs = [env_fn() for env_fn in env_fns.var]
+    stop = start + len(envs)
+    remote.send((envs[0].observation_space, envs[0].action_space))
+    names, shapes = remote.recv()
+    memories, arrays = _attach(names, shapes)
+    observations, actions, rewards, dones = [array[start:stop] for array in arrays]
+    del arrays
+
+    try:
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                infos = []
+                for i, env in enumerate(envs):
+                    observation, rewards[i], dones[i], info = env.step(actions[i].copy())
+                    if dones[i]:
+                        # the vectorized environment resets automatically
+                        info['terminal_observation'] = observation
+                        observation = env.reset()
+                    observations[i] = observation
+                    infos.append(info)
+                # infos are usually empty, which is sent as `None`
+                remote.send(infos if any(infos) else None)
+            elif command == 'reset':
+                for i, env in enumerate(envs):
+                    observations[i] = env.reset()
+                remote.send(None)
+            elif command == 'env_method':
+                indices, method_name, args, kwargs = data
+                remote.send([getattr(envs[i], method_name)(*args, **kwargs) for i in indices])
+            elif command == 'get_attr':
+                indices, attr_name = data
+                remote.send([getattr(envs[i], attr_name) for i in indices])
+            elif command == 'set_attr':
+                indices, attr_name, value = data
+                remote.send([setattr(envs[i], attr_name, value) for i in indices])
+            elif command == 'is_wrapped':
+                indices, wrapper_class = data
+                remote.send([is_wrapped(envs[i], wrapper_class) for i in indices])
+            elif command == 'seed':
+                seeds = [None if data is None else data + start + i for i in range(len(envs))]
+                remote.send([env.seed(seed) for env, seed in zip(envs, seeds)])
+            elif command == 'close':
+                break
+            else:
+                raise NotImplementedError(f'Unknown command: {command}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for env in envs:
+            env.close()
+        # the arrays have to be released before their memory
+        del observations, actions, rewards, dones
+        for memory in memories:
+            memory.close()
+        remote.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Steps environments in `num_workers` subprocesses, each running several environments, which
+    write observations, rewards and dones into arrays in shared memory and read their actions
+    from one. Only a short command and the (usually empty) infos go through the pipe of a
+    worker, while `SubprocVecEnv` pickles every step of every environment through a pipe of its
+    own. Observation and action spaces have to be `Box` or `Discrete`.
+    """
+
+    def __init__(
+            self,
+            env_fns: List[Callable[[], gym.Env]],
+            num_workers: Optional[int] = None,
+            start_method: Optional[str] = None,
+    ):
+        self.waiting = False
+        self.closed = False
+        num_envs = len(env_fns)
+        num_workers = min(num_workers or multiprocessing.cpu_count(), num_envs)
+
+        if start_method is None:
+            # like `SubprocVecEnv`, fork is not thread safe
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        # workers attach the shared memory created later on, they have to share the resource
+        # tracker of this process, or theirs would unlink the memory when they exit
+        resource_tracker.ensure_running()
+
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int).tolist()
+        self._slices = [slice(start, stop) for start, stop in zip(bounds, bounds[1:])]
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for work_remote, remote, envs in zip(self.work_remotes, self.remotes, self._slices):
+            args = (work_remote, remote, CloudpickleWrapper(env_fns[envs]), envs.start)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        observation_space, action_space = self.remotes[0].recv()
+        for remote in self.remotes[1:]:
+            remote.recv()
+
+        shapes = _shapes(num_envs, observation_space, action_space)
+        self._memories, arrays = _attach([None] * len(shapes), shapes)
+        self._observations, self._actions, self._rewards, self._dones = arrays
+        names = [memory.name for memory in self._memories]
+        for remote in self.remotes:
+            remote.send((names, shapes))
+
+        super().__init__(num_envs, observation_space, action_space)
+
+    def step_async(self, actions: np.ndarray):
+        self._actions[:] = np.reshape(actions, self._actions.shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = []
+        for remote, envs in zip(self.remotes, self._slices):
+            worker_infos = remote.recv()
+            infos.extend(worker_infos or ({} for _ in range(envs.stop - envs.start)))
+        self.waiting = False
+        # the shared arrays are overwritten by the next step
+        return self._observations.copy(), self._rewards.copy(), self._dones.copy(), infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self._observations.copy()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+
+        del self._observations, self._actions, self._rewards, self._dones
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
+        self.closed = True
+
+    def seed(self, seed: Optional[int] = None) -> List[Optional[int]]:
+        for remote in self.remotes:
+            remote.send(('seed', seed))
+        return [env_seed for remote in self.remotes for env_seed in remote.recv()]
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        return self.env_method('render', 'rgb_array')
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return self._call('get_attr', indices, attr_name)
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None):
+        self._call('set_attr', indices, attr_name, value)
+
+    def env_method(
+            self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs
+    ) -> List[Any]:
+        return self._call('env_method', indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices: VecEnvIndices = None) -> List[bool]:
+        return self._call('is_wrapped', indices, wrapper_class)
+
+    def _call(self, command: str, indices: VecEnvIndices, *args) -> List[Any]:
+        """Runs a command on the environments of `indices`, results are in the same order."""
+        by_worker: Dict[int, List[int]] = {}
+        for index in self._get_indices(indices):
+            worker = next(i for i, envs in enumerate(self._slices) if index < envs.stop)
+            by_worker.setdefault(worker, []).append(index)
+
+        for worker, worker_indices in by_worker.items():
+            local_indices = [index - self._slices[worker].start for index in worker_indices]
+            self.remotes[worker].send((command, (local_indices, *args)))
+
+        results = {}
+        for worker, worker_indices in by_worker.items():
+            results.update(zip(worker_indices, self.remotes[worker].recv()))
+        return [results[index] for index in self._get_indices(indices)]
+
+
+class PipelinedVecEnv(VecEnv):
+    """
+    Groups of vectorized environments, e.g. `SubprocVecEnv`s, that `A2CTrainer` steps one after
+    another: while a group steps in its subprocesses, actions are chosen for the next one. As a
+    `VecEnv` the groups behave like their concatenation.
+    """
+
+    def __init__(self, groups: Sequence[VecEnv]):
+        self.groups = list(groups)
+        bounds = np.cumsum([0] + [group.num_envs for group in self.groups]).tolist()
+        self.slices = [slice(start, stop) for start, stop in zip(bounds, bounds[1:])]
+        super().__init__(bounds[-1], self.groups[0].observation_space, self.groups[0].action_space)
+
+    def step_async(self, actions: np.ndarray):
+        for group, envs in zip(self.groups, self.slices):
+            group.step_async(actions[envs])
+
+    def step_wait(self):
+        observations, rewards, dones, infos = zip(*(group.step_wait() for group in self.groups))
+        return (
+            np.concatenate(observations),
+            np.concatenate(rewards),
+            np.concatenate(dones),
+            [info for group_infos in infos for info in group_infos],
+        )
+
+    def reset(self):
+        return np.concatenate([group.reset() for group in self.groups])
+
+    def close(self):
+        for group in self.groups:
+            group.close()
+
+    def seed(self, seed: Optional[int] = None) -> List[Optional[int]]:
+        return [
+            env_seed
+            for group, envs in zip(self.groups, self.slices)
+            for env_seed in group.seed(None if seed is None else seed + envs.start)
+        ]
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        return [image for group in self.groups for image in group.get_images()]
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return self._call(indices, lambda group, local: group.get_attr(attr_name, local))
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None):
+        def set_group_attr(group: VecEnv, local_indices: List[int]) -> List[None]:
+            group.set_attr(attr_name, value, local_indices)
+            return [None] * len(local_indices)
+
+        self._call(indices, set_group_attr)
+
+    def env_method(
+            self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs
+    ) -> List[Any]:
+        return self._call(
+            indices,
+            lambda group, local: group.env_method(
+                method_name, *method_args, indices=local, **method_kwargs
+            ),
+        )
+
+    def env_is_wrapped(self, wrapper_class, indices: VecEnvIndices = None) -> List[bool]:
+        return self._call(indices, lambda group, local: group.env_is_wrapped(wrapper_class, local))
+
+    def _call(self, indices: VecEnvIndices, call: Callable[[VecEnv, List[int]], List]) -> List:
+        """Calls the groups with the local indices of their environments in `indices`."""
+        results = {}
+        indices = list(self._get_indices(indices))
+        for group, envs in zip(self.groups, self.slices):
+            group_indices = [index for index in indices if envs.start <= index < envs.stop]
+            if group_indices:
+                local_indices = [index - envs.start for index in group_indices]
+                results.update(zip(group_indices, call(group, local_indices)))
+
+        return [results.get(index) for index in indices]